@@ -0,0 +1,296 @@
+import multiprocessing, queue, threading, time, os, contextlib
+from multiprocessing import shared_memory
+import numpy
+import style
+import metrics
+import config_store
+
+# ===================================================================================
+# Analysis runs in a supervised child process, so that a long clustering never stalls the UI
+# and a native crash (OpenCV / scikit-learn) never takes the whole station down.
+#   frames  : parent -> child through a ring of shared-memory slots (never pickled)
+#   jobs    : parent -> child, small tuples on a queue (slot, shape, file names)
+#   results : child -> parent, the output config (a few ROI colors) on a queue
+# ===================================================================================
+
+def _child_main(memory_name, slots, slot_bytes, settings, jobs, results):
+    # [NOTE EXPLANATION] Settings changed at runtime in the parent (e.g. file paths of the soak-test) hold in the child too.
+    for name, value in settings.items():
+        setattr(style, name, value)
+
+    # [NOTE EXPLANATION] Child process: heavy imports happen here, never in the parent's job path.
+    import recipe_library
+    import profiling
+    import image_processing as img_proc
+
+    memory = shared_memory.SharedMemory(name=memory_name)
+    loaded_version = None
+    recipe_masks = {}
+    results.put(('ready', os.getpid(), None))
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            job_id, slot, shape, dtype, reference_jsonfile, outputpath, legacy_size, recipe_name, profile, quick, version = job
+            try:
+                frame = numpy.ndarray(shape, numpy.dtype(dtype), buffer=memory.buf, offset=slot*slot_bytes)
+
+                # [NOTE EXPLANATION] Calibration is re-read (and recipe masks rebuilt) only when the parent saw the files change, else all comes from memory.
+                if version != loaded_version or version is None:
+                    config_store.invalidate()
+                    recipe_masks = {}
+                    loaded_version = version
+                masks = None
+                if recipe_name is not None:
+                    key = (recipe_name, min(shape[:2]))
+                    if key not in recipe_masks:
+                        config = config_store.read_json(reference_jsonfile)
+                        recipe_masks[key] = recipe_library.load_recipe(recipe_name).masks_for(config, min(shape[:2]))
+                    masks = recipe_masks[key]
+                with profiling.capture('analysis') if profile == True else contextlib.nullcontext():
+                    output_config = img_proc.inspect_frame(frame, reference_jsonfile, None, outputpath, masks, legacy_size, quick)
+                del frame
+                results.put((job_id, True, output_config))
+            except Exception as err:
+                results.put((job_id, False, '{}: {}'.format(type(err).__name__, err)))
+    finally:
+        memory.close()
+
+class analysis_worker:
+    '''
+    Definition:
+    -----------
+    Class supervises the analysis child process and hands frames to it through shared memory.\n
+    Frames are copied once into a free slot of the ring; the child reads them in place.\n
+    A child that crashes or overruns `timeout` is restarted transparently, and the job is run again (up to `style.ANALYSIS_WORKER_RETRIES` times).\n
+    Hand-over cost is recorded as 'analysis_handoff', the full round-trip as 'inspection', restarts as 'analysis_worker_restarts' (see `metrics.py`).\n
+
+    Attributes:
+    -----------
+    `slots` : Int
+        number of frames that can be in flight at once.\n
+
+    `slot_bytes` : Int
+        size of every slot, default the largest frame of `style.CAPTURE_MODES`.\n
+
+    `timeout` : Float
+        longest time a job may take (in seconds) before the child is considered hung.\n
+
+    '''
+    def __init__(self, slots=style.ANALYSIS_RING_SLOTS, slot_bytes=None, timeout=style.ANALYSIS_WORKER_TIMEOUT):
+        self.slots = slots
+        self.slot_bytes = max(width*height*3 for width, height in style.CAPTURE_MODES) if slot_bytes is None else slot_bytes
+        self.timeout = timeout
+        self.restarts = 0
+
+        self._context = multiprocessing.get_context('spawn')
+        self._memory = shared_memory.SharedMemory(create=True, size=self.slots*self.slot_bytes)
+        self._free_slots = list(range(self.slots))
+        self._jobs = {}
+        self._done = {}
+        self._discarded = set()
+        self._next_id = 0
+        # [NOTE EXPLANATION] Supervisor is shared by the UI thread (submit/poll) and the conveyor scheduler (inspect), the lock guards jobs, slots and the child.
+        self._lock = threading.RLock()
+        self._process = None
+        self._job_queue = None
+        self._result_queue = None
+
+    def start(self):
+        '''
+        Definition:
+        -----------
+        Starts the child process and waits until it has loaded the image-processing libraries.\n
+        '''
+        self._job_queue = self._context.Queue()
+        self._result_queue = self._context.Queue()
+        settings = {name: value for name, value in vars(style).items() if name.isupper()}
+        self._process = self._context.Process(target=_child_main, name='analysis_worker', daemon=True,
+                                              args=(self._memory.name, self.slots, self.slot_bytes, settings, self._job_queue, self._result_queue))
+        self._process.start()
+        try:
+            message = self._result_queue.get(timeout=self.timeout)
+        except queue.Empty:
+            message = None
+        if message is None or message[0] != 'ready':
+            raise RuntimeError('analysis worker did not start')
+
+    def stop(self):
+        '''
+        Definition:
+        -----------
+        Stops the child process and frees the shared memory.\n
+        '''
+        with self._lock:
+            if self._process is not None:
+                if self._process.is_alive():
+                    self._job_queue.put(None)
+                    self._process.join(timeout=2)
+                if self._process.is_alive():
+                    self._process.kill()
+                self._process = None
+        self._memory.close()
+        self._memory.unlink()
+
+    def submit(self, frame, reference_jsonfile, outputpath, legacy_size=None, recipe_name=None, profile=False, quick=False):
+        '''
+        Definition:
+        -----------
+        Copies a frame into a free slot and queues its inspection (see `image_processing.inspect_frame`), never waits for the result.\n
+
+        Attributes:
+        -----------
+        `frame` : numpy array
+            B-G-R camera frame (native resolution).\n
+
+        `reference_jsonfile`, `outputpath`, `legacy_size` :
+            see `image_processing.compare_colors`.\n
+
+        `recipe_name` : String
+            active recipe, whose compiled masks the child uses (optional).\n
+
+        `profile` : bool
+            True profiles the analysis in the child (see `profiling.py`).\n
+
+        `quick` : bool
+            True uses the cheap color estimator instead of the clustering (see `image_processing.inspect_frame`).\n
+
+        Returns:
+        --------
+        `job_id` : Int
+            to be passed to `poll`
+        '''
+        self._collect()
+        frame = numpy.ascontiguousarray(frame)
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError('frame of {} bytes does not fit a slot of {} bytes'.format(frame.nbytes, self.slot_bytes))
+        with self._lock:
+            if len(self._free_slots) == 0:
+                raise RuntimeError('all {} analysis slots are in use'.format(self.slots))
+            slot = self._free_slots.pop(0)
+            job_id = self._next_id
+            self._next_id = self._next_id + 1
+
+        with metrics.timed('analysis_handoff'):
+            target = numpy.ndarray(frame.shape, frame.dtype, buffer=self._memory.buf, offset=slot*self.slot_bytes)
+            target[...] = frame
+            del target
+            job = (job_id, slot, frame.shape, frame.dtype.str, reference_jsonfile, outputpath, legacy_size, recipe_name, profile, quick,
+                   self._version(reference_jsonfile, recipe_name))
+            # [NOTE EXPLANATION] Job is registered before it is queued, so that a result collected by another thread at once is never dropped.
+            with self._lock:
+                self._jobs[job_id] = {'job': job, 'started': time.monotonic(), 'attempts': 1}
+                self._job_queue.put(job)
+        return job_id
+
+    def _version(self, reference_jsonfile, recipe_name):
+        # [NOTE EXPLANATION] File signatures as the parent's config-store knows them (from memory, hot reload as usual), the child reloads when they change.
+        try:
+            for filename in (reference_jsonfile, style.APP_CONFIG_JSON):
+                config_store.read_json(filename)
+        except (OSError, ValueError):
+            return None
+        return (config_store.version(reference_jsonfile), config_store.version(style.APP_CONFIG_JSON), recipe_name)
+
+    def poll(self, job_id):
+        '''
+        Definition:
+        -----------
+        Checks on a job without blocking; restarts a crashed or hung child and runs its jobs again.\n
+
+        Returns:
+        --------
+        `result` : tuple or None
+            None while the job is running, else (`ok` [bool], `output_config` [dict] or error message [String])
+        '''
+        with self._lock:
+            self._collect()
+            if job_id in self._done:
+                return self._done.pop(job_id)
+
+            entry = self._jobs[job_id]
+            crashed = self._process is None or self._process.is_alive() == False
+            hung = time.monotonic() - entry['started'] > self.timeout
+            if crashed or hung:
+                self._restart()
+            return self._done.pop(job_id, None)
+
+    def discard(self, job_id):
+        '''
+        Definition:
+        -----------
+        Drops a job nobody waits for anymore (e.g. the page was closed), its slot is freed once the child is done with it.\n
+        '''
+        with self._lock:
+            self._discarded.add(job_id)
+            self._collect()
+
+    def inspect(self, frame, reference_jsonfile, output_jsonfile, outputpath, legacy_size=None, recipe_name=None, quick=False):
+        '''
+        Definition:
+        -----------
+        Blocking variant of `submit` + `poll`, for callers without an event-loop. Output is written to `output_jsonfile` (unless None).\n
+        '''
+        with metrics.timed('inspection'):
+            job_id = self.submit(frame, reference_jsonfile, outputpath, legacy_size, recipe_name, quick=quick)
+            while True:
+                result = self.poll(job_id)
+                if result is not None: break
+                time.sleep(0.001)
+        return self.finish(result, output_jsonfile)
+
+    def finish(self, result, output_jsonfile):
+        '''
+        Definition:
+        -----------
+        Writes the output config of a finished job (in the parent, so its config-store cache stays coherent), raises if the job failed.\n
+        '''
+        ok, output = result
+        if ok == False:
+            raise RuntimeError('analysis failed: ' + output)
+        if output_jsonfile is not None:
+            config_store.write_json(output_jsonfile, output)
+        return output
+
+    def _collect(self):
+        # [NOTE EXPLANATION] Move every result waiting on the queue to the finished jobs, and free their slots.
+        with self._lock:
+            while True:
+                try:
+                    job_id, ok, output = self._result_queue.get_nowait()
+                except (queue.Empty, OSError, ValueError):
+                    return
+                entry = self._jobs.pop(job_id, None)
+                if entry is None:
+                    continue
+                self._release(entry)
+                if job_id in self._discarded:
+                    self._discarded.discard(job_id)
+                    continue
+                self._done[job_id] = (ok, output)
+
+    def _release(self, entry):
+        with self._lock:
+            self._free_slots.append(entry['job'][1])
+
+    def _restart(self):
+        with self._lock:
+            metrics.increment('analysis_worker_restarts')
+            self.restarts = self.restarts + 1
+            if self._process is not None:
+                if self._process.is_alive(): self._process.kill()
+                self._process.join(timeout=2)
+            self.start()
+
+            # [NOTE EXPLANATION] Frames are still in their slots, so unfinished jobs are simply queued again.
+            for job_id, entry in list(self._jobs.items()):
+                if entry['attempts'] > style.ANALYSIS_WORKER_RETRIES:
+                    self._jobs.pop(job_id)
+                    self._release(entry)
+                    if job_id in self._discarded: self._discarded.discard(job_id)
+                    else: self._done[job_id] = (False, 'analysis worker failed {} times'.format(entry['attempts']))
+                    continue
+                entry['attempts'] = entry['attempts'] + 1
+                entry['started'] = time.monotonic()
+                self._job_queue.put(entry['job'])
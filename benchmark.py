@@ -0,0 +1,396 @@
+#! /usr/bin/python3
+
+# ===================================================================================
+# Benchmarks of the image-processing pipeline, run on synthetic data (no camera or UI needed).
+#   python3 benchmark.py roi-scaling --rois 32
+#   python3 benchmark.py lighting [--video footage.avi --config config.json --app-config app_config.json]
+#   python3 benchmark.py worker-handoff --width 1280 --height 720
+#   python3 benchmark.py roi-shapes --size 768
+#   python3 benchmark.py palette --rois 8
+#   python3 benchmark.py presence [--video conveyor.avi --config config.json --expected 12]
+# ===================================================================================
+
+import argparse, os, time, math, tempfile
+import numpy
+import cv2 as cv
+import style
+import config_store
+import image_processing as img_proc
+import simulation
+import metrics
+import analysis_worker
+import presence_trigger
+
+def synthetic_config(roi_count, frame_size):
+    '''
+    Definition:
+    -----------
+    Function creates a config with `roi_count` quadrilateral ROIs laid out on a grid over a square frame.\n
+    '''
+    columns = int(math.ceil(math.sqrt(roi_count)))
+    cell = frame_size // columns
+    config = {}
+    for index in range(roi_count):
+        x, y = (index % columns)*cell, (index // columns)*cell
+        config['ROI' + str(index + 1)] = {'coordinates': [  [x + cell//8, y + cell//8], [x + 7*cell//8, y + cell//6],
+                                                            [x + 6*cell//7, y + 7*cell//8], [x + cell//7, y + 6*cell//7]]}
+    return config
+
+def synthetic_frame(frame_size, seed=0):
+    camera = simulation.simulated_camera(width=frame_size, height=frame_size, seed=seed)
+    return camera.read()[1]
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def roi_scaling(arguments):
+    '''
+    Definition:
+    -----------
+    Prints the scaling curve of `image_processing.analyse_ROIs`: time per inspection for 1 worker up to the core count.\n
+    '''
+    frame = synthetic_frame(arguments.size)
+    config = synthetic_config(arguments.rois, arguments.size)
+    max_workers = arguments.max_workers or os.cpu_count()
+    worker_counts = sorted(set([1] + [2**i for i in range(1, 8) if 2**i < max_workers] + [max_workers]))
+
+    print('{} ROIs, {}x{} frame, {} pool, best of {}'.format(arguments.rois, arguments.size, arguments.size, arguments.pool, arguments.repeat))
+    print('{:>8} {:>10} {:>9} {:>11}'.format('workers', 'time [s]', 'speed-up', 'efficiency'))
+    serial = None
+    for workers in worker_counts:
+        # [NOTE EXPLANATION] Warm-up run, so that pool start-up is not part of the measurement.
+        img_proc.analyse_ROIs(frame, config, workers=workers, pool_kind=arguments.pool)
+        elapsed = best_time(lambda: img_proc.analyse_ROIs(frame, config, workers=workers, pool_kind=arguments.pool), arguments.repeat)
+        serial = elapsed if serial is None else serial
+        print('{:>8} {:>10.3f} {:>9.2f} {:>10.0f}%'.format(workers, elapsed, serial/elapsed, 100*serial/elapsed/workers))
+
+def roi_shapes(arguments):
+    '''
+    Definition:
+    -----------
+    Compares getting the pixels of a ROI through its shape-specific path (slicing, analytic mask) with isolating it as a free polygon (mask + background passes).\n
+    Also compares the cheap mean-color estimate (`image_processing.region_mean_color`) on both paths.\n
+    '''
+    frame = synthetic_frame(arguments.size)
+    side = arguments.size//2
+    corners = [[arguments.size//4, arguments.size//4], [arguments.size//4 + side, arguments.size//4 + side]]
+    print('{}x{} ROI on a {}x{} frame, best of {}'.format(side, side, arguments.size, arguments.size, arguments.repeat))
+    print('{:>10} {:>16} {:>16} {:>16} {:>16}'.format('shape', 'isolate [ms]', 'as polygon [ms]', 'mean [ms]', 'as polygon [ms]'))
+    for shape in (img_proc.RECTANGLE, img_proc.CIRCLE, img_proc.ELLIPSE):
+        points = corners if shape != img_proc.CIRCLE else [[arguments.size//2, arguments.size//2], [arguments.size//2 + side//2, arguments.size//2]]
+        coordinates = img_proc.shape_vertices(shape, points)
+        (x, y, w, h), coordinate_list, _ = img_proc._ROI_geometry({'coordinates': coordinates})
+        cropped_img = frame[y: y+h, x: x+w]
+
+        def isolate(kind):
+            if kind == img_proc.RECTANGLE: return cropped_img.copy()
+            if kind in (img_proc.CIRCLE, img_proc.ELLIPSE): return cv.copyTo(cropped_img, img_proc.ROI_mask(coordinate_list, cropped_img.shape[:2], kind))
+            return img_proc.isolate_ROI(cropped_img, coordinate_list, None, kind)
+        timings = [best_time(lambda: isolate(shape), arguments.repeat), best_time(lambda: isolate(img_proc.POLYGON), arguments.repeat),
+                   best_time(lambda: img_proc.region_mean_color(frame, coordinates, shape), arguments.repeat),
+                   best_time(lambda: img_proc.region_mean_color(frame, coordinates), arguments.repeat)]
+        print('{:>10} {:>16.3f} {:>16.3f} {:>16.3f} {:>16.3f}'.format(shape, *[1000*timing for timing in timings]))
+
+def palette(arguments):
+    '''
+    Definition:
+    -----------
+    Compares the single dominant-color path with the palette path (see `image_processing.color_palette`):
+    clustering of all ROIs, and comparing them with their reference (one `color_error` per ROI vs one vectorised `palette_distances`).\n
+    '''
+    frame = synthetic_frame(arguments.size)
+    config = synthetic_config(arguments.rois, arguments.size)
+    references = img_proc.analyse_ROIs(frame, config, palette=True)
+    measured = img_proc.analyse_ROIs(frame, config, palette=True)
+    keys = list(config)
+
+    single = best_time(lambda: img_proc.analyse_ROIs(frame, config, palette=False), arguments.repeat)
+    with_palette = best_time(lambda: img_proc.analyse_ROIs(frame, config, palette=True), arguments.repeat)
+    color_compare = best_time(lambda: [img_proc.color_error(references[key]['mean_color'], measured[key]['mean_color']) for key in keys], arguments.repeat)
+    palette_compare = best_time(lambda: img_proc.palette_distances([references[key]['palette'] for key in keys], [measured[key]['palette'] for key in keys]), arguments.repeat)
+
+    print('{} ROIs, {}x{} frame, palettes of {} colors, best of {}'.format(arguments.rois, arguments.size, arguments.size, style.PALETTE_SIZE, arguments.repeat))
+    print('{:>12} {:>16} {:>16}'.format('', 'analysis [ms]', 'comparison [ms]'))
+    print('{:>12} {:>16.2f} {:>16.3f}'.format('single color', 1000*single, 1000*color_compare))
+    print('{:>12} {:>16.2f} {:>16.3f}'.format('palette', 1000*with_palette, 1000*palette_compare))
+    print('palette adds {:+.2f} ms per inspection ({:+.1f}%)'.format(1000*(with_palette + palette_compare - single - color_compare),
+                                                                   100*(with_palette + palette_compare - single - color_compare)/max(single + color_compare, 1e-9)))
+
+def replay_frames(video, frame_size, limit):
+    '''
+    Definition:
+    -----------
+    Function yields the frames of a recorded video, cropped and resized exactly like run-mode does.\n
+    '''
+    capture = cv.VideoCapture(video)
+    count = 0
+    while count < limit:
+        ret, frame = capture.read()
+        if ret == False: break
+        count = count + 1
+        yield cv.resize(img_proc.square_crop(frame), dsize=(frame_size, frame_size))
+    capture.release()
+
+def drifting_frames(frame_size, count):
+    '''
+    Definition:
+    -----------
+    Function yields a synthetic part under slowly drifting light: brightness from 60% to 140% with a warm/cold tint.\n
+    '''
+    base = synthetic_frame(frame_size).astype(numpy.float32)
+    for index in range(count):
+        phase = index/max(count - 1, 1)
+        brightness = 0.6 + 0.8*phase
+        tint = 0.08*math.sin(2*math.pi*phase)
+        gains = numpy.array([brightness*(1 - tint), brightness, brightness*(1 + tint)], numpy.float32)
+        yield numpy.clip(base*gains, 0, 255).astype(numpy.uint8)
+
+def lighting(arguments):
+    '''
+    Definition:
+    -----------
+    Replays footage of GOOD parts and counts false rejects with and without lighting compensation.\n
+    Also reports the cost of the compensation stage (gain estimate + LUT over the ROI pixels) per inspection.\n
+    Without `--video`, a synthetic part under drifting light is used (white patch = neutral background corner).\n
+    '''
+    if arguments.video:
+        # [NOTE EXPLANATION] Map stored ROIs (and white patch) onto the replayed frames.
+        config = img_proc.scale_config(config_store.read_json(arguments.config), arguments.size)
+        param_config = dict(config_store.read_json(arguments.app_config))
+        frames = list(replay_frames(arguments.video, arguments.size, arguments.frames))
+        if 'white_patch' not in param_config:
+            raise SystemExit('{} has no white_patch, mark one while calibrating'.format(arguments.app_config))
+        param_config['white_patch'] = dict(param_config['white_patch'], coordinates=img_proc.ROI_points(param_config['white_patch'], arguments.size))
+    else:
+        config = {  'ROI1': {'coordinates': [[arguments.size//8 + 10, arguments.size//4 + 10], [3*arguments.size//8 - 10, arguments.size//4 + 10],
+                                             [3*arguments.size//8 - 10, 3*arguments.size//4 - 10], [arguments.size//8 + 10, 3*arguments.size//4 - 10]]},
+                    'ROI2': {'coordinates': [[5*arguments.size//8 + 10, arguments.size//4 + 10], [7*arguments.size//8 - 10, arguments.size//4 + 10],
+                                             [7*arguments.size//8 - 10, 3*arguments.size//4 - 10], [5*arguments.size//8 + 10, 3*arguments.size//4 - 10]]}}
+        reference_frame = synthetic_frame(arguments.size)
+        for key, result in img_proc.analyse_ROIs(reference_frame, config).items():
+            config[key]['mean_color'] = result['mean_color']
+        patch = [[10, 10], [arguments.size//8, 10], [arguments.size//8, arguments.size//8], [10, arguments.size//8]]
+        param_config = {'error_margin': arguments.margin,
+                        'white_patch': {'coordinates': patch, 'reference_color': img_proc.region_mean_color(reference_frame, patch)}}
+        frames = list(drifting_frames(arguments.size, arguments.frames))
+
+    error_margin = img_proc.clamp_error_margin(param_config['error_margin'])
+    rejects = {'off': 0, 'on': 0}
+    compensation_cost = []
+    for frame in frames:
+        for mode in ('off', 'on'):
+            lut = None
+            if mode == 'on':
+                start = time.perf_counter()
+                gains = img_proc.lighting_gains(frame, param_config['white_patch'])
+                lut = img_proc.gain_LUT(gains)
+                for key in config:
+                    x, y, w, h = cv.boundingRect(numpy.array(config[key]['coordinates'], numpy.int32))
+                    cv.LUT(frame[y: y+h, x: x+w], lut)
+                compensation_cost.append(time.perf_counter() - start)
+            results = img_proc.analyse_ROIs(frame, config, lut=lut)
+            if any(img_proc.color_error(config[key]['mean_color'], results[key]['mean_color']) >= error_margin for key in config):
+                rejects[mode] = rejects[mode] + 1
+
+    compensation_cost = sorted(compensation_cost)
+    print('{} frames of good parts, error margin {}%'.format(len(frames), error_margin))
+    print('false rejects without compensation : {:>5} ({:.1f}%)'.format(rejects['off'], 100*rejects['off']/max(len(frames), 1)))
+    print('false rejects with compensation    : {:>5} ({:.1f}%)'.format(rejects['on'], 100*rejects['on']/max(len(frames), 1)))
+    if len(compensation_cost) > 0:
+        print('compensation cost per inspection   : median {:.3f} ms, max {:.3f} ms'.format(
+              1000*compensation_cost[len(compensation_cost)//2], 1000*compensation_cost[-1]))
+
+def worker_handoff(arguments):
+    '''
+    Definition:
+    -----------
+    Compares an inspection in the same process with one in the analysis worker process (see `analysis_worker.py`).\n
+    Also reports the hand-over alone: copying the frame into shared memory and queueing the job.\n
+    '''
+    folder = tempfile.mkdtemp(prefix='cake_benchmark_')
+    reference_file = os.path.join(folder, 'config.json')
+    output_file = os.path.join(folder, 'output.json')
+    style.APP_CONFIG_JSON = os.path.join(folder, 'app_config.json')
+    style.LIGHTING_COMPENSATION = False
+
+    camera = simulation.simulated_camera(width=arguments.width, height=arguments.height)
+    frame = camera.read()[1]
+    size = min(arguments.width, arguments.height)
+    config = {}
+    for key, ROI in synthetic_config(arguments.rois, size).items():
+        config[key] = {'normalised': img_proc.normalise_coordinates(ROI['coordinates'], size), 'mean_color': [128, 128, 128]}
+    config_store.write_json(reference_file, config)
+    config_store.write_json(style.APP_CONFIG_JSON, {'error_margin': 10})
+
+    img_proc.inspect_frame(frame, reference_file, output_file, folder + os.sep)
+    in_process = best_time(lambda: img_proc.inspect_frame(frame, reference_file, output_file, folder + os.sep), arguments.repeat)
+
+    worker = analysis_worker.analysis_worker()
+    worker.start()
+    try:
+        worker.inspect(frame, reference_file, output_file, folder + os.sep)
+        metrics.reset()
+        in_worker = best_time(lambda: worker.inspect(frame, reference_file, output_file, folder + os.sep), arguments.repeat)
+        handoff = metrics.snapshot()['timings_ms']['analysis_handoff']
+    finally:
+        worker.stop()
+
+    print('{} ROIs, {}x{} frame ({:.1f} MB), best of {}'.format(arguments.rois, arguments.width, arguments.height, frame.nbytes/1e6, arguments.repeat))
+    print('inspection in same process   : {:>8.2f} ms'.format(1000*in_process))
+    print('inspection in worker process : {:>8.2f} ms ({:+.2f} ms)'.format(1000*in_worker, 1000*(in_worker - in_process)))
+    print('hand-over (copy + queue)     : {:>8.3f} ms median, {:.3f} ms max'.format(handoff['p50'], handoff['max']))
+
+def conveyor_patch(frame_size):
+    '''
+    Definition:
+    -----------
+    Function returns the white patch of the synthetic conveyor (a fixture in the top-left corner, outside the ROIs, never covered by a part).\n
+    '''
+    side = max(2, frame_size//24)
+    return {'coordinates': [[0, 0], [side, 0], [side, side], [0, side]], 'reference_color': [235, 235, 235]}
+
+def conveyor_frames(frame_size, parts, travel=15, rest=20, gap=25, seed=0, flat=False):
+    '''
+    Definition:
+    -----------
+    Function yields synthetic conveyor footage: parts slide in, rest, and slide out again over an empty belt,
+    with sensor noise and slowly drifting light. The white patch of `conveyor_patch` is always in view.\n
+    Parts are textured (a simulated camera frame), or of a single flat color if `flat`.\n
+
+    Returns:
+    --------
+    (`frame` [numpy array], `settled` [bool]) : tuples
+    \n
+    settled : True on the first frame a part is at rest (ground truth for the trigger)\n
+    \n
+    '''
+    random = numpy.random.default_rng(seed)
+    part = synthetic_frame(frame_size).astype(numpy.int16)
+    if flat == True: part = numpy.full_like(part, (150, 180, 200))
+    belt = numpy.full_like(part, (160, 164, 159))
+    side = conveyor_patch(frame_size)['coordinates'][2][0]
+    timeline = []
+    for _ in range(parts):
+        timeline.extend([None]*gap)
+        timeline.extend([-frame_size + frame_size*(step + 1)//travel for step in range(travel)])
+        timeline.extend([0]*(rest - 1))
+        timeline.extend([frame_size*(step + 1)//travel for step in range(travel)])
+    timeline.extend([None]*gap)
+
+    previous = None
+    for index, shift in enumerate(timeline):
+        frame = belt.copy()
+        if shift is not None and abs(shift) < frame_size:
+            if shift < 0: frame[:, :frame_size + shift] = part[:, -shift:]
+            else: frame[:, shift:] = part[:, :frame_size - shift]
+        frame[: side, : side] = conveyor_patch(frame_size)['reference_color']
+        light = 1 + 0.05*math.sin(2*math.pi*index/len(timeline))
+        frame = numpy.clip(frame*light + random.integers(-4, 5, size=frame.shape), 0, 255).astype(numpy.uint8)
+        yield frame, (shift == 0 and previous != 0)
+        previous = shift
+
+def presence(arguments):
+    '''
+    Definition:
+    -----------
+    Replays conveyor footage through the software trigger (see `presence_trigger.py`) frame by frame, as the stream-loop would.\n
+    Reports the triggers, how many frames after the part came to rest they fired, and the cost per frame against the frame-interval.\n
+    Without `--video`, synthetic footage with a known number of parts is used (`--flat` for parts of one flat color).\n
+    Exits non-zero when the number of triggers differs from the number of parts expected.\n
+    '''
+    if arguments.video:
+        config, legacy_size = config_store.read_json(arguments.config), arguments.legacy_size or None
+        param_config = config_store.read_json(arguments.app_config) if os.path.exists(arguments.app_config) else {}
+        footage = ((frame, False) for frame in replay_frames(arguments.video, arguments.size, arguments.frames))
+        expected = arguments.expected
+    else:
+        config, legacy_size = synthetic_config(4, arguments.size), arguments.size
+        param_config = {'white_patch': conveyor_patch(arguments.size)}
+        footage = conveyor_frames(arguments.size, arguments.parts, flat=arguments.flat)
+        expected = arguments.parts
+
+    metrics.reset()
+    trigger = presence_trigger.presence_trigger(config, legacy_size, arguments.fps, param_config)
+    triggers, latencies, settled_at, frame_count = [], [], None, 0
+    for index, (frame, settled) in enumerate(footage):
+        frame_count = frame_count + 1
+        if settled == True: settled_at = index
+        if trigger.observe(frame) == True:
+            triggers.append(index)
+            if settled_at is not None:
+                latencies.append(index - settled_at)
+                settled_at = None
+
+    cost = metrics.snapshot()['timings_ms'].get('presence_trigger', {'p50': 0.0, 'p95': 0.0, 'max': 0.0})
+    interval = 1000/arguments.fps
+    print('{} frames, {} triggers{}'.format(frame_count, len(triggers), '' if expected is None else ' ({} parts expected)'.format(expected)))
+    print('trigger frames : {}'.format(triggers))
+    if len(latencies) > 0:
+        print('settle latency : median {} frames, max {} frames ({} parts caught)'.format(sorted(latencies)[len(latencies)//2], max(latencies), len(latencies)))
+    print('cost per frame : median {:.3f} ms, p95 {:.3f} ms, max {:.3f} ms ({:.2f}% of the {:.1f} ms frame-interval, budget {:.0f}%)'.format(
+          cost['p50'], cost['p95'], cost['max'], 100*cost['p50']/interval, interval, 100*style.PRESENCE_BUDGET))
+    if expected is not None and len(triggers) != expected:
+        raise SystemExit('{} triggers for {} parts'.format(len(triggers), expected))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the cake-detection image-processing pipeline.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('roi-scaling', help='per-ROI parallel speed-up vs number of workers')
+    command.add_argument('--rois', type=int, default=32)
+    command.add_argument('--size', type=int, default=768, help='side of the square frame (pixels)')
+    command.add_argument('--pool', choices=['thread', 'process'], default='thread')
+    command.add_argument('--max-workers', type=int, default=0, help='0 means the core count')
+    command.add_argument('--repeat', type=int, default=3)
+    command.set_defaults(function=roi_scaling)
+
+    command = commands.add_parser('roi-shapes', help='shape-specific ROI paths vs free polygons')
+    command.add_argument('--size', type=int, default=768, help='side of the square frame (pixels)')
+    command.add_argument('--repeat', type=int, default=20)
+    command.set_defaults(function=roi_shapes)
+
+    command = commands.add_parser('palette', help='cost of color palettes vs the single dominant color')
+    command.add_argument('--rois', type=int, default=8)
+    command.add_argument('--size', type=int, default=768, help='side of the square frame (pixels)')
+    command.add_argument('--repeat', type=int, default=5)
+    command.set_defaults(function=palette)
+
+    command = commands.add_parser('lighting', help='false rejects with/without lighting compensation, and its cost')
+    command.add_argument('--video', default='', help='recorded footage of good parts (synthetic drift if omitted)')
+    command.add_argument('--config', default=style.JSON_FILE)
+    command.add_argument('--app-config', default=style.APP_CONFIG_JSON)
+    command.add_argument('--size', type=int, default=768, help='side of the square frames are resized to (pixels)')
+    command.add_argument('--frames', type=int, default=200)
+    command.add_argument('--margin', type=float, default=10, help='error margin for synthetic footage')
+    command.set_defaults(function=lighting)
+
+    command = commands.add_parser('worker-handoff', help='inspection in the analysis worker process vs in the same process')
+    command.add_argument('--rois', type=int, default=4)
+    command.add_argument('--width', type=int, default=1280)
+    command.add_argument('--height', type=int, default=720)
+    command.add_argument('--repeat', type=int, default=10)
+    command.set_defaults(function=worker_handoff)
+
+    command = commands.add_parser('presence', help='replay conveyor footage through the software trigger')
+    command.add_argument('--video', default='', help='recorded conveyor footage (synthetic if omitted)')
+    command.add_argument('--config', default=style.JSON_FILE)
+    command.add_argument('--legacy-size', type=int, default=0, help='screen height legacy pixel ROIs were drawn on')
+    command.add_argument('--expected', type=int, default=None, help='number of parts in the footage')
+    command.add_argument('--size', type=int, default=480, help='side of the square frames are resized to (pixels)')
+    command.add_argument('--frames', type=int, default=100000)
+    command.add_argument('--parts', type=int, default=10, help='parts in synthetic footage')
+    command.add_argument('--flat', action='store_true', help='synthetic parts of one flat color')
+    command.add_argument('--app-config', default=style.APP_CONFIG_JSON, help='white patch compensating lighting drift (optional)')
+    command.add_argument('--fps', type=float, default=style.VIDEO_STREAM_FPS)
+    command.set_defaults(function=presence)
+
+    arguments = parser.parse_args()
+    arguments.function(arguments)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import time
+import numpy
+import cv2 as cv
+import style
+import metrics
+import image_processing as img_proc
+
+# [NOTE EXPLANATION] Measured decode cost of every (camera, resolution) -> chosen pixel format, so it is measured only once per run.
+_format_cache = {}
+
+def required_resolution(coordinate_size, config=None):
+    """
+    Definition:
+    -----------
+    Function returns the smallest camera resolution (from `style.CAPTURE_MODES`) which still covers the ROIs.\n
+    The smallest ROI must get atleast `style.CAPTURE_MIN_ROI_PIXELS` native pixels across.\n
+    More pixels than the screen shows (`coordinate_size`) are never asked for.\n
+    Only modes with the aspect ratio of `style.CAPTURE_DEFAULT_MODE` (the mode the reference image is calibrated at) are considered:
+    a mode of another aspect ratio crops the sensor differently, so its square centre shows another field of view and the ROIs would land on the wrong pixels.\n
+    Without ROIs (e.g. while calibrating), `style.CAPTURE_DEFAULT_MODE` is used.\n
+
+    Attributes:
+    -----------
+    `coordinate_size` : Int
+        side of the square screen the ROIs are shown on (pixels), legacy pixel coordinates were drawn on it.\n
+
+    `config` : dict
+        contents of the json file containing the coordinates of the ROI (optional).\n
+
+    Returns:
+    --------
+    (`width` [Int], `height` [Int]) : tuple
+    """
+    if not config:
+        return style.CAPTURE_DEFAULT_MODE
+    smallest_ROI = min(min(cv.boundingRect(numpy.array(img_proc.ROI_points(config[key], coordinate_size), numpy.int32))[2:]) for key in config)
+    needed = min(coordinate_size, int(numpy.ceil(style.CAPTURE_MIN_ROI_PIXELS*coordinate_size/max(smallest_ROI, 1))))
+
+    calibration_width, calibration_height = style.CAPTURE_DEFAULT_MODE
+    modes = sorted([mode for mode in style.CAPTURE_MODES if mode[0]*calibration_height == mode[1]*calibration_width], key=lambda mode: mode[0]*mode[1])
+    for width, height in modes:
+        if min(width, height) >= needed:
+            return width, height
+    return modes[-1] if len(modes) > 0 else style.CAPTURE_DEFAULT_MODE
+
+def _decode_cost(camera, fourcc, width, height, samples):
+    # [NOTE EXPLANATION] Time to read (grab + decode) a frame in said format, None if camera refuses the format.
+    camera.set(cv.CAP_PROP_FOURCC, cv.VideoWriter_fourcc(*fourcc))
+    camera.set(cv.CAP_PROP_FRAME_WIDTH, width)
+    camera.set(cv.CAP_PROP_FRAME_HEIGHT, height)
+    if int(camera.get(cv.CAP_PROP_FOURCC)) != cv.VideoWriter_fourcc(*fourcc):
+        return None
+    camera.read()
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        ret, _ = camera.read()
+        if ret == False: return None
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings)//2]
+
+def open_camera(coordinate_size, config=None, device=None):
+    """
+    Definition:
+    -----------
+    Function opens the camera with a low-latency capture-profile:\n
+    resolution : smallest mode covering the ROIs (see `required_resolution`)\n
+    format     : MJPEG or YUYV, whichever reads faster on this camera at said resolution (measured once, then cached)\n
+    buffer     : driver buffer depth of 1, so that a read returns a fresh frame (see `fresh_frame` if the driver ignores it)\n
+
+    Attributes:
+    -----------
+    `coordinate_size` : Int
+        side of the square screen the ROIs are shown on (pixels).\n
+
+    `config` : dict
+        contents of the json file containing the coordinates of the ROI (optional).\n
+
+    `device` : Int or object
+        camera index (default `style.USB_CAMERA`), or an already opened capture object (e.g. `simulation.simulated_camera`).\n
+
+    Returns:
+    --------
+    `camera` : cv.VideoCapture
+        the configured camera
+    """
+    device = style.USB_CAMERA if device is None else device
+    camera = cv.VideoCapture(device) if isinstance(device, (int, str)) else device
+    camera.set(cv.CAP_PROP_FPS, style.VIDEO_STREAM_FPS)
+    if camera.isOpened() == False:
+        return camera
+
+    width, height = required_resolution(coordinate_size, config)
+    key = (str(device), width, height)
+    if key not in _format_cache:
+        costs = {}
+        for fourcc in style.CAPTURE_FORMATS:
+            cost = _decode_cost(camera, fourcc, width, height, style.CAPTURE_FORMAT_SAMPLES)
+            if cost is not None: costs[fourcc] = cost
+        _format_cache[key] = min(costs, key=costs.get) if len(costs) > 0 else None
+
+    if _format_cache[key] is not None:
+        camera.set(cv.CAP_PROP_FOURCC, cv.VideoWriter_fourcc(*_format_cache[key]))
+    camera.set(cv.CAP_PROP_FRAME_WIDTH, width)
+    camera.set(cv.CAP_PROP_FRAME_HEIGHT, height)
+    camera.set(cv.CAP_PROP_BUFFERSIZE, 1)
+    camera.set(cv.CAP_PROP_FPS, style.VIDEO_STREAM_FPS)
+    return camera
+
+def fresh_frame(camera):
+    """
+    Definition:
+    -----------
+    Function returns a frame exposed after the call (not one waiting in the driver buffer since before the part arrived).\n
+    Buffered frames are returned by grab() at once, a fresh one only after the sensor delivers it.\n
+    So frames are grabbed (not decoded) until a grab has to wait for about half a frame-interval, or `style.CAPTURE_FLUSH_FRAMES` were discarded.\n
+
+    Returns:
+    --------
+    (`ret` [bool], `frame` [numpy array], `grab_time` [Float]) : tuple
+    \n
+    ret       : True if a frame was read\n
+    frame     : the fresh frame\n
+    grab_time : `time.monotonic()` when the frame was grabbed, to compute its age at analysis\n
+    \n
+    """
+    fps = camera.get(cv.CAP_PROP_FPS) or style.VIDEO_STREAM_FPS
+    fresh_wait = 0.5/fps
+    flushed = 0
+    while True:
+        start = time.monotonic()
+        if camera.grab() == False:
+            return False, None, start
+        grab_time = time.monotonic()
+        if grab_time - start >= fresh_wait or flushed >= style.CAPTURE_FLUSH_FRAMES:
+            break
+        flushed = flushed + 1
+    metrics.increment('capture_frames_flushed', flushed)
+    ret, frame = camera.retrieve()
+    return ret, frame, grab_time
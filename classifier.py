@@ -0,0 +1,158 @@
+import copy, threading
+import numpy
+from sklearn.neighbors import KDTree
+import style
+import config_store
+import image_processing as img_proc
+
+# ===================================================================================
+# Catalogue file (json, same register as config.json):
+#   {"roi_keys": ["ROI1", "ROI2", ...],
+#    "classes" : {"<class name>": [[B, G, R], [B, G, R], ...], ...}}
+# Every class is the reference color of every ROI (in `roi_keys` order) of one product variant.
+# ===================================================================================
+
+UNKNOWN_CLASS = 'UNKNOWN'
+
+class colour_catalogue:
+    '''
+    Definition:
+    -----------
+    Class holds the color signatures of many product variants and assigns a captured part to its nearest variant.\n
+    Signatures are the ROI colors concatenated into one feature vector per variant.\n
+    Lookup is a single vectorised distance computation, or a KD-tree query for large catalogues, so its cost stays flat as the catalogue grows.\n
+
+    Attributes:
+    -----------
+    `catalogue` : dict
+        contents of the catalogue json file.\n
+
+    '''
+    def __init__(self, catalogue):
+        self.roi_keys = list(catalogue.get('roi_keys', []))
+        self.names = list(catalogue.get('classes', {}).keys())
+        self.signatures = numpy.array([numpy.ravel(catalogue['classes'][name]) for name in self.names], numpy.float32).reshape(len(self.names), 3*len(self.roi_keys))
+        self.tree = KDTree(self.signatures) if len(self.names) >= style.CLASSIFIER_KDTREE_MIN_CLASSES else None
+
+    def feature_vector(self, colors):
+        '''
+        Definition:
+        -----------
+        Concatenates the B-G-R colors of the catalogue's ROIs into one feature vector (None if a ROI is missing).\n
+        '''
+        if any(key not in colors for key in self.roi_keys):
+            return None
+        return numpy.array([colors[key][0:3] for key in self.roi_keys], numpy.float32).ravel()
+
+    def classify(self, colors, error_margin):
+        '''
+        Definition:
+        -----------
+        Assigns the ROI colors of a captured part to the nearest class of the catalogue.\n
+
+        Attributes:
+        -----------
+        `colors` : dict
+            ROI name -> B-G-R color.\n
+
+        `error_margin` : Float
+            largest accepted distance (in percent, same scale as `image_processing.color_error`), farther parts are UNKNOWN.\n
+
+        Returns:
+        --------
+        (`name` [String], `confidence` [Float], `error` [Float]) : tuple
+        \n
+        name       : nearest class, or UNKNOWN\n
+        confidence : 0 (equally close to 2 classes) to 1 (exact match, no other class near)\n
+        error      : distance to nearest class in percent (root-mean-square over the ROIs)\n
+        \n
+        '''
+        feature = self.feature_vector(colors)
+        if feature is None or len(self.names) == 0:
+            return UNKNOWN_CLASS, 0.0, 100.0
+
+        # [NOTE EXPLANATION] 2 nearest classes: the gap between them gives the confidence.
+        neighbours = min(2, len(self.names))
+        if self.tree is not None:
+            distances, indices = self.tree.query(feature.reshape(1, -1), k=neighbours)
+            distances, indices = distances[0], indices[0]
+        else:
+            all_distances = numpy.sqrt(((self.signatures - feature)**2).sum(axis=1))
+            indices = numpy.argsort(all_distances)[:neighbours]
+            distances = all_distances[indices]
+
+        # [NOTE EXPLANATION] Express distance per ROI, as percent of the largest possible color distance.
+        error = round(float(distances[0])/numpy.sqrt(len(self.roi_keys))*100/(255*1.732), 2)
+        if neighbours == 2 and distances[1] > 0:
+            confidence = float(1.0 - distances[0]/distances[1])
+        else:
+            confidence = 1.0 if error < error_margin else 0.0
+        if error >= error_margin:
+            return UNKNOWN_CLASS, round(confidence, 3), error
+        return self.names[indices[0]], round(confidence, 3), error
+
+# [NOTE EXPLANATION] Catalogue index is rebuilt only when the catalogue file changed (config-store hands out a new dict then).
+_index = (None, None)
+_lock = threading.Lock()
+
+def load_catalogue(filename=None):
+    """
+    Definition:
+    -----------
+    Function returns the `colour_catalogue` of the catalogue file, rebuilt only when the file has changed.\n
+    Returns an empty catalogue if the file does not exist yet.\n
+    """
+    global _index
+    filename = style.CATALOGUE_FILE if filename is None else filename
+    try:
+        data = config_store.read_json(filename)
+    except (OSError, ValueError):
+        data = {}
+    with _lock:
+        if _index[0] is not data:
+            _index = (data, colour_catalogue(data))
+        return _index[1]
+
+def add_class(name, colors, filename=None):
+    """
+    Definition:
+    -----------
+    Function adds (or replaces) a class in the catalogue file, using the ROI colors of a part of said class.\n
+    The first class fixes the ROIs used for classification.\n
+
+    Attributes:
+    -----------
+    `name` : String
+        name of the product variant.\n
+
+    `colors` : dict
+        ROI name -> B-G-R color (e.g. `mean_color` of the output json file).\n
+
+    """
+    filename = style.CATALOGUE_FILE if filename is None else filename
+    try:
+        data = copy.deepcopy(config_store.read_json(filename))
+    except (OSError, ValueError):
+        data = {}
+    if len(data.get('classes', {})) == 0:
+        data = {'roi_keys': sorted(colors.keys()), 'classes': {}}
+    missing = [key for key in data['roi_keys'] if key not in colors]
+    if len(missing) > 0:
+        raise ValueError('ROI/s {} missing, catalogue was built with ROIs {}'.format(missing, data['roi_keys']))
+    data['classes'][name] = [list(colors[key][0:3]) for key in data['roi_keys']]
+    config_store.write_json(filename, data)
+
+def classify_result(color_config, error_margin):
+    """
+    Definition:
+    -----------
+    Function classifies an inspection result (contents of the output json file) against the catalogue.\n
+
+    Returns:
+    --------
+    `classification` : dict
+        {'class': name or UNKNOWN, 'confidence': 0..1, 'error': percent}
+    """
+    colors = {key: color_config[key]['mean_color'] for key in color_config}
+    name, confidence, error = load_catalogue().classify(colors, img_proc.clamp_error_margin(error_margin))
+    return {'class': name, 'confidence': confidence, 'error': error}
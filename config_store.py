@@ -0,0 +1,133 @@
+import os, json, time, tempfile, threading
+import style
+
+# [NOTE EXPLANATION] Parsed json files, keyed by filepath: (file-signature, time-of-last-check, data).
+_cache = {}
+_lock = threading.Lock()
+
+def _signature(filename):
+    # [NOTE EXPLANATION] Inode changes on every atomic write (rename), mtime/size catch in-place edits.
+    stat = os.stat(filename)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def read_json(filename):
+    """
+    Definition:
+    -----------
+    Function returns the parsed contents of a json config file, from memory whenever possible.\n
+    File is parsed only the first time and again after it has changed on disk (hot reload).\n
+    Change is detected via inode/mtime/size, checked at most once every `style.CONFIG_RELOAD_INTERVAL` seconds.\n
+    Returned dict is shared between all callers and MUST NOT be modified, copy it first.\n
+
+    Attributes:
+    -----------
+    `filename` : String
+        filepath and filename of json file.\n
+
+    Returns:
+    --------
+    `data` : dict
+        parsed contents of the json file
+    """
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(filename)
+        if entry is not None and now - entry[1] < style.CONFIG_RELOAD_INTERVAL:
+            return entry[2]
+
+    signature = _signature(filename)
+    with _lock:
+        entry = _cache.get(filename)
+        if entry is not None and entry[0] == signature:
+            _cache[filename] = (signature, now, entry[2])
+            return entry[2]
+
+    # [NOTE EXPLANATION] File is new or has changed, parse it again.
+    with open(filename, 'r') as file:
+        data = json.load(file)
+        file.close()
+
+    with _lock:
+        _cache[filename] = (signature, now, data)
+    return data
+
+def write_atomic(filename, payload):
+    """
+    Definition:
+    -----------
+    Function writes bytes to a file atomically.\n
+    Data is written to a temporary file in the same folder, flushed to disk (fsync) and renamed over the old file.\n
+    A power-cut at any instant therefore leaves either the complete old file or the complete new file.\n
+
+    Attributes:
+    -----------
+    `filename` : String
+        filepath and filename of the file.\n
+
+    `payload` : bytes
+        complete new contents of the file.\n
+
+    """
+    folder = os.path.dirname(os.path.abspath(filename))
+    file_descriptor, temp_filename = tempfile.mkstemp(dir=folder, prefix='.' + os.path.basename(filename), suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file:
+            file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filename, filename)
+    except Exception:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+    # [NOTE EXPLANATION] fsync the folder too, so that the rename itself survives a power-cut.
+    try:
+        folder_descriptor = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(folder_descriptor)
+        finally:
+            os.close(folder_descriptor)
+    except OSError:
+        pass
+
+def write_json(filename, data):
+    """
+    Definition:
+    -----------
+    Function writes a json config file atomically (see `write_atomic`) and updates the in-memory copy.\n
+
+    Attributes:
+    -----------
+    `filename` : String
+        filepath and filename of json file.\n
+
+    `data` : dict
+        data to be stored, it must not be modified after this call.\n
+
+    """
+    write_atomic(filename, json.dumps(data).encode())
+
+    with _lock:
+        _cache[filename] = (_signature(filename), time.monotonic(), data)
+
+def invalidate(filename=None):
+    """
+    Definition:
+    -----------
+    Function drops the in-memory copy of one json file (or of all files), forcing it to be parsed again on next read.\n
+    """
+    with _lock:
+        if filename is None: _cache.clear()
+        else: _cache.pop(filename, None)
+
+def version(filename):
+    """
+    Definition:
+    -----------
+    Function returns a token which changes whenever the json file changes on disk (its file-signature), for caches derived from its contents.\n
+    Token is taken from the in-memory copy (no disk access), None if the file has not been read yet.\n
+    """
+    with _lock:
+        entry = _cache.get(filename)
+    return entry[0] if entry is not None else None
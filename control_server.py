@@ -0,0 +1,354 @@
+#! /usr/bin/python3
+
+import asyncio, threading, json, time, base64, hashlib, struct, argparse, os, tempfile
+import style
+import metrics
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+HTTP_REASONS = {200: 'OK', 202: 'Accepted', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found',
+                405: 'Method Not Allowed', 409: 'Conflict', 504: 'Gateway Timeout'}
+
+class control_server:
+    '''
+    Definition:
+    -----------
+    Class is a local HTTP/WebSocket server which lets other machines (PLC gateway, dashboards) control the station.\n
+    Server runs an asyncio event-loop on its own thread, so any number of clients never block the camera or UI threads.\n
+    Endpoints:\n
+        POST /trigger          : request an inspection (`?wait=1` waits for its result, `&timeout=` in seconds)\n
+        GET  /result           : latest inspection result\n
+        GET  /results/stream   : every new result, via WebSocket (if `Upgrade: websocket`) or else Server-Sent-Events\n
+        GET  /health           : liveness and readiness of the station\n
+        GET  /metrics          : counters and timings from `metrics.py`\n
+
+    Attributes:
+    -----------
+    `trigger_callback` : function
+        called (on the server thread) for every trigger request. Returns True if an inspection will be run, False if the station is busy.\n
+        Callback must only hand over the request (e.g. set a flag), never run the inspection itself.\n
+
+    `host`, `port` : String, Int
+        address the server listens on, localhost by default.\n
+
+    '''
+    def __init__(self, trigger_callback=None, host=style.API_HOST, port=style.API_PORT):
+        self.trigger_callback = trigger_callback
+        self.host = host
+        self.port = port
+        self.latest_result = None
+        self.sequence = 0
+        self.loop = None
+        self.server = None
+        self.subscribers = set()
+        self.result_waiters = []
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+    # ----------------------------------------------------------------------------------
+    # [NOTE EXPLANATION] Thread-safe interface, called from the application threads.
+    # ----------------------------------------------------------------------------------
+    def start(self, timeout=style.API_START_TIMEOUT):
+        '''
+        Definition:
+        -----------
+        Starts the event-loop thread and returns once the server is listening.\n
+        Raises OSError if the server could not listen (e.g. port already in use) or did not come up within `timeout` seconds.\n
+        '''
+        self._thread = threading.Thread(target=self._run, name='control_server', daemon=True)
+        self._thread.start()
+        if self._ready.wait(timeout) == False:
+            raise OSError('control-server did not start within {} seconds'.format(timeout))
+        if self._error is not None:
+            raise self._error
+
+    def stop(self):
+        '''
+        Definition:
+        -----------
+        Closes the server and all client connections and stops the event-loop thread.\n
+        '''
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+
+    def publish_result(self, rois, classification=None, no_decision=None, process_control=None, schedule=None):
+        '''
+        Definition:
+        -----------
+        Makes a new inspection result available to all clients (latest-result, streams and waiting triggers).\n
+
+        Attributes:
+        -----------
+        `rois` : dict
+            contents of the output json file (ROI name -> mean_color / error / success_status).\n
+
+        `classification` : dict
+            result of the classification mode ({'class', 'confidence', 'error'}), if active.\n
+
+        `no_decision` : dict
+            verdict of the frame-quality gate if it rejected the capture, `passed` is then None.\n
+
+        `process_control` : dict
+            rolling statistics and drift alarms of every ROI (see `process_control.py`), if enabled.\n
+
+        `schedule` : dict
+            deadline of the part on a conveyor ({'deadline_ms', 'latency_ms', 'quick', 'state'}, see `inspection_scheduler.py`), if enabled.\n
+        '''
+        result = {  'sequence'  : None,
+                    'timestamp' : time.time(),
+                    'passed'    : all(roi.get('success_status') == True for roi in rois.values()),
+                    'rois'      : rois}
+        if classification is not None:
+            result['classification'] = classification
+        if process_control is not None:
+            result['process_control'] = process_control
+        if schedule is not None:
+            result['schedule'] = schedule
+        if no_decision is not None:
+            result['passed'] = None
+            result['no_decision'] = no_decision
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._broadcast, result)
+
+    # ----------------------------------------------------------------------------------
+    # [NOTE EXPLANATION] Everything below runs on the event-loop thread only.
+    # ----------------------------------------------------------------------------------
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        # [NOTE EXPLANATION] A failed bind must not leave `start` waiting, the error is handed over to it instead.
+        try:
+            self.server = loop.run_until_complete(asyncio.start_server(self._handle_client, self.host, self.port))
+        except OSError as err:
+            loop.close()
+            self._error = err
+            self._ready.set()
+            return
+        self.loop = loop
+        self.port = self.server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            for task in asyncio.all_tasks(self.loop):
+                task.cancel()
+            self.loop.run_until_complete(asyncio.sleep(0))
+            self.loop.close()
+
+    def _broadcast(self, result):
+        self.sequence = self.sequence + 1
+        result['sequence'] = self.sequence
+        self.latest_result = result
+        metrics.increment('api_results_published')
+
+        # [NOTE EXPLANATION] A slow subscriber loses its oldest results instead of holding memory.
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+                metrics.increment('api_stream_results_dropped')
+            queue.put_nowait(result)
+
+        waiters, self.result_waiters = self.result_waiters, []
+        for waiter in waiters:
+            if not waiter.done(): waiter.set_result(result)
+
+    async def _handle_client(self, reader, writer):
+        metrics.increment('api_connections')
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line: break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''): break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > 0: await reader.readexactly(length)
+
+                path, _, query_string = target.partition('?')
+                query = dict(item.partition('=')[::2] for item in query_string.split('&') if item)
+                metrics.increment('api_requests')
+
+                if path == '/results/stream' and method == 'GET':
+                    if headers.get('upgrade', '').lower() == 'websocket':
+                        await self._stream_websocket(reader, writer, headers)
+                    else:
+                        await self._stream_events(writer)
+                    break
+
+                status, payload = await self._route(method, path, query)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                await self._send_json(writer, status, payload, keep_alive)
+                if keep_alive == False: break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, query):
+        if path == '/trigger':
+            if method != 'POST': return 405, {'error': 'use POST'}
+            return await self._trigger(query)
+        if method != 'GET':
+            return 405, {'error': 'use GET'}
+        if path == '/result':
+            if self.latest_result is None: return 404, {'error': 'no inspection yet'}
+            return 200, self.latest_result
+        if path == '/health':
+            return 200, {   'status'          : 'ok',
+                            'trigger_ready'   : self.trigger_callback is not None,
+                            'results'         : self.sequence,
+                            'stream_clients'  : len(self.subscribers)}
+        if path == '/metrics':
+            return 200, metrics.snapshot()
+        return 404, {'error': 'unknown path {}'.format(path)}
+
+    async def _trigger(self, query):
+        if self.trigger_callback is None:
+            return 409, {'accepted': False, 'error': 'run-mode not active'}
+
+        # [NOTE EXPLANATION] Bad query is refused before anything is triggered.
+        try:
+            timeout = float(query.get('timeout', style.API_TRIGGER_TIMEOUT))
+        except ValueError:
+            timeout = -1.0
+        if not timeout >= 0:
+            return 400, {'accepted': False, 'error': 'timeout must be a number of seconds'}
+
+        # [NOTE EXPLANATION] Register waiter before triggering, so a very fast inspection is not missed.
+        waiter = None
+        if query.get('wait', '0') not in ('0', ''):
+            waiter = self.loop.create_future()
+            self.result_waiters.append(waiter)
+
+        accepted = self.trigger_callback()
+        metrics.increment('api_triggers_accepted' if accepted else 'api_triggers_rejected')
+        if accepted == False:
+            if waiter is not None: self.result_waiters.remove(waiter)
+            return 409, {'accepted': False, 'error': 'station busy'}
+        if waiter is None:
+            return 202, {'accepted': True}
+        try:
+            result = await asyncio.wait_for(waiter, timeout=timeout)
+            return 200, result
+        except asyncio.TimeoutError:
+            return 504, {'accepted': True, 'error': 'no result within timeout'}
+
+    async def _send_json(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode()
+        head = 'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+            status, HTTP_REASONS.get(status, ''), len(body), 'keep-alive' if keep_alive else 'close')
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+    async def _subscribe(self):
+        queue = asyncio.Queue(maxsize=style.API_STREAM_BACKLOG)
+        self.subscribers.add(queue)
+        if self.latest_result is not None: queue.put_nowait(self.latest_result)
+        return queue
+
+    async def _stream_events(self, writer):
+        # [NOTE EXPLANATION] Server-Sent-Events: plain HTTP, readable with curl or an EventSource.
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n')
+        await writer.drain()
+        queue = await self._subscribe()
+        try:
+            while True:
+                result = await queue.get()
+                writer.write('id: {}\ndata: {}\n\n'.format(result['sequence'], json.dumps(result)).encode())
+                await writer.drain()
+        finally:
+            self.subscribers.discard(queue)
+
+    async def _stream_websocket(self, reader, writer, headers):
+        key = headers.get('sec-websocket-key', '')
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                      'Sec-WebSocket-Accept: {}\r\n\r\n').format(accept).encode())
+        await writer.drain()
+
+        queue = await self._subscribe()
+        receiver = asyncio.ensure_future(self._websocket_receiver(reader, writer))
+        try:
+            while not receiver.done():
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    break
+                writer.write(_websocket_frame(0x1, json.dumps(getter.result()).encode()))
+                await writer.drain()
+        finally:
+            receiver.cancel()
+            self.subscribers.discard(queue)
+
+    async def _websocket_receiver(self, reader, writer):
+        # [NOTE EXPLANATION] Answer pings, stop on close. Anything the client sends otherwise is ignored.
+        while True:
+            header = await reader.readexactly(2)
+            opcode, length = header[0] & 0x0F, header[1] & 0x7F
+            if length == 126: length = struct.unpack('!H', await reader.readexactly(2))[0]
+            elif length == 127: length = struct.unpack('!Q', await reader.readexactly(8))[0]
+            mask = await reader.readexactly(4) if header[1] & 0x80 else b'\x00\x00\x00\x00'
+            payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(await reader.readexactly(length)))
+            if opcode == 0x8:
+                writer.write(_websocket_frame(0x8, payload[:2]))
+                return
+            if opcode == 0x9:
+                writer.write(_websocket_frame(0xA, payload))
+
+def _websocket_frame(opcode, payload):
+    if len(payload) < 126:
+        header = struct.pack('!BB', 0x80 | opcode, len(payload))
+    elif len(payload) < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, len(payload))
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, len(payload))
+    return header + payload
+
+def run_simulated_station(host, port, frame_size):
+    '''
+    Definition:
+    -----------
+    Runs the control-server without UI or camera, inspecting frames from `simulation.simulated_camera`.\n
+    Meant for testing clients (PLC gateway, dashboards) entirely on localhost.\n
+    '''
+    import image_processing as img_proc
+    import config_store
+    import simulation
+
+    camera = simulation.simulated_camera(realtime=True)
+    trigger = threading.Event()
+    work_folder = tempfile.mkdtemp(prefix='cake_detection_')
+    output_file = os.path.join(work_folder, 'output.json')
+
+    def request_trigger():
+        if trigger.is_set(): return False
+        trigger.set()
+        return True
+
+    server = control_server(request_trigger, host, port)
+    server.start()
+    print('control-server listening on http://{}:{}'.format(server.host, server.port))
+
+    while True:
+        trigger.wait()
+        ret, frame = camera.read()
+        with metrics.timed('inspection'):
+            img_proc.inspect_frame(frame, style.JSON_FILE, output_file, work_folder + os.sep, legacy_size=frame_size)
+        server.publish_result(config_store.read_json(output_file))
+        trigger.clear()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local control/results API of the inspection station.')
+    parser.add_argument('--host', default=style.API_HOST)
+    parser.add_argument('--port', type=int, default=style.API_PORT)
+    parser.add_argument('--frame-size', type=int, default=768, help='side of the square legacy (pixel) ROI coordinates were drawn on')
+    arguments = parser.parse_args()
+    run_simulated_station(arguments.host, arguments.port, arguments.frame_size)
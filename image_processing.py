@@ -1,8 +1,15 @@
-import subprocess, json, numpy, math
+import subprocess, numpy, math, copy, os, contextlib, functools
+import concurrent.futures
 from types import new_class
 from sklearn.cluster import KMeans
+try:
+    from threadpoolctl import threadpool_limits    # NOTE ships with scikit-learn
+except ImportError:
+    threadpool_limits = None
 import cv2 as cv 
 import style
+import config_store
+import metrics
 
 def get_screensize():
     """
@@ -30,7 +37,542 @@ def get_screensize():
         # print('Error occured while getting screen size with message: {}'.format(err))
         return False, 0, 0
 
-def get_mean_colors(pngfile, jsonfile, outputpath):
+# [NOTE EXPLANATION] Shapes a ROI can have in the config ('shape' key, ROIs without it are polygons).
+# [NOTE EXPLANATION] Every shape also stores its outline as vertices, so that display, bounding-boxes and scaling treat all shapes alike.
+POLYGON = 'polygon'
+RECTANGLE = 'rectangle'
+CIRCLE = 'circle'
+ELLIPSE = 'ellipse'
+ROI_SHAPES = (POLYGON, RECTANGLE, CIRCLE, ELLIPSE)
+
+def ROI_shape(ROI):
+    return ROI.get('shape', POLYGON)
+
+def shape_vertices(shape, points):
+    """
+    Definition:
+    -----------
+    Function returns the outline vertices of a ROI shape from the points clicked by the user.\n
+    rectangle : 2 opposite corners, axis-aligned\n
+    circle    : centre and a point on the rim\n
+    ellipse   : 2 opposite corners of its (axis-aligned) bounding-box\n
+    polygon   : the points themselves\n
+    Circles and ellipses get a vertex every 10 degrees, including the 4 extreme points, so that their bounding-box is exact.\n
+
+    Returns:
+    --------
+    `coordinates` : list
+        integer [x, y] vertices
+    """
+    if shape == POLYGON:
+        return [[int(x), int(y)] for x, y in points]
+    (x1, y1), (x2, y2) = points[-2], points[-1]
+    if shape == RECTANGLE:
+        left, top, right, bottom = min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+        return [[left, top], [right, top], [right, bottom], [left, bottom]]
+    if shape == CIRCLE:
+        radius = int(round(math.hypot(x2 - x1, y2 - y1)))
+        centre, axes = (int(x1), int(y1)), (radius, radius)
+    else:
+        centre, axes = (int(round((x1 + x2)/2)), int(round((y1 + y2)/2))), (int(round(abs(x2 - x1)/2)), int(round(abs(y2 - y1)/2)))
+    return cv.ellipse2Poly(centre, axes, 0, 0, 360, 10)[:-1].tolist()
+
+def isolate_ROI(cropped_img, coordinate_list, mask=None, kind=POLYGON, holes=None):
+    """
+    Definition:
+    -----------
+    Function isolates a region of interest inside an image already cropped to the ROI's bounding-box.\n
+
+    Attributes:
+    -----------
+    `cropped_img` : numpy array
+        B-G-R image cropped to the bounding-box of the ROI.\n
+
+    `coordinate_list` : numpy array
+        vertices of the ROI polygon, relative to the top-left corner of the bounding-box.\n
+
+    `mask` : numpy array
+        precompiled ROI mask (see `compile_masks`), it is built from `coordinate_list` if None (see `ROI_mask`).\n
+
+    `kind`, `holes` :
+        see `ROI_mask`.\n
+
+    Returns:
+    --------
+    (`mask`, `blackbg_img`, `whitebg_img`, `isolated_img`) : tuple of numpy arrays
+    \n
+    mask         : ROI mask\n
+    blackbg_img  : ROI isolated via black-background\n
+    whitebg_img  : ROI isolated via white-background\n
+    isolated_img : ROI isolated via no-background (B-G-R-A)\n
+    \n
+    """
+    # [NOTE EXPLANATION] Create an image mask based on the ROI coordinates.
+    if mask is None:
+        mask = ROI_mask(coordinate_list, cropped_img.shape[:2], kind, holes)
+
+    # [NOTE EXPLANATION] Create an image with ROI isolated via black-background.
+    blackbg_img = cv.bitwise_and(cropped_img, cropped_img, mask=mask)
+
+    # [NOTE EXPLANATION] Create an image with ROI isolated via white-background.
+    bg = numpy.ones_like(cropped_img, numpy.uint8)*255
+    cv.bitwise_not(bg, bg, mask=mask)
+    whitebg_img = bg + blackbg_img
+
+    # [NOTE EXPLANATION] Create an image with ROI isolated via no-background.
+    temp = cv.cvtColor(blackbg_img, cv.COLOR_BGR2GRAY)
+    _, alpha = cv.threshold(temp, 0, 255, cv.THRESH_BINARY)
+    b, g, r = cv.split(blackbg_img)
+    rgba = [b, g, r, alpha]
+    isolated_img = cv.merge(rgba, 4)
+
+    return mask, blackbg_img, whitebg_img, isolated_img
+
+def ROI_mask(coordinate_list, shape, kind=POLYGON, holes=None):
+    """
+    Definition:
+    -----------
+    Function builds the mask of a ROI inside its bounding-box.\n
+    rectangle         : the whole bounding-box\n
+    circle / ellipse  : analytic, the ellipse inscribed in the bounding-box (no rasterisation, cached per size)\n
+    polygon           : rasterised (anti-aliased), holes are cut out of it\n
+
+    Attributes:
+    -----------
+    `coordinate_list` : numpy array
+        vertices of the ROI outline, relative to the top-left corner of the bounding-box.\n
+
+    `shape` : tuple
+        (height, width) of the bounding-box.\n
+
+    `kind` : String
+        shape of the ROI, one of `ROI_SHAPES`.\n
+
+    `holes` : list of numpy arrays
+        vertices of the holes of a polygon, relative to the top-left corner of the bounding-box (optional).\n
+
+    Returns:
+    --------
+    `mask` : numpy array
+        uint8 mask, 255 inside the ROI (read-only for circles and ellipses, it is shared)
+    """
+    if kind == RECTANGLE:
+        return numpy.full(shape, 255, numpy.uint8)
+    if kind in (CIRCLE, ELLIPSE):
+        return _ellipse_mask(int(shape[0]), int(shape[1]))
+    mask = numpy.zeros(shape, numpy.uint8)
+    cv.drawContours(mask, [coordinate_list], -1, (255, 255, 255), -1, cv.LINE_AA)
+    if holes:
+        cv.drawContours(mask, list(holes), -1, (0, 0, 0), -1, cv.LINE_AA)
+    return mask
+
+@functools.lru_cache(maxsize=64)
+def _ellipse_mask(height, width):
+    # [NOTE EXPLANATION] Pixel centres inside the ellipse inscribed in a height x width box.
+    y, x = numpy.ogrid[0: height, 0: width]
+    inside = ((x - (width - 1)/2)/(width/2))**2 + ((y - (height - 1)/2)/(height/2))**2 <= 1.0
+    mask = numpy.where(inside, 255, 0).astype(numpy.uint8)
+    mask.flags.writeable = False
+    return mask
+
+def _ROI_geometry(ROI):
+    # [NOTE EXPLANATION] Outline and holes of a ROI (in pixels, see `scale_config`), relative to its bounding-box.
+    coordinate_list = numpy.array(ROI['coordinates'], numpy.int32)
+    x, y, w, h = cv.boundingRect(coordinate_list)
+    origin = numpy.array([x, y], numpy.int32)
+    holes = [numpy.array(hole, numpy.int32) - origin for hole in ROI.get('hole_coordinates', [])]
+    return (x, y, w, h), coordinate_list - origin, holes
+
+def compile_masks(config):
+    """
+    Definition:
+    -----------
+    Function rasterises the mask of every ROI once, so that they can be stored (see `recipe_library.py`) and reused for every inspection.\n
+
+    Attributes:
+    -----------
+    `config` : dict
+        contents of the json file containing the coordinates of the ROI.\n
+
+    Returns:
+    --------
+    `masks` : dict
+        ROI name -> uint8 mask of the size of the ROI's bounding-box (rectangles have none)
+    """
+    masks = {}
+    for key in config:
+        # [NOTE EXPLANATION] Rectangles need no mask, they are sliced straight out of the image.
+        if ROI_shape(config[key]) == RECTANGLE: continue
+        (x, y, w, h), coordinate_list, holes = _ROI_geometry(config[key])
+        masks[key] = numpy.array(ROI_mask(coordinate_list, (h, w), ROI_shape(config[key]), holes))
+    return masks
+
+def dominant_color(isolated_img):
+    """
+    Definition:
+    -----------
+    Function determines the dominant color of an isolated ROI via K-cluster algorithm.\n
+
+    Attributes:
+    -----------
+    `isolated_img` : numpy array
+        B-G-R-A (or B-G-R) image of the isolated ROI.\n
+
+    Returns:
+    --------
+    `dom_rgb` : Int array
+        B-G-R values of the dominant color
+    """
+    # [NOTE EXPLANATION] Calculate dominant color of isolated image using K-means clustering.
+    rgb_image = isolated_img.reshape((-1, isolated_img.shape[-1]))[:, 2::-1]
+    cluster = KMeans(n_clusters=style.K_CLUSTER_SIZE, random_state=style.KMEANS_SEED).fit(rgb_image)
+    labels = numpy.arange(0, len(numpy.unique(cluster.labels_)) + 1)
+    (hist, _) = numpy.histogram(cluster.labels_, bins = labels)
+    hist = hist.astype('float')
+    hist /= hist.sum()
+    colors = sorted([(percent, color) for (percent, color) in zip(hist, cluster.cluster_centers_)], key=lambda item:item[0])
+    dom_rgb = max(colors, key=lambda item:item[0])[1]
+    dom_rgb = [int(dom_rgb[2]), int(dom_rgb[1]), int(dom_rgb[0])]
+    # print('dominant color is', dom_rgb)
+    return dom_rgb
+
+def color_palette(pixels, k=None):
+    """
+    Definition:
+    -----------
+    Function determines the top-k color palette of a ROI via K-cluster algorithm, from the pixels inside the ROI only.\n
+    Palette is a compact signature of multi-colored parts (e.g. decorated cakes), its heaviest color is the dominant color.\n
+
+    Attributes:
+    -----------
+    `pixels` : numpy array
+        N x 3 B-G-R pixels inside the ROI.\n
+
+    `k` : Int
+        number of colors, default `style.PALETTE_SIZE`.\n
+
+    Returns:
+    --------
+    `palette` : dict
+        {'colors': B-G-R colors, 'weights': share of the pixels of every color}, heaviest color first
+    """
+    k = style.PALETTE_SIZE if k is None else k
+    pixels = numpy.asarray(pixels, numpy.float32).reshape(-1, 3)
+    k = max(1, min(k, len(pixels)))
+    cluster = KMeans(n_clusters=k, random_state=style.KMEANS_SEED).fit(pixels)
+    weights = numpy.bincount(cluster.labels_, minlength=k)/float(len(pixels))
+    order = numpy.argsort(-weights)
+    return {'colors' : [[int(round(float(value))) for value in cluster.cluster_centers_[index]] for index in order],
+            'weights': [round(float(weights[index]), 4) for index in order]}
+
+def _analyse_ROI(cropped_img, coordinate_list, keep_images, mask=None, kind=POLYGON, holes=None, palette=False):
+    # [NOTE EXPLANATION] Work of a single ROI, kept picklable so that it can also run in a worker process.
+    if kind == RECTANGLE:
+        # [NOTE EXPLANATION] Rectangle: the cropped bounding-box is the ROI, no mask and no bitwise passes.
+        ROI_palette = color_palette(cropped_img) if palette == True else None
+        dom_rgb = ROI_palette['colors'][0] if palette == True else dominant_color(cropped_img)
+        if keep_images == False:
+            return dom_rgb, None, ROI_palette
+        mask = numpy.full(cropped_img.shape[:2], 255, numpy.uint8)
+        isolated_img = cv.merge(list(cv.split(cropped_img)) + [mask], 4)
+        return dom_rgb, (mask, cropped_img, cropped_img, isolated_img), ROI_palette
+
+    if kind in (CIRCLE, ELLIPSE) and keep_images == False:
+        # [NOTE EXPLANATION] Circle / ellipse: one masked copy through the analytic mask (the black-background image), no polygon mask and no further passes.
+        mask = ROI_mask(coordinate_list, cropped_img.shape[:2], kind) if mask is None else mask
+        if palette == True:
+            ROI_palette = color_palette(cropped_img[mask > 0] if numpy.count_nonzero(mask) > 0 else cropped_img)
+            return ROI_palette['colors'][0], None, ROI_palette
+        return dominant_color(cv.copyTo(cropped_img, mask)), None, None
+
+    mask, blackbg_img, whitebg_img, isolated_img = isolate_ROI(cropped_img, coordinate_list, mask, kind, holes)
+    # [NOTE EXPLANATION] Palette clusters the pixels inside the mask only, single dominant color keeps its original behaviour.
+    ROI_palette = color_palette(cropped_img[mask > 0] if numpy.count_nonzero(mask) > 0 else cropped_img) if palette == True else None
+    dom_rgb = ROI_palette['colors'][0] if palette == True else dominant_color(isolated_img)
+    images = (mask, blackbg_img, whitebg_img, isolated_img) if keep_images == True else None
+    return dom_rgb, images, ROI_palette
+
+def _limit_inner_threads():
+    # [NOTE EXPLANATION] Every ROI worker must stay single-threaded inside, else BLAS/OpenMP oversubscribe the cores.
+    cv.setNumThreads(style.ROI_INNER_THREADS)
+    if threadpool_limits is not None:
+        threadpool_limits(limits=style.ROI_INNER_THREADS)
+
+_ROI_pools = {}
+
+def _ROI_pool(kind, workers):
+    pool = _ROI_pools.get((kind, workers))
+    if pool is None:
+        if kind == 'process':
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_limit_inner_threads)
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='roi_worker')
+        _ROI_pools[(kind, workers)] = pool
+    return pool
+
+def analyse_ROIs(image, config, keep_images=False, workers=None, pool_kind=None, masks=None, lut=None, palette=None):
+    """
+    Definition:
+    -----------
+    Function crops every ROI out of an image and determines its dominant color.\n
+    ROIs are independent, so they are dispatched to a pool of workers (threads by default, OpenCV/NumPy/KMeans release the GIL).\n
+    Inner BLAS/OpenMP threading is limited to `style.ROI_INNER_THREADS` per worker, so that the pool does not oversubscribe the CPU.\n
+    Only the cropped ROI is handed to a worker, never the full image.\n
+
+    Attributes:
+    -----------
+    `image` : numpy array
+        B-G-R image, in the coordinate space of the ROIs.\n
+
+    `config` : dict
+        contents of the json file containing the coordinates of the ROI.\n
+
+    `keep_images` : bool
+        True also returns the intermediate images (mask, black/white background, isolated) of every ROI.\n
+
+    `workers` : Int
+        number of parallel workers, default `style.ROI_WORKERS` (0 means one per CPU core, 1 means serial).\n
+
+    `pool_kind` : String
+        'thread' or 'process', default `style.ROI_POOL`.\n
+
+    `masks` : dict
+        precompiled ROI masks (see `compile_masks`), ROIs missing from it are rasterised.\n
+
+    `lut` : numpy array
+        lighting-compensation lookup-table (see `lighting_LUT`), applied to the cropped ROIs only.\n
+
+    `palette` : bool
+        True determines the color palette of every ROI (see `color_palette`), None only of ROIs calibrated with a palette or opted in ("use_palette").\n
+
+    Returns:
+    --------
+    `results` : dict
+        ROI name -> {'mean_color': B-G-R dominant color, 'extremes_of_ROI': [x, y, w, h], 'images': tuple or None, 'palette': dict or None}
+    """
+    workers = style.ROI_WORKERS if workers is None else workers
+    workers = os.cpu_count() if workers == 0 else workers
+    workers = min(workers, len(config)) if len(config) > 0 else 1
+    pool_kind = style.ROI_POOL if pool_kind is None else pool_kind
+
+    jobs = {}
+    for key in config:
+        # [NOTE EXPLANATION] Find out image extreme coordinates of image.
+        (x, y, w, h), coordinate_list, holes = _ROI_geometry(config[key])
+        cropped_img = image[y: y+h, x: x+w].copy() if lut is None else cv.LUT(image[y: y+h, x: x+w], lut)
+
+        # [NOTE EXPLANATION] Use precompiled mask only if it still fits the ROI.
+        mask = masks.get(key) if masks is not None else None
+        if mask is not None and mask.shape != cropped_img.shape[:2]: mask = None
+        ROI_palette = ('palette' in config[key] or config[key].get('use_palette') == True) if palette is None else palette
+        jobs[key] = ([x, y, w, h], cropped_img, coordinate_list, mask, ROI_shape(config[key]), holes, ROI_palette)
+
+    results = {}
+    if workers <= 1:
+        for key, (extremes_list, cropped_img, coordinate_list, mask, kind, holes, ROI_palette) in jobs.items():
+            dom_rgb, images, ROI_palette = _analyse_ROI(cropped_img, coordinate_list, keep_images, mask, kind, holes, ROI_palette)
+            results[key] = {'mean_color': dom_rgb, 'extremes_of_ROI': extremes_list, 'images': images, 'palette': ROI_palette}
+        return results
+
+    pool = _ROI_pool(pool_kind, workers)
+    limits = threadpool_limits(limits=style.ROI_INNER_THREADS) if (pool_kind == 'thread' and threadpool_limits is not None) else contextlib.nullcontext()
+    with limits:
+        futures = {key: pool.submit(_analyse_ROI, cropped_img, coordinate_list, keep_images, mask, kind, holes, ROI_palette)
+                   for key, (_, cropped_img, coordinate_list, mask, kind, holes, ROI_palette) in jobs.items()}
+        for key in jobs:
+            dom_rgb, images, ROI_palette = futures[key].result()
+            results[key] = {'mean_color': dom_rgb, 'extremes_of_ROI': jobs[key][0], 'images': images, 'palette': ROI_palette}
+    return results
+
+def _store_ROI_images(outputpath, key, suffix, cropped_img, images):
+    mask, blackbg_img, whitebg_img, isolated_img = images
+    cv.imwrite(outputpath + str(key) + suffix + style.CROPPED_IMAGE   , cropped_img)
+    cv.imwrite(outputpath + str(key) + suffix + style.MASK_ONLY       , mask)
+    cv.imwrite(outputpath + str(key) + suffix + style.BLACK_BACKGROUND, blackbg_img)
+    cv.imwrite(outputpath + str(key) + suffix + style.WHITE_BACKGROUND, whitebg_img)
+    cv.imwrite(outputpath + str(key) + suffix + style.ISOLATED_ROI    , isolated_img)
+
+def square_crop(frame):
+    """
+    Definition:
+    -----------
+    Function crops a camera frame to an aspect-ratio of 1:1 (i.e. square), around its centre.\n
+    Returned image is a view into the frame, nothing is copied.\n
+    """
+    img_width, img_height = int(frame.shape[1]), int(frame.shape[0])
+    if img_width > img_height:
+        return frame[0:img_height, int((img_width - img_height)/2):int((img_width + img_height)/2)]
+    else:
+        return frame[int((img_height - img_width)/2):int((img_height + img_width)/2), 0:img_width]
+
+# ===================================================================================
+# ROI coordinates are stored normalised ('normalised' : 0.0 to 1.0 of the square centre of the camera frame),
+# so they hold for every camera resolution and every monitor. Older configs only have 'coordinates' in pixels
+# of the (square) screen they were drawn on, `legacy_size` is the side of said screen.
+# ===================================================================================
+
+def square_geometry(shape):
+    """
+    Definition:
+    -----------
+    Function returns where `square_crop` takes the square centre of a frame of said shape.\n
+
+    Returns:
+    --------
+    (`size` [Int], `offset` [tuple]) : tuple
+    \n
+    size   : side of the square (pixels)\n
+    offset : (x, y) of its top-left corner in the frame\n
+    \n
+    """
+    img_width, img_height = int(shape[1]), int(shape[0])
+    size = min(img_width, img_height)
+    return size, (int((img_width - size)/2), int((img_height - size)/2))
+
+def normalise_coordinates(coordinates, size):
+    """
+    Definition:
+    -----------
+    Function converts polygon vertices from pixels of a `size` x `size` square (e.g. the ROI canvas) to normalised coordinates.\n
+    """
+    return [[round(float(x)/size, 5), round(float(y)/size, 5)] for x, y in coordinates]
+
+def ROI_points(ROI, size, offset=(0, 0), legacy_size=None):
+    """
+    Definition:
+    -----------
+    Function returns the vertices of a ROI (or white patch) in pixels of a `size` x `size` square placed at `offset`.\n
+
+    Attributes:
+    -----------
+    `ROI` : dict
+        ROI as stored in the config, with 'normalised' (or legacy 'coordinates') vertices.\n
+
+    `size` : Int
+        side of the square the ROI is mapped onto (pixels).\n
+
+    `offset` : tuple
+        (x, y) of the square's top-left corner, e.g. where the square centre lies in a full camera frame.\n
+
+    `legacy_size` : Int
+        side of the square legacy 'coordinates' were drawn on, default `size`.\n
+
+    Returns:
+    --------
+    `coordinates` : list
+        integer [x, y] vertices
+    """
+    if 'normalised' in ROI:
+        points = numpy.array(ROI['normalised'], numpy.float64)*size
+    else:
+        points = numpy.array(ROI['coordinates'], numpy.float64)*size/(size if legacy_size is None else legacy_size)
+    points = numpy.rint(points + numpy.array(offset, numpy.float64)).astype(numpy.int32)
+    return points.tolist()
+
+def scale_config(config, size, offset=(0, 0), legacy_size=None):
+    """
+    Definition:
+    -----------
+    Function maps every ROI of a config onto a square of `size` pixels at `offset` (see `ROI_points`).\n
+    Used for the display (`size` = canvas) and for the analysis (`size` and `offset` of the square centre of the native frame).\n
+
+    Returns:
+    --------
+    `config` : dict
+        copy of the config with 'coordinates', 'hole_coordinates' (polygons with holes) and 'extremes_of_ROI' in said pixels (other keys are shared, not copied)
+    """
+    scaled = {}
+    for key in config:
+        coordinates = ROI_points(config[key], size, offset, legacy_size)
+        scaled[key] = dict(config[key])
+        scaled[key]['coordinates'] = coordinates
+        if 'holes' in config[key]:
+            scaled[key]['hole_coordinates'] = [ROI_points({'normalised': hole}, size, offset) for hole in config[key]['holes']]
+        scaled[key]['extremes_of_ROI'] = list(cv.boundingRect(numpy.array(coordinates, numpy.int32)))
+    return scaled
+
+def ROI_union(config):
+    """
+    Definition:
+    -----------
+    Function returns the bounding-box [x, y, w, h] of all ROIs of a config (in pixels, see `scale_config`) together.\n
+    """
+    points = numpy.concatenate([numpy.array(config[key]['coordinates'], numpy.int32) for key in config])
+    return list(cv.boundingRect(points))
+
+def crop_to_ROIs(frame, config):
+    """
+    Definition:
+    -----------
+    Function crops the bounding-box of all ROIs out of a frame, before anything else touches the pixels.\n
+    Crop is a view into the frame (nothing is copied), and the ROIs are shifted to it. Parts of the box outside the frame are cut off.\n
+
+    Attributes:
+    -----------
+    `frame` : numpy array
+        B-G-R frame, in the pixel space of `config`.\n
+
+    `config` : dict
+        ROIs in pixels of `frame` (see `scale_config`).\n
+
+    Returns:
+    --------
+    (`cropped_img` [numpy array], `config` [dict]) : tuple
+    """
+    # [NOTE EXPLANATION] Both corners are clipped to the frame, so that a ROI sticking out on any side neither shifts nor enlarges the crop.
+    x, y, w, h = ROI_union(config)
+    x2, y2 = min(x + w, frame.shape[1]), min(y + h, frame.shape[0])
+    x, y = max(x, 0), max(y, 0)
+    w, h = max(x2 - x, 0), max(y2 - y, 0)
+    shifted = {}
+    for key in config:
+        coordinates = (numpy.array(config[key]['coordinates'], numpy.int32) - numpy.array([x, y], numpy.int32)).tolist()
+        shifted[key] = dict(config[key])
+        shifted[key]['coordinates'] = coordinates
+        if 'hole_coordinates' in config[key]:
+            shifted[key]['hole_coordinates'] = [(numpy.array(hole, numpy.int32) - numpy.array([x, y], numpy.int32)).tolist() for hole in config[key]['hole_coordinates']]
+        shifted[key]['extremes_of_ROI'] = list(cv.boundingRect(numpy.array(coordinates, numpy.int32)))
+    return frame[y: y+h, x: x+w], shifted
+
+def shrink_ROIs(image, config, scale):
+    """
+    Definition:
+    -----------
+    Function shrinks an image (e.g. the ROI box of `crop_to_ROIs`) by `scale`, and maps the ROIs onto the shrunk pixels.\n
+
+    Attributes:
+    -----------
+    `image` : numpy array
+        B-G-R image, in the pixel space of `config`.\n
+
+    `config` : dict
+        ROIs in pixels of `image` (see `scale_config`).\n
+
+    `scale` : Float
+        factor between 0 and 1.\n
+
+    Returns:
+    --------
+    (`shrunk_img` [numpy array], `config` [dict]) : tuple
+    """
+    height, width = image.shape[:2]
+    dsize = (max(1, int(round(width*scale))), max(1, int(round(height*scale))))
+    factors = numpy.array([dsize[0]/float(width), dsize[1]/float(height)], numpy.float64)
+
+    def shrink(points):
+        points = numpy.rint(numpy.array(points, numpy.float64)*factors).astype(numpy.int32)
+        return numpy.minimum(points, numpy.array(dsize, numpy.int32) - 1).tolist()
+
+    shrunk = {}
+    for key in config:
+        shrunk[key] = dict(config[key])
+        shrunk[key]['coordinates'] = shrink(config[key]['coordinates'])
+        if 'hole_coordinates' in config[key]:
+            shrunk[key]['hole_coordinates'] = [shrink(hole) for hole in config[key]['hole_coordinates']]
+        shrunk[key]['extremes_of_ROI'] = list(cv.boundingRect(numpy.array(shrunk[key]['coordinates'], numpy.int32)))
+    return cv.resize(image, dsize=dsize, interpolation=cv.INTER_AREA), shrunk
+
+def get_mean_colors(pngfile, jsonfile, outputpath, legacy_size=None):
     """
     Definition:
     -----------
@@ -50,81 +592,105 @@ def get_mean_colors(pngfile, jsonfile, outputpath):
 
     `outputpath` : String
         filepath where the photos created during cropping are to be stored
+
+    `legacy_size` : Int
+        side of the square legacy (pixel) ROI coordinates were drawn on, default the side of the image (optional)
     
     """
     # [NOTE EXPLANATION] Read png-image and json-file.
     image = cv.imread(pngfile, cv.IMREAD_UNCHANGED)
 
-    with open(jsonfile, 'r') as file:
-        config = json.load(file)
-        file.close()
-    
+    config = copy.deepcopy(config_store.read_json(jsonfile))
+    # [NOTE EXPLANATION] Palettes of a previous calibration do not carry over, only the "use_palette" opt-in (or `style.COLOR_PALETTE`) does.
     for key in config:
-        coordinate_list = numpy.array(config[key]['coordinates'])
+        config[key].pop('palette', None)
 
-        # [NOTE EXPLANATION] Find out image extreme coordinates of image.
-        extremes = cv.boundingRect(coordinate_list)
-        x, y, w, h = extremes
-        extremes_list = [x, y, w, h]
-        # print('extremes', extremes)
-        cropped_img = image[y: y+h, x: x+w].copy()
-
-        coordinate_list = coordinate_list - coordinate_list.min(axis=0)
+    # [NOTE EXPLANATION] Map ROIs onto the native pixels of the image, and keep only the part covered by ROIs.
+    size, offset = square_geometry(image.shape)
+    image, pixel_config = crop_to_ROIs(image, scale_config(config, size, offset, legacy_size))
 
-        # [NOTE EXPLANATION] Create an image mask based on the ROI coordinates.
-        mask = numpy.zeros(cropped_img.shape[:2], numpy.uint8)
-        cv.drawContours(mask, [coordinate_list], -1, (255, 255, 255), -1, cv.LINE_AA)
-
-        # [NOTE EXPLANATION] Create an image with ROI isolated via black-background.
-        blackbg_img = cv.bitwise_and(cropped_img, cropped_img, mask=mask)
-
-        # [NOTE EXPLANATION] Create an image with ROI isolated via white-background.
-        bg = numpy.ones_like(cropped_img, numpy.uint8)*255
-        cv.bitwise_not(bg, bg, mask=mask)
-        whitebg_img = bg + blackbg_img
-
-        # [NOTE EXPLANATION] Create an image with ROI isolated via no-background.
-        temp = cv.cvtColor(blackbg_img, cv.COLOR_BGR2GRAY)
-        _, alpha = cv.threshold(temp, 0, 255, cv.THRESH_BINARY)
-        b, g, r = cv.split(blackbg_img)
-        rgba = [b, g, r, alpha]
-        isolated_img = cv.merge(rgba, 4)
-
-        # [NOTE EXPLANATION] Calculate mean/average color of isolated image.
-        # mean_color = ((numpy.array(cv.mean(isolated_img)).astype(numpy.uint8)).tolist())
-        # config[key]['mean_color'] = mean_color
-        # print('mean color is {}'.format(mean_color))
-
-        # [NOTE EXPLANATION] Calculate dominant color of isolated image using K-means clustering.
-        rgb_image = cv.cvtColor(isolated_img, cv.COLOR_BGR2RGB)
-        rgb_image = rgb_image.reshape((rgb_image.shape[0] * rgb_image.shape[1], 3))
-        cluster = KMeans(n_clusters=style.K_CLUSTER_SIZE).fit(rgb_image)
-        labels = numpy.arange(0, len(numpy.unique(cluster.labels_)) + 1)
-        (hist, _) = numpy.histogram(cluster.labels_, bins = labels)
-        hist = hist.astype('float')
-        hist /= hist.sum()
-        colors = sorted([(percent, color) for (percent, color) in zip(hist, cluster.cluster_centers_)])
-        dom_rgb = max(colors, key=lambda item:item[0])[1]
-        dom_rgb = [int(dom_rgb[2]), int(dom_rgb[1]), int(dom_rgb[0])]
-        # print('dominant color is', dom_rgb)
-        config[key]['mean_color'] = dom_rgb
-        config[key]['extremes_of_ROI'] = extremes_list
+    # [NOTE EXPLANATION] Determine dominant color (and palette, if enabled) of every ROI (in parallel).
+    results = analyse_ROIs(image, pixel_config, keep_images=style.CREATE_FILES, palette=True if style.COLOR_PALETTE == True else None)
+    # [NOTE EXPLANATION] Plain mean color too, the live preview compares like with like (see `live_preview.py`).
+    preview_colors = estimate_mean_colors(image, pixel_config)
+    
+    for key in config:
+        # [NOTE EXPLANATION] Legacy ROIs are stored normalised from now on.
+        if 'normalised' not in config[key]:
+            config[key]['normalised'] = normalise_coordinates(config[key]['coordinates'], size if legacy_size is None else legacy_size)
+            config[key].pop('coordinates')
+        config[key]['mean_color'] = results[key]['mean_color']
+        config[key]['extremes_of_ROI'] = results[key]['extremes_of_ROI']
+        config[key]['preview_color'] = preview_colors[key]
+        if results[key]['palette'] is not None:
+            config[key]['palette'] = results[key]['palette']
 
         # [NOTE EXPLANATION] Store images if required.        
         if style.CREATE_FILES == True: 
-            cv.imwrite(outputpath + str(key) + style.CROPPED_IMAGE   , cropped_img)
-            cv.imwrite(outputpath + str(key) + style.MASK_ONLY       , mask)
-            cv.imwrite(outputpath + str(key) + style.BLACK_BACKGROUND, blackbg_img)
-            cv.imwrite(outputpath + str(key) + style.WHITE_BACKGROUND, whitebg_img)
-            cv.imwrite(outputpath + str(key) + style.ISOLATED_ROI    , isolated_img)
+            x, y, w, h = results[key]['extremes_of_ROI']
+            _store_ROI_images(outputpath, key, '', image[y: y+h, x: x+w], results[key]['images'])
 
     # [NOTE EXPLANATION] Write data to json file.
-    with open(jsonfile, 'w') as file:
-        file.write(json.dumps(config))
-        file.close()
+    config_store.write_json(jsonfile, config)
+
+
+def propose_ROIs(image, max_ROIs=None):
+    """
+    Definition:
+    -----------
+    Function proposes ROIs on a reference image: regions of uniform color, as simplified polygons.\n
+    Square centre of the image is shrunk to `style.PROPOSAL_SIZE` pixels and quantised to `style.PROPOSAL_COLORS` colors (k-means in Lab).\n
+    Connected regions of every color, cleaned by a morphological opening, are proposed if their area lies between
+    `style.PROPOSAL_MIN_AREA` and `style.PROPOSAL_MAX_AREA` of the image. Outlines are pulled 1 pixel inwards, so that
+    they stay clear of color edges, and simplified to a few vertices.\n
+    Everything runs on the small copy, a proposal costs a few tens of milliseconds (recorded as 'roi_proposal', see `metrics.py`).\n
+
+    Attributes:
+    -----------
+    `image` : numpy array
+        B-G-R reference image.\n
+
+    `max_ROIs` : Int
+        most ROIs proposed, largest regions first, default `style.PROPOSAL_MAX_ROIS`.\n
+
+    Returns:
+    --------
+    `proposals` : list
+        normalised vertices of every proposed ROI (see `ROI_points`)
+    """
+    max_ROIs = style.PROPOSAL_MAX_ROIS if max_ROIs is None else max_ROIs
+    size = style.PROPOSAL_SIZE
+    with metrics.timed('roi_proposal'):
+        small = cv.resize(square_crop(image), dsize=(size, size), interpolation=cv.INTER_AREA)
+        small = cv.GaussianBlur(small, (3, 3), 0)
+        lab = cv.cvtColor(small, cv.COLOR_BGR2LAB).reshape(-1, 3).astype(numpy.float32)
 
+        # [NOTE EXPLANATION] Quantise colors, a few iterations are plenty on a 128 x 128 image.
+        criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+        _, labels, _ = cv.kmeans(lab, style.PROPOSAL_COLORS, None, criteria, 1, cv.KMEANS_PP_CENTERS)
+        labels = labels.reshape(size, size)
 
-def compare_colors(filename, reference_jsonfile, output_jsonfile, outputpath):
+        kernel = numpy.ones((3, 3), numpy.uint8)
+        min_area, max_area = style.PROPOSAL_MIN_AREA*size*size, style.PROPOSAL_MAX_AREA*size*size
+        regions = []
+        for color in range(style.PROPOSAL_COLORS):
+            mask = cv.morphologyEx(numpy.where(labels == color, 255, 0).astype(numpy.uint8), cv.MORPH_OPEN, kernel)
+            count, components, stats, _ = cv.connectedComponentsWithStats(mask, connectivity=4)
+            for component in range(1, count):
+                area = stats[component, cv.CC_STAT_AREA]
+                if area < min_area or area > max_area: continue
+                region = cv.erode(numpy.where(components == component, 255, 0).astype(numpy.uint8), kernel)
+                contours, _ = cv.findContours(region, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+                if len(contours) == 0: continue
+                contour = max(contours, key=cv.contourArea)
+                polygon = cv.approxPolyDP(contour, style.PROPOSAL_EPSILON*cv.arcLength(contour, True), True).reshape(-1, 2)
+                if len(polygon) >= 3:
+                    regions.append((area, polygon.tolist()))
+
+    regions = sorted(regions, key=lambda region: region[0], reverse=True)[:max_ROIs]
+    return [normalise_coordinates(polygon, size) for _, polygon in regions]
+
+def compare_colors(filename, reference_jsonfile, output_jsonfile, outputpath, masks=None, legacy_size=None):
     """
     Definition:
     -----------
@@ -147,90 +713,105 @@ def compare_colors(filename, reference_jsonfile, output_jsonfile, outputpath):
 
     `outputpath` : String
         filepath where the photos created during cropping are to be stored
+
+    `masks` : dict
+        precompiled ROI masks, e.g. of the active recipe (optional)
+
+    `legacy_size` : Int
+        side of the square legacy (pixel) ROI coordinates were drawn on, default the side of the image (optional)
     
     """
-    # [NOTE EXPLANATION] Read png-image and json-file.
-    output_config = {}
+    # [NOTE EXPLANATION] Read png-image, then inspect it.
     image = cv.imread(filename, cv.IMREAD_UNCHANGED)
+    inspect_frame(image, reference_jsonfile, output_jsonfile, outputpath, masks, legacy_size)
 
-    with open(reference_jsonfile, 'r') as file:
-        input_config = json.load(file)
-        file.close()
+def inspect_frame(frame, reference_jsonfile, output_jsonfile, outputpath, masks=None, legacy_size=None, quick=False, scale=None):
+    """
+    Definition:
+    -----------
+    Function does the work of `compare_colors` on a frame straight from the camera (native resolution, not cropped).\n
+    ROIs are mapped onto the square centre of the frame, and only the bounding-box of all ROIs is cut out (a view).\n
+    Nothing outside said box is ever resized, color-converted or copied.\n
 
-    for key in input_config:
-        output_config[key] = {}
-        coordinate_list = numpy.array(input_config[key]['coordinates'])
+    Attributes:
+    -----------
+    `frame` : numpy array
+        B-G-R camera frame.\n
 
-        # [NOTE EXPLANATION] Find out image extreme coordinates of image.
-        extremes = cv.boundingRect(coordinate_list)
-        x, y, w, h = extremes
-        cropped_img = image[y: y+h, x: x+w].copy()
+    `reference_jsonfile`, `output_jsonfile`, `outputpath`, `masks`, `legacy_size` :
+        see `compare_colors`, nothing is written if `output_jsonfile` is None.\n
 
-        coordinate_list = coordinate_list - coordinate_list.min(axis=0)
+    `quick` : bool
+        True takes the plain mean color of every ROI (see `estimate_mean_colors`) instead of the clustering, for when time runs short.\n
 
-        # [NOTE EXPLANATION] Create an image mask based on the ROI coordinates.
-        mask = numpy.zeros(cropped_img.shape[:2], numpy.uint8)
-        cv.drawContours(mask, [coordinate_list], -1, (255, 255, 255), -1, cv.LINE_AA)
-
-        # [NOTE EXPLANATION] Create an image with ROI isolated via black-background.
-        blackbg_img = cv.bitwise_and(cropped_img, cropped_img, mask=mask)
-
-        # [NOTE EXPLANATION] Create an image with ROI isolated via white-background.
-        bg = numpy.ones_like(cropped_img, numpy.uint8)*255
-        cv.bitwise_not(bg, bg, mask=mask)
-        whitebg_img = bg + blackbg_img
-
-        # [NOTE EXPLANATION] Create an image with ROI isolated via no-background.
-        temp = cv.cvtColor(blackbg_img, cv.COLOR_BGR2GRAY)
-        _, alpha = cv.threshold(temp, 0, 255, cv.THRESH_BINARY)
-        b, g, r = cv.split(blackbg_img)
-        rgba = [b, g, r, alpha]
-        isolated_img = cv.merge(rgba, 4)
-
-        # [NOTE EXPLANATION] Calculate dominant color of isolated image using K-means clustering.
-        rgb_image = cv.cvtColor(isolated_img, cv.COLOR_BGR2RGB)
-        rgb_image = rgb_image.reshape((rgb_image.shape[0] * rgb_image.shape[1], 3))
-        cluster = KMeans(n_clusters=style.K_CLUSTER_SIZE).fit(rgb_image)
-        labels = numpy.arange(0, len(numpy.unique(cluster.labels_)) + 1)
-        (hist, _) = numpy.histogram(cluster.labels_, bins = labels)
-        hist = hist.astype('float')
-        hist /= hist.sum()
-        colors = sorted([(percent, color) for (percent, color) in zip(hist, cluster.cluster_centers_)])
-        dom_rgb = max(colors, key=lambda item:item[0])[1]
-        dom_rgb = [int(dom_rgb[2]), int(dom_rgb[1]), int(dom_rgb[0])]
-        # print('dominant color is', dom_rgb)
-        output_config[key]['mean_color'] = dom_rgb
+    `scale` : Float
+        factor the ROI box is shrunk by before the analysis (see `shrink_ROIs`), default `style.ANALYSIS_SCALE`. Cost is recorded as 'analysis_resize'.\n
+
+    Returns:
+    --------
+    `output_config` : dict
+        contents of the output json file
+    """
+    output_config = {}
 
-        # mean_color = ((numpy.array(cv.mean(isolated_img)).astype(numpy.uint8)).tolist())
-        # output_config[key]['mean_color'] = mean_color
+    input_config = config_store.read_json(reference_jsonfile)
+    param_config = config_store.read_json(style.APP_CONFIG_JSON)
+
+    # [NOTE EXPLANATION] Calculate desired error margin.
+    error_margin = clamp_error_margin(param_config["error_margin"])
+
+    # [NOTE EXPLANATION] Map ROIs (and white patch) onto the native pixels of the frame.
+    size, offset = square_geometry(frame.shape)
+    pixel_config = scale_config(input_config, size, offset, legacy_size)
+    if 'white_patch' in param_config:
+        param_config = dict(param_config)
+        param_config['white_patch'] = dict(param_config['white_patch'], coordinates=ROI_points(param_config['white_patch'], size, offset, legacy_size))
+
+    # [NOTE EXPLANATION] Compensate lighting drift (if a white patch is calibrated), only ROI pixels are corrected.
+    lut = lighting_LUT(frame, param_config)
+
+    # [NOTE EXPLANATION] Keep only the bounding-box of all ROIs.
+    image, pixel_config = crop_to_ROIs(frame, pixel_config)
+
+    # [NOTE EXPLANATION] Shrink said box if configured, masks precompiled at full resolution no longer fit and are rasterised anew.
+    scale = style.ANALYSIS_SCALE if scale is None else scale
+    if scale < 1.0:
+        with metrics.timed('analysis_resize'):
+            image, pixel_config = shrink_ROIs(image, pixel_config, scale)
+        masks = None
+
+    # [NOTE EXPLANATION] Determine dominant color of every ROI (in parallel), or just its mean color if quick.
+    if quick == True:
+        if lut is not None: image = cv.LUT(image, lut)
+        colors = estimate_mean_colors(image, pixel_config)
+        results = {key: {'mean_color': colors[key]} for key in colors}
+    else:
+        results = analyse_ROIs(image, pixel_config, keep_images=style.CREATE_FILES, masks=masks, lut=lut)
+
+    # [NOTE EXPLANATION] ROIs calibrated with a palette are compared by palette distance, all of them at once.
+    palette_keys = [key for key in input_config if results[key].get('palette') is not None and 'palette' in input_config[key]]
+    palette_errors = {}
+    if len(palette_keys) > 0:
+        errors = palette_distances([input_config[key]['palette'] for key in palette_keys], [results[key]['palette'] for key in palette_keys])
+        palette_errors = {key: round(float(error), 2) for key, error in zip(palette_keys, errors)}
+
+    for key in input_config:
+        output_config[key] = {}
+        dom_rgb = results[key]['mean_color']
+        output_config[key]['mean_color'] = dom_rgb
+        if key in palette_errors:
+            output_config[key]['palette'] = results[key]['palette']
 
         # [NOTE EXPLANATION] Store images if required. 
-        if style.CREATE_FILES == True: 
-            cv.imwrite(outputpath + str(key) + '_output' + style.CROPPED_IMAGE   , cropped_img)
-            cv.imwrite(outputpath + str(key) + '_output' + style.MASK_ONLY       , mask)
-            cv.imwrite(outputpath + str(key) + '_output' + style.BLACK_BACKGROUND, blackbg_img)
-            cv.imwrite(outputpath + str(key) + '_output' + style.WHITE_BACKGROUND, whitebg_img)
-            cv.imwrite(outputpath + str(key) + '_output' + style.ISOLATED_ROI, isolated_img)
+        if style.CREATE_FILES == True and quick == False: 
+            x, y, w, h = results[key]['extremes_of_ROI']
+            _store_ROI_images(outputpath, key, '_output', image[y: y+h, x: x+w], results[key]['images'])
 
         rgb_arr_1 =  input_config[key]['mean_color'][0:3]
         rgb_arr_2 = dom_rgb[0:3]
 
-        # [NOTE EXPLANATION] Write data to json file.
-        with open(style.APP_CONFIG_JSON, 'r') as file:
-            param_config = json.load(file)
-            file.close()
-
-        # [NOTE EXPLANATION] Calculate desired error margin.
-        if param_config["error_margin"] < 0     : error_margin = 0.0
-        elif param_config["error_margin"] > 100 : error_margin = 100.0
-        else: error_margin = float(param_config["error_margin"])
-        
-        # [NOTE EXPLANATION] compute eucledian distance between 2 colors.
-        eucledian_distance = 0
-        for color_component_1, color_component_2 in zip(rgb_arr_1, rgb_arr_2):
-            eucledian_distance = eucledian_distance + (color_component_1 - color_component_2)**2
-
-        eucledian_distance = round(((math.sqrt(eucledian_distance))*100/(255*1.732)), 2)
+        # [NOTE EXPLANATION] compute eucledian distance between 2 colors (or between 2 palettes, same scale).
+        eucledian_distance = palette_errors[key] if key in palette_errors else color_error(rgb_arr_1, rgb_arr_2)
         output_config[key]['error'] = eucledian_distance
 
         # [NOTE EXPLANATION] Compare eucledian distance and error margin.
@@ -243,9 +824,231 @@ def compare_colors(filename, reference_jsonfile, output_jsonfile, outputpath):
             # print(eucledian_distance, error_margin, False)
 
     # [NOTE EXPLANATION] Write data to json file.
-    with open(output_jsonfile, 'w') as file:
-        file.write(json.dumps(output_config))
-        file.close()
+    if output_jsonfile is not None:
+        config_store.write_json(output_jsonfile, output_config)
+    return output_config
+
+def clamp_error_margin(error_margin):
+    """
+    Definition:
+    -----------
+    Function restricts the user-entered error-margin to the range 0 to 100 (percent).\n
+
+    Attributes:
+    -----------
+    `error_margin` : Int or Float
+        error-margin as stored in the app-config json file.\n
+
+    Returns:
+    --------
+    `error_margin` : Float
+        error-margin clamped between 0.0 and 100.0
+    """
+    if error_margin < 0     : return 0.0
+    elif error_margin > 100 : return 100.0
+    else: return float(error_margin)
+
+def color_error(rgb_arr_1, rgb_arr_2):
+    """
+    Definition:
+    -----------
+    Function computes the eucledian distance between 2 colors, as a percentage of the largest possible distance.\n
+
+    Attributes:
+    -----------
+    `rgb_arr_1`, `rgb_arr_2` : Int arrays
+        color components of the 2 colors (same order for both)
+
+    Returns:
+    --------
+    `eucledian_distance` : Float
+        distance between the colors in percent, rounded to 2 decimals
+    """
+    eucledian_distance = 0
+    for color_component_1, color_component_2 in zip(rgb_arr_1[0:3], rgb_arr_2[0:3]):
+        eucledian_distance = eucledian_distance + (color_component_1 - color_component_2)**2
+
+    return round(((math.sqrt(eucledian_distance))*100/(255*1.732)), 2)
+
+# [NOTE EXPLANATION] 13 directions of the cube (axes, face- and body-diagonals) for the sliced distance.
+_SLICE_DIRECTIONS = numpy.array([[1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0], [1, -1, 0], [1, 0, 1], [1, 0, -1], [0, 1, 1], [0, 1, -1],
+                                 [1, 1, 1], [1, 1, -1], [1, -1, 1], [-1, 1, 1]], numpy.float64)
+_SLICE_DIRECTIONS = _SLICE_DIRECTIONS/numpy.linalg.norm(_SLICE_DIRECTIONS, axis=1, keepdims=True)
+# [NOTE EXPLANATION] Scale so that shifting a single color along an axis gives its eucledian distance.
+_SLICE_SCALE = 1.0/numpy.abs(_SLICE_DIRECTIONS[:, 0]).mean()
+
+def _pack_palettes(palettes, k):
+    colors = numpy.zeros((len(palettes), k, 3), numpy.float64)
+    weights = numpy.zeros((len(palettes), k), numpy.float64)
+    for index, palette in enumerate(palettes):
+        count = min(k, len(palette['colors']))
+        colors[index, :count] = numpy.array(palette['colors'], numpy.float64)[:count, :3]
+        weights[index, :count] = palette['weights'][:count]
+    weights = weights/numpy.maximum(weights.sum(axis=1, keepdims=True), 1e-12)
+    return colors, weights
+
+def palette_distances(reference_palettes, palettes):
+    """
+    Definition:
+    -----------
+    Function computes the distance between pairs of color palettes (see `color_palette`), for all ROIs at once.\n
+    Distance is the earth-mover's distance sliced along 13 fixed directions of color space: projected on a direction,
+    2 palettes are 1-D distributions whose EMD has a closed form (area between their cumulative weights).\n
+    No optimisation is solved, every ROI and direction is one vectorised sort + cumulative sum.\n
+    Result is on the scale of `color_error` (percent), so the same error-margin applies; for single-color palettes it matches it closely.\n
+
+    Attributes:
+    -----------
+    `reference_palettes`, `palettes` : lists of dicts
+        calibrated and measured palette of every ROI, in the same order.\n
+
+    Returns:
+    --------
+    `distances` : numpy array
+        distance in percent for every ROI
+    """
+    k = max(len(palette['colors']) for palette in list(reference_palettes) + list(palettes))
+    reference_colors, reference_weights = _pack_palettes(reference_palettes, k)
+    colors, weights = _pack_palettes(palettes, k)
+
+    # [NOTE EXPLANATION] Project both palettes on every direction: ROIs x directions x 2k positions, weights signed (+ reference, - measured).
+    positions = numpy.concatenate([reference_colors, colors], axis=1) @ _SLICE_DIRECTIONS.T
+    positions = positions.transpose(0, 2, 1)
+    signed = numpy.concatenate([reference_weights, -weights], axis=1)[:, None, :].repeat(positions.shape[1], axis=1)
+
+    # [NOTE EXPLANATION] 1-D EMD = sum over sorted positions of |difference of cumulative weights| x gap to next position.
+    order = numpy.argsort(positions, axis=2)
+    positions = numpy.take_along_axis(positions, order, axis=2)
+    cumulative = numpy.cumsum(numpy.take_along_axis(signed, order, axis=2), axis=2)[:, :, :-1]
+    emd = (numpy.abs(cumulative)*numpy.diff(positions, axis=2)).sum(axis=2)
+
+    return numpy.round(_SLICE_SCALE*emd.mean(axis=1)*100/(255*1.732), 2)
+
+def estimate_mean_colors(frame, config):
+    """
+    Definition:
+    -----------
+    Function is a cheap estimator of the color inside every ROI, meant for the live preview of run-mode.\n
+    Instead of K-means clustering, the plain mean of the pixels inside the ROI polygon is taken.\n
+    Only the bounding-box of each ROI is touched, the frame is never copied.\n
+
+    Attributes:
+    -----------
+    `frame` : numpy array
+        B-G-R image.\n
+
+    `config` : dict
+        ROIs in pixels of `frame` (see `scale_config`).\n
+
+    Returns:
+    --------
+    `colors` : dict
+        B-G-R mean color of every ROI, keyed by ROI name
+    """
+    colors = {}
+    for key in config:
+        mean_color = region_mean_color(frame, config[key]['coordinates'], ROI_shape(config[key]), config[key].get('hole_coordinates'))
+        colors[key] = [int(mean_color[0]), int(mean_color[1]), int(mean_color[2])]
+    return colors
+
+def region_mean_color(image, coordinates, kind=POLYGON, holes=None):
+    """
+    Definition:
+    -----------
+    Function returns the plain mean B-G-R color of the pixels inside a ROI, touching only its bounding-box.\n
+    Rectangles are averaged straight from the slice, circles and ellipses through their analytic mask.\n
+
+    Attributes:
+    -----------
+    `image` : numpy array
+        B-G-R image.\n
+
+    `coordinates` : list
+        vertices of the outline, in pixels of `image`.\n
+
+    `kind`, `holes` :
+        shape of the ROI (see `ROI_mask`), and the vertices of the holes of a polygon in pixels of `image`.\n
+
+    Returns:
+    --------
+    `mean_color` : Float array
+        B-G-R mean color
+    """
+    coordinate_list = numpy.array(coordinates, numpy.int32)
+    x, y, w, h = cv.boundingRect(coordinate_list)
+    cropped_img = image[y: y+h, x: x+w]
+
+    if kind == RECTANGLE:
+        mean_color = cv.mean(cropped_img)
+    elif kind in (CIRCLE, ELLIPSE):
+        mean_color = cv.mean(cropped_img, mask=_ellipse_mask(cropped_img.shape[0], cropped_img.shape[1]))
+    else:
+        # [NOTE EXPLANATION] Hard-edged mask is enough here, anti-aliasing only adds cost.
+        mask = numpy.zeros(cropped_img.shape[:2], numpy.uint8)
+        cv.fillPoly(mask, [coordinate_list - numpy.array([x, y], numpy.int32)], 255)
+        if holes:
+            cv.fillPoly(mask, [numpy.array(hole, numpy.int32) - numpy.array([x, y], numpy.int32) for hole in holes], 0)
+        mean_color = cv.mean(cropped_img, mask=mask)
+    return [mean_color[0], mean_color[1], mean_color[2]]
+
+def lighting_gains(image, white_patch):
+    """
+    Definition:
+    -----------
+    Function estimates how much the lighting has drifted since calibration, from the neutral reference (white) patch.\n
+    Per-channel gain = color of patch at calibration / color of patch now, limited to `style.LIGHTING_GAIN_LIMITS`.\n
+    Gains are rounded to `style.LIGHTING_GAIN_STEP`, so that slowly drifting light keeps hitting the same cached LUT.\n
+
+    Attributes:
+    -----------
+    `image` : numpy array
+        B-G-R image, in the coordinate space of the ROIs.\n
+
+    `white_patch` : dict
+        {'coordinates': polygon of the patch, 'reference_color': B-G-R mean color of the patch at calibration}\n
+
+    Returns:
+    --------
+    `gains` : tuple
+        B-G-R gains
+    """
+    current_color = region_mean_color(image, white_patch['coordinates'])
+    low, high = style.LIGHTING_GAIN_LIMITS
+    gains = []
+    for reference, measured in zip(white_patch['reference_color'], current_color):
+        gain = min(max(reference/max(measured, 1.0), low), high)
+        gains.append(round(round(gain/style.LIGHTING_GAIN_STEP)*style.LIGHTING_GAIN_STEP, 4))
+    return tuple(gains)
+
+@functools.lru_cache(maxsize=64)
+def gain_LUT(gains):
+    """
+    Definition:
+    -----------
+    Function builds (once per distinct set of gains, then cached) the lookup-table which applies per-channel gains to a B-G-R image via `cv.LUT`.\n
+
+    Returns:
+    --------
+    `lut` : numpy array
+        256x1x3 uint8 lookup-table
+    """
+    levels = numpy.arange(256, dtype=numpy.float32)
+    lut = numpy.stack([numpy.clip(levels*gain + 0.5, 0, 255) for gain in gains], axis=1)
+    return lut.astype(numpy.uint8).reshape(256, 1, 3)
+
+def lighting_LUT(image, param_config):
+    """
+    Definition:
+    -----------
+    Function returns the lighting-compensation LUT for an image, or None if compensation is off, no patch is calibrated or light is unchanged.\n
+    """
+    if style.LIGHTING_COMPENSATION == False or 'white_patch' not in param_config:
+        return None
+    with metrics.timed('lighting_gain'):
+        gains = lighting_gains(image, param_config['white_patch'])
+    if gains == (1.0, 1.0, 1.0):
+        return None
+    return gain_LUT(gains)
 
 def tkinter_compatible_color(arr):
     """
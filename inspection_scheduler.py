@@ -0,0 +1,279 @@
+import heapq, itertools, threading, time
+import style
+import metrics
+
+# ===================================================================================
+# Conveyor operation: every triggered part travels on to the reject gate, which it reaches `style.REJECT_GATE_DELAY`
+# seconds after the trigger. Its verdict is only of use before then, so:
+#   deadline  : every part is stamped with trigger time + gate delay
+#   order     : parts waiting for analysis are taken earliest deadline first
+#   degrading : a part is analysed with the cheap estimator (plain mean color) instead of the clustering
+#               whenever the clustering would make it, or a part queued behind it, miss its deadline
+#   gate      : at the deadline the reject actuator pulses for failed parts, and for parts without a verdict
+#               (deadline missed, analysis failed, no usable frame) if `style.REJECT_ON_MISS` is True (fail-safe)
+# Missed deadlines are counted (metrics 'deadline_missed') and reported, a late verdict is never acted upon.
+# Analyses raising an error are counted apart (metrics 'inspection_failed'), they are no timing misses.
+# ===================================================================================
+
+QUEUED = 'QUEUED'
+RUNNING = 'RUNNING'
+DONE = 'DONE'
+MISSED = 'MISSED'
+FAILED = 'FAILED'
+DROPPED = 'DROPPED'
+NO_DECISION = 'NO DECISION'
+
+class reject_actuator:
+    '''
+    Definition:
+    -----------
+    Class drives the reject actuator: GPIO output `pin` is held HIGH for `pulse` seconds per rejected part.\n
+    On machines without GPIO pins, `simulation.simulated_gpio` stands in and records every level change in its history.\n
+
+    Attributes:
+    -----------
+    `gpio` : module or object
+        `RPi.GPIO` (or its stand-in), set up in BOARD numbering.\n
+
+    `pin` : Int
+        output pin of the actuator, default `style.GPIO_REJECT_PIN`.\n
+
+    `pulse` : Float
+        duration of a pulse (in seconds).\n
+
+    '''
+    def __init__(self, gpio, pin=style.GPIO_REJECT_PIN, pulse=style.REJECT_PULSE):
+        self.gpio = gpio
+        self.pin = pin
+        self.pulse = pulse
+        self.pulses = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self.gpio.setup(self.pin, self.gpio.OUT, initial=self.gpio.LOW)
+
+    def fire(self):
+        '''
+        Definition:
+        -----------
+        Starts a pulse, never blocks. A pulse already running is extended.\n
+        '''
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self.gpio.output(self.pin, self.gpio.HIGH)
+            self._timer = threading.Timer(self.pulse, self._release)
+            self._timer.daemon = True
+            self._timer.start()
+            self.pulses = self.pulses + 1
+        metrics.increment('reject_pulses')
+
+    def _release(self):
+        with self._lock:
+            self.gpio.output(self.pin, self.gpio.LOW)
+            self._timer = None
+
+class inspection_scheduler:
+    '''
+    Definition:
+    -----------
+    Class inspects the parts of a conveyor in deadline order on its own thread, and decides at the reject gate.\n
+    Costs of both analyses are learned as they run (smoothed), and used to plan the next part.\n
+
+    Attributes:
+    -----------
+    `analyse` : function
+        analyse(frame, quick) -> output config (ROI name -> mean_color / error / success_status), `quick` selects the cheap estimator.\n
+
+    `actuator` : reject_actuator
+        actuator pulsed at the gate (optional).\n
+
+    `on_event` : function
+        on_event(kind, job), called from the scheduler threads: kind 'verdict' when a part is analysed in time, 'gate' when a part reaches the gate.\n
+        Must not touch Tkinter, hand the job over to the UI thread instead.\n
+
+    `gate_delay` : Float
+        time from trigger until the part reaches the reject gate (in seconds).\n
+
+    `capacity` : Int
+        most parts waiting for analysis, the part with the latest deadline is dropped (left to the gate without verdict) beyond it.\n
+
+    '''
+    def __init__(self, analyse, actuator=None, on_event=None, gate_delay=style.REJECT_GATE_DELAY, capacity=style.SCHEDULER_QUEUE):
+        self.analyse = analyse
+        self.actuator = actuator
+        self.on_event = on_event
+        self.gate_delay = gate_delay
+        self.capacity = capacity
+        self.counts = {'submitted': 0, 'full': 0, 'quick': 0, 'passed': 0, 'rejected': 0, 'missed': 0, 'failed': 0, 'dropped': 0, 'no_decision': 0}
+
+        self._queue = []
+        self._sequence = itertools.count()
+        self._cost = {False: None, True: None}
+        self._gates = set()
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._worker, name='inspection_scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, trigger_time):
+        '''
+        Definition:
+        -----------
+        Stamps a part with its deadline and queues its analysis, never blocks.\n
+
+        Attributes:
+        -----------
+        `frame` : numpy array
+            B-G-R frame of the part, None if no usable frame was captured (the part is still tracked to the gate).\n
+
+        `trigger_time` : Float
+            `time.monotonic()` at which the frame was grabbed.\n
+
+        Returns:
+        --------
+        `job` : dict
+            {'id', 'trigger_time', 'deadline', 'state', 'verdict', 'output', 'quick', 'finished'}
+        '''
+        job = {'id': next(self._sequence), 'frame': frame, 'trigger_time': trigger_time, 'deadline': trigger_time + self.gate_delay,
+               'state': QUEUED if frame is not None else NO_DECISION, 'verdict': None, 'output': None, 'quick': None, 'finished': None}
+        with self._condition:
+            self.counts['submitted'] = self.counts['submitted'] + 1
+            if job['state'] == QUEUED:
+                heapq.heappush(self._queue, (job['deadline'], job['id'], job))
+                if len(self._queue) > self.capacity:
+                    # [NOTE EXPLANATION] Overloaded: the part that can wait longest gives way (it is decided at the gate like a missed one).
+                    latest = max(self._queue)
+                    self._queue.remove(latest)
+                    heapq.heapify(self._queue)
+                    latest[2]['state'], latest[2]['frame'] = DROPPED, None
+                    self.counts['dropped'] = self.counts['dropped'] + 1
+                    metrics.increment('scheduler_dropped')
+                self._condition.notify()
+
+            gate = threading.Timer(max(job['deadline'] - time.monotonic(), 0.0), self._at_gate, args=(job,))
+            gate.daemon = True
+            self._gates.add(gate)
+        gate.start()
+        return job
+
+    def in_flight(self):
+        '''
+        Definition:
+        -----------
+        Returns the number of parts that have not reached the gate yet.\n
+        '''
+        with self._condition:
+            return len(self._gates)
+
+    def summary(self):
+        '''
+        Definition:
+        -----------
+        Returns the counts of all parts so far, and the learned analysis costs (in milliseconds).\n
+        '''
+        with self._condition:
+            summary = dict(self.counts)
+            summary['in_flight'] = len(self._gates)
+            summary['full_cost_ms'] = None if self._cost[False] is None else round(1000*self._cost[False], 1)
+            summary['quick_cost_ms'] = None if self._cost[True] is None else round(1000*self._cost[True], 1)
+        return summary
+
+    def stop(self):
+        '''
+        Definition:
+        -----------
+        Stops the scheduler. Parts still in flight are forgotten (no gate decisions are taken anymore).\n
+        '''
+        with self._condition:
+            self._running = False
+            for gate in self._gates:
+                gate.cancel()
+            self._gates.clear()
+            self._queue = []
+            self._condition.notify()
+
+    def _plan(self, now, deadline):
+        # [NOTE EXPLANATION] Full analysis if it meets the deadline and makes no queued part miss that the quick one would not; None if even quick is too late.
+        # [NOTE EXPLANATION] Costs not yet measured are taken as 0, so that both analyses get measured on first need.
+        full = self._cost[False] or 0.0
+        quick = self._cost[True] or 0.0
+        margin = style.SCHEDULER_SAFETY
+        later = sorted(entry[0] for entry in self._queue)
+
+        def misses(start):
+            finish, count = start, 0
+            for later_deadline in later:
+                finish = finish + quick
+                if finish + margin > later_deadline: count = count + 1
+            return count
+
+        if now + full + margin <= deadline and misses(now + full) <= misses(now + quick):
+            return False
+        if now + quick + margin <= deadline:
+            return True
+        return None
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while self._running and len(self._queue) == 0:
+                    self._condition.wait()
+                if self._running == False:
+                    return
+                deadline, _, job = heapq.heappop(self._queue)
+                quick = self._plan(time.monotonic(), deadline)
+                if quick is None:
+                    # [NOTE EXPLANATION] Too late for any analysis, the CPU goes to parts that can still make it.
+                    job['frame'] = None
+                    continue
+                job['state'], job['quick'] = RUNNING, quick
+                frame = job['frame']
+
+            start = time.perf_counter()
+            try:
+                output = self.analyse(frame, quick)
+            except Exception as err:
+                print('Error received while analysing scheduled part is: {}'.format(err))
+                output = None
+            elapsed = time.perf_counter() - start
+            metrics.observe('scheduled_inspection_quick' if quick == True else 'scheduled_inspection', elapsed)
+
+            with self._condition:
+                self._cost[quick] = elapsed if self._cost[quick] is None else 0.8*self._cost[quick] + 0.2*elapsed
+                self.counts['quick' if quick == True else 'full'] = self.counts['quick' if quick == True else 'full'] + 1
+                job['frame'] = None
+                if job['state'] != RUNNING:
+                    continue
+                if output is None:
+                    # [NOTE EXPLANATION] Failed analysis: decided at the gate like a part without verdict, but not counted as a missed deadline.
+                    job['state'], job['finished'] = FAILED, time.monotonic()
+                    self.counts['failed'] = self.counts['failed'] + 1
+                    metrics.increment('inspection_failed')
+                    continue
+                job['state'], job['output'], job['finished'] = DONE, output, time.monotonic()
+                job['verdict'] = all(output[key]['success_status'] == True for key in output)
+            if self.on_event is not None:
+                self.on_event('verdict', job)
+
+    def _at_gate(self, job):
+        with self._condition:
+            if self._running == False:
+                return
+            self._gates.discard(threading.current_thread())
+            if job['state'] in (QUEUED, RUNNING, DROPPED):
+                if job['state'] == QUEUED:
+                    self._queue = [entry for entry in self._queue if entry[2] is not job]
+                    heapq.heapify(self._queue)
+                job['state'] = MISSED
+                self.counts['missed'] = self.counts['missed'] + 1
+                metrics.increment('deadline_missed')
+            elif job['state'] == NO_DECISION:
+                self.counts['no_decision'] = self.counts['no_decision'] + 1
+
+            reject = job['verdict'] == False or (job['verdict'] is None and style.REJECT_ON_MISS == True)
+            self.counts['rejected' if reject == True else 'passed'] = self.counts['rejected' if reject == True else 'passed'] + 1
+
+        if reject == True and self.actuator is not None:
+            self.actuator.fire()
+        if self.on_event is not None:
+            self.on_event('gate', job)
@@ -0,0 +1,107 @@
+import threading, time
+import style
+import image_processing as img_proc
+
+class live_scorer:
+    '''
+    Definition:
+    -----------
+    Class scores the live video stream of run-mode in the background.\n
+    The UI thread hands over the latest frame, a worker thread estimates the color of every ROI and compares it with the reference color.\n
+    Estimate is the plain mean color (see `image_processing.estimate_mean_colors`), compared with the plain mean of the reference image
+    ('preview_color', stored by calibration), so it is an approximate indicator and may differ from the verdict of an inspection.\n
+    ROIs calibrated before 'preview_color' existed are not scored.\n
+    Only one frame is ever held: a frame that arrives while another one is waiting replaces it (frames are dropped, never queued).\n
+    Scoring is throttled to one pass every `interval` seconds so that it never competes with the stream for CPU.\n
+
+    Attributes:
+    -----------
+    `config` : dict
+        contents of the json file containing the coordinates and reference colors of the ROI.\n
+
+    `error_margin` : Float
+        user-entered error-margin in percent.\n
+
+    `legacy_size` : Int
+        side of the square legacy (pixel) ROI coordinates were drawn on, i.e. the screen height (see `image_processing.ROI_points`).\n
+
+    `interval` : Float
+        minimum time between two scoring passes (in seconds).\n
+
+    '''
+    def __init__(self, config, error_margin, legacy_size=None, interval=style.LIVE_SCORING_INTERVAL):
+        self.config = config
+        self.error_margin = img_proc.clamp_error_margin(error_margin)
+        self.legacy_size = legacy_size
+        self.interval = interval
+        self.frames_scored = 0
+        self.frames_dropped = 0
+
+        self._results = {}
+        self._frame = None
+        self._lock = threading.Lock()
+        self._frame_ready = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._worker, name='live_scorer', daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        '''
+        Definition:
+        -----------
+        Hands over the latest square B-G-R frame to the worker thread.\n
+        Function never blocks; an unscored frame still waiting is dropped.\n
+        '''
+        with self._lock:
+            if self._frame is not None:
+                self.frames_dropped = self.frames_dropped + 1
+            self._frame = frame
+        self._frame_ready.set()
+
+    def latest(self):
+        '''
+        Definition:
+        -----------
+        Returns the most recent verdict of every ROI as a dict of ROI name -> True/False.\n
+        Dict is empty until the first frame has been scored.\n
+        '''
+        with self._lock:
+            return self._results
+
+    def stop(self):
+        '''
+        Definition:
+        -----------
+        Stops the worker thread, any frame still waiting is discarded.\n
+        '''
+        self._running = False
+        self._frame_ready.set()
+
+    def _worker(self):
+        next_pass = 0.0
+        while self._running:
+            self._frame_ready.wait()
+            self._frame_ready.clear()
+
+            # [NOTE EXPLANATION] Throttle scoring, newer frames keep replacing the waiting one meanwhile.
+            delay = next_pass - time.monotonic()
+            if delay > 0: time.sleep(delay)
+
+            with self._lock:
+                frame, self._frame = self._frame, None
+            if frame is None or self._running == False:
+                continue
+            next_pass = time.monotonic() + self.interval
+
+            # [NOTE EXPLANATION] Map ROIs onto the native pixels of the frame, the frame itself is never resized.
+            config = img_proc.scale_config(self.config, frame.shape[0], legacy_size=self.legacy_size)
+            config = {key: config[key] for key in config if 'preview_color' in config[key]}
+            colors = img_proc.estimate_mean_colors(frame, config)
+            results = {}
+            for key in colors:
+                error = img_proc.color_error(config[key]['preview_color'], colors[key])
+                results[key] = error < self.error_margin
+
+            with self._lock:
+                self._results = results
+                self.frames_scored = self.frames_scored + 1
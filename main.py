@@ -10,13 +10,32 @@
 from numpy import imag
 import cv2 as cv                        # NOTE Open CV             library/ies
 import tkinter as tk                    # NOTE Tkinter             library/ies
+from tkinter import simpledialog        # NOTE Tkinter             library/ies
 from PIL import Image, ImageTk          # NOTE Pillow              library/ies
-import time, json, random, os           # NOTE Other basic         library/ies
+import time, random, os, atexit         # NOTE Other basic         library/ies
+import collections                      # NOTE Other basic         library/ies
 import style                            # NOTE style.py            file
 import image_processing as img_proc     # NOTE image_processing.py file
+import live_preview                     # NOTE live_preview.py     file
+import config_store                     # NOTE config_store.py     file
+import control_server                   # NOTE control_server.py   file
+import metrics                          # NOTE metrics.py          file
+import recipe_library                   # NOTE recipe_library.py   file
+import classifier                       # NOTE classifier.py       file
+import quality_gate                     # NOTE quality_gate.py     file
+import capture                          # NOTE capture.py          file
+import analysis_worker                  # NOTE analysis_worker.py  file
+import profiling                        # NOTE profiling.py        file
+import process_control                  # NOTE process_control.py  file
+import presence_trigger                 # NOTE presence_trigger.py file
+import inspection_scheduler             # NOTE inspection_scheduler.py file
 import RPi.GPIO as GPIO
 
 screen_readstatus, screen_width, screen_height = img_proc.get_screensize()
+api_server = None
+analysis_supervisor = None
+reject_output = None
+process_monitor = None
         
 class run_device:
     '''
@@ -58,12 +77,23 @@ class run_device:
                                 font=(style.FONT,30,"bold"))
         self.label1.place(relx = 0.5, anchor=tk.CENTER,y=1*run_canvas_height//10)
 
+        # [NOTE EXPLANATION] Hidden control: triple-click on the title arms/disarms profiling of the next inspections.
+        self.label1.bind('<Triple-Button-1>', self.toggle_profiling)
+
         self.label2 = tk.Label(self.run_canvas)
         self.label2.configure(  background=style.COLOR_WHITE,
                                 foreground=style.COLOR_RED,
                                 font=(style.FONT,30))
         self.label2.place(relx = 0.5, anchor=tk.CENTER,y=3*run_canvas_height//10)
 
+        # [NOTE EXPLANATION] Compact control-chart of the ROIs (statistical process control), between notification label and buttons.
+        self.process_control = process_monitor
+        if self.process_control is not None:
+            self.chart_width, self.chart_height = int(0.8*run_canvas_width), run_canvas_height//12
+            self.chart_canvas = tk.Canvas(self.run_canvas, width=self.chart_width, height=self.chart_height)
+            self.chart_canvas.configure(background=style.COLOR_BLACK, highlightthickness=0)
+            self.chart_canvas.place(relx = 0.5, anchor=tk.CENTER, y=0.41*run_canvas_height)
+
         # [NOTE EXPLANATION] Create and configure and place buttons on main page/canvas.
         self.button1=tk.Button(self.run_canvas, text="TRIGGER CAMERA", command=self.take_picture_now)
         self.button1.configure( width=30, 
@@ -85,20 +115,99 @@ class run_device:
                                 activeforeground=style.COLOR_WHITE)
         self.button2.place(relx = 0.5, anchor=tk.CENTER, y=6*screen_height//8)
 
+        # [NOTE EXPLANATION] Create recipe selector (switch product without re-calibrating) and save-recipe button.
+        active = recipe_library.active_recipe()
+        self.recipe_name = tk.StringVar(value=active.name if active is not None else 'SELECT RECIPE')
+        self.recipe_menu = tk.OptionMenu(self.run_canvas, self.recipe_name, '')
+        self.recipe_menu.configure( width=27,
+                                    font=(style.FONT, 15),
+                                    background=style.COLOR_WHITE,
+                                    foreground=style.COLOR_BLACK)
+        self.recipe_menu.place(relx = 0.5, anchor=tk.CENTER, y=5*screen_height//8)
+        self.refresh_recipe_menu()
+
+        self.button3=tk.Button(self.run_canvas, text="SAVE AS RECIPE", command=self.save_recipe)
+        self.button3.configure( width=30, 
+                                height =1,
+                                font=(style.FONT, 15), 
+                                background=style.COLOR_BLUE, 
+                                activebackground=style.COLOR_DARKBLUE,
+                                foreground=style.COLOR_WHITE,
+                                activeforeground=style.COLOR_WHITE)
+        self.button3.place(relx = 0.5, anchor=tk.CENTER, y=7*screen_height//8)
+
+        # [NOTE EXPLANATION] In classify-mode, the last part inspected can be added to the catalogue as a new class.
+        if style.SORTING_MODE == 'classify':
+            self.button3.configure(width=14)
+            self.button3.place(relx = 0.28, anchor=tk.CENTER, y=7*screen_height//8)
+            self.button4=tk.Button(self.run_canvas, text="ADD AS CLASS", command=self.add_class, state=tk.DISABLED)
+            self.button4.configure( width=14, 
+                                    height =1,
+                                    font=(style.FONT, 15), 
+                                    background=style.COLOR_BLUE, 
+                                    activebackground=style.COLOR_DARKBLUE,
+                                    foreground=style.COLOR_WHITE,
+                                    activeforeground=style.COLOR_WHITE)
+            self.button4.place(relx = 0.72, anchor=tk.CENTER, y=7*screen_height//8)
+
         # NOTE configure gpios here
-        with open(style.JSON_FILE, 'r') as file:
-            self.config = json.load(file)
-            file.close()
-            # print(self.config)
+        self.config = config_store.read_json(style.JSON_FILE)
+        # print(self.config)
+
+        # [NOTE EXPLANATION] Start live-scoring of the stream (runs on its own thread), if enabled.
+        self.live_scorer = None
+        if style.LIVE_SCORING == True:
+            param_config = config_store.read_json(style.APP_CONFIG_JSON)
+            self.live_scorer = live_preview.live_scorer(self.config, param_config['error_margin'], screen_height)
+
+        # [NOTE EXPLANATION] Gate which keeps blurred / badly exposed / moving frames away from the clustering.
+        self.quality_gate = None
+        if style.QUALITY_GATE == True:
+            self.quality_gate = quality_gate.frame_quality_gate(self.config, config_store.read_json(style.APP_CONFIG_JSON), screen_height)
+
+        # [NOTE EXPLANATION] Software trigger, inspects once a part has settled in front of the camera (no trigger sensor needed).
+        self.presence_trigger = presence_trigger.presence_trigger(self.config, screen_height) if style.PRESENCE_TRIGGER == True else None
+
+        # [NOTE EXPLANATION] Conveyor: parts are inspected in deadline order while the stream keeps running, and rejected at the gate.
+        # [NOTE EXPLANATION] Scheduler threads hand their events over through a deque, the stream-loop shows them.
+        self.scheduler = None
+        self.scheduler_events = collections.deque()
+        if style.DEADLINE_SCHEDULER == True:
+            self.scheduler = inspection_scheduler.inspection_scheduler(self.scheduled_analysis, reject_output,
+                                                                       lambda kind, job: self.scheduler_events.append((kind, job)))
+
+        # [NOTE EXPLANATION] Let the control-server trigger inspections while this page is open.
+        self.api_trigger = False
+        if api_server is not None:
+            api_server.trigger_callback = self.request_trigger
 
         # [NOTE EXPLANATION] Configure camera and stream-variables.
-        self.camera = cv.VideoCapture(style.USB_CAMERA)
-        self.camera.set(cv.CAP_PROP_FPS, style.VIDEO_STREAM_FPS)
+        self.camera = open_camera(self.config)
+        self.frame_size = None
+        self.analysis_job = None
+        self.profile_inspection = False
         self.picture_clicked = False
         self.stream_interval = 10 #miliseconds
+        self.stream_job = None
+        if self.process_control is not None:
+            self.draw_control_chart()
         self.update_stream()
 
     def take_picture_now(self):
+        '''
+        Definition:
+        -----------
+        Function runs one inspection (see `click_and_compare`), under the profiler if profiling is armed (see `profiling.py`).\n
+        When profiling is not armed, this costs a single check.\n
+        '''
+        self.profile_inspection = profiling.take()
+        if self.profile_inspection == False:
+            self.click_and_compare()
+        else:
+            with profiling.capture('take_picture_now'):
+                self.click_and_compare()
+
+    def click_and_compare(self):
         '''
         Definition:
         -----------
@@ -114,19 +223,31 @@ class run_device:
         '''
         # [NOTE EXPLANATION] Check if camera is connected to USB-port or not.
         if self.camera.isOpened() == True:
-            ret, frame = self.camera.read()
-            if ret == True:
-                # [NOTE EXPLANATION] Image needs to be cropped to a 1:1 aspect ratio.
-                img_width, img_height = int(frame.shape[1]), int(frame.shape[0])
-                if img_width > img_height:
-                    frame = frame[0:img_height, int((img_width - img_height)/2):int((img_width + img_height)/2)]
-                else:
-                    frame = frame[int((img_height - img_width)/2):int((img_height + img_width)/2), 0:img_width]
-                
-                # [NOTE EXPLANATION] resize and store said image.
-                dsize = (screen_height, screen_height)
-                frame = cv.resize(frame, dsize=dsize)                
-                cv.imwrite(style.REALTIME_IMAGE, frame)
+            # [NOTE EXPLANATION] Skip frames buffered before the trigger, the part must be on the picture.
+            ret, frame, grab_time = capture.fresh_frame(self.camera)
+
+            # [NOTE EXPLANATION] Reject blurred / badly exposed / moving frames, retrying within the time-budget.
+            quality = None
+            if ret == True and self.quality_gate is not None:
+                frame, quality = self.quality_gate.capture(self.camera, frame)
+                if quality['attempts'] > 1: grab_time = time.monotonic()
+
+            if self.scheduler is not None:
+                # [NOTE EXPLANATION] Conveyor: hand the part to the scheduler and keep streaming, a part without a good frame is still tracked to the gate.
+                good = ret == True and (quality is None or quality['passed'] == True)
+                if good == True: metrics.observe('frame_age', time.monotonic() - grab_time)
+                self.scheduler.submit(frame if good == True else None, grab_time)
+                self.label2.configure(text='PART {}\nIN FLIGHT'.format('SUBMITTED' if good == True else 'NOT CAPTURED'))
+
+            elif quality is not None and quality['passed'] == False:
+                # [NOTE EXPLANATION] No good frame in time: flag "no decision" and keep streaming.
+                self.label1.configure(text='NO DECISION\n' + quality['reason'])
+                if api_server is not None:
+                    api_server.publish_result({}, no_decision=quality)
+
+            elif ret == True:
+                # [NOTE EXPLANATION] Keep the native frame for analysis, ROIs are mapped onto it (nothing is resized).
+                self.frame_size = min(frame.shape[:2])
 
                 # [NOTE EXPLANATION] Disconnect camera now.
                 if self.camera.isOpened() == True:
@@ -135,60 +256,29 @@ class run_device:
                 # [NOTE EXPLANATION] Notify user that picture has been taken successfully.
                 self.picture_clicked = True
                 self.label2.configure(text='PICTURE CLICKED\nSUCCESSFULLY')
-                self.label1.configure(text="RESULTS")
                 self.button1.configure(state=tk.DISABLED)
-                self.button2.configure(command=self.run_again)
-
-                # [NOTE EXPLANATION] Get dominant color in every ROI.
-                img_proc.compare_colors(style.REALTIME_IMAGE, style.JSON_FILE, style.OUTPUT_FILE, style.MASK_IMAGE_PATH)
-                # [NOTE EXPLANATION] Display picture clicked on the canvas.
-                image = cv.imread(style.REALTIME_IMAGE)
-                image = cv.cvtColor(image, cv.COLOR_BGR2RGBA)
-                pil_frame = Image.fromarray(image)
-                pil_frame = pil_frame.resize((screen_height, screen_height))
-                pil_pic = ImageTk.PhotoImage(image = pil_frame)
-                self.video_canvas.create_image((0, 0), image=pil_pic, anchor=tk.NW)
-                self.video_canvas.image = pil_pic
-
-                # [NOTE EXPLANATION] Open config file/s.
-                with open(style.OUTPUT_FILE, 'r') as file:
-                    color_config = json.load(file)
-                    file.close()
-
-                with open(style.APP_CONFIG_JSON, 'r') as file:
-                    param_config = json.load(file)
-                    file.close()
-
-                # [NOTE EXPLANATION] Highlight ROI on the screen, and in highlight them in GREEN/RED.
-                # [NOTE EXPLANATION] GREEN indicates that color has matched.
-                # [NOTE EXPLANATION] RED indicates that color has not matched.
-                color_dict = {}
-                for key in color_config:
-                    success = color_config[key]["success_status"]
-                    fill_color = style.RESULT_GREEN if success == True else style.RESULT_RED
-                    color_dict[key] = fill_color
-                    # print(fill_color, success)
-                for key in self.config:
-                    coordinates = self.config[key]["coordinates"]
-                    for i in range(1, len(coordinates)):
-                        self.video_canvas.create_line(  coordinates[i-1][0], coordinates[i-1][1],
-                                                        coordinates[i][0], coordinates[i][1],
-                                                        fill=color_dict[key], 
-                                                        width=8)                
-
-                    self.video_canvas.create_line(      coordinates[0][0], coordinates[0][1],
-                                                        coordinates[len(coordinates)-1][0], coordinates[len(coordinates)-1][1],
-                                                        fill=color_dict[key], 
-                                                        width=8)
-                    extremes = self.config[key]['extremes_of_ROI']
-                    # self.video_canvas
-
-                    # [NOTE EXPLANATION] Display the difference in color in terms of percentage.
-                    label = tk.Label(self.video_canvas, text=str(color_config[key]['error']) + ' / ' + str(param_config['error_margin']))
-                    label.configure(background=style.COLOR_BLACK,
-                                    foreground=style.COLOR_WHITE,
-                                    font=(style.FONT,10,"bold"))
-                    label.place(x=extremes[0], y=extremes[1] - 30)
+
+                # [NOTE EXPLANATION] Get dominant color in every ROI (re-using the compiled masks of the active recipe).
+                metrics.observe('frame_age', time.monotonic() - grab_time)
+                job_id = None
+                if analysis_supervisor is not None:
+                    # [NOTE EXPLANATION] Analyse in the worker process, the UI keeps running and polls for the result.
+                    # [NOTE EXPLANATION] Frame too large for a slot, no free slot or worker not restartable: analyse in-process instead.
+                    try:
+                        recipe = recipe_library.active_recipe()
+                        job_id = analysis_supervisor.submit(frame, style.JSON_FILE, style.MASK_IMAGE_PATH, screen_height,
+                                                            recipe.name if recipe is not None else None, profile=self.profile_inspection)
+                    except (ValueError, RuntimeError) as err:
+                        print('Error received while handing over to analysis worker is: {}'.format(err))
+                        metrics.increment('analysis_worker_fallbacks')
+                if job_id is not None:
+                    self.label1.configure(text="ANALYSING")
+                    self.analysis_job = (job_id, self.run_page.after(style.ANALYSIS_POLL_INTERVAL, self.wait_for_analysis, job_id, frame, time.monotonic()))
+                else:
+                    with metrics.timed('inspection'):
+                        img_proc.inspect_frame(frame, style.JSON_FILE, style.OUTPUT_FILE, style.MASK_IMAGE_PATH,
+                                               masks=recipe_library.active_masks(self.config, self.frame_size), legacy_size=screen_height)
+                    self.show_result(frame)
             
             else:
                 self.label2.configure(text='PLEASE CLICK AGAIN')
@@ -197,11 +287,281 @@ class run_device:
 
         self.update_stream()
 
+    def wait_for_analysis(self, job_id, frame, started):
+        '''
+        Definition:
+        -----------
+        Polls the analysis worker (see `analysis_worker.py`) until the inspection of `frame` is done, then shows its result.\n
+        '''
+        # [NOTE EXPLANATION] Polling restarts a crashed child, which raises if it does not come up again.
+        try:
+            result = analysis_supervisor.poll(job_id)
+            if result is None:
+                self.analysis_job = (job_id, self.run_page.after(style.ANALYSIS_POLL_INTERVAL, self.wait_for_analysis, job_id, frame, started))
+                return
+            self.analysis_job = None
+            metrics.observe('inspection', time.monotonic() - started)
+            analysis_supervisor.finish(result, style.OUTPUT_FILE)
+        except (RuntimeError, KeyError) as err:
+            self.analysis_job = None
+            print('Error received while analysing is: {}'.format(err))
+            self.label1.configure(text='NO DECISION\nANALYSIS FAILED')
+            self.button2.configure(command=self.run_again)
+            if api_server is not None:
+                api_server.publish_result({}, no_decision={'passed': False, 'reason': 'ANALYSIS FAILED'})
+            return
+        self.show_result(frame)
+
+    def show_result(self, frame):
+        '''
+        Definition:
+        -----------
+        Shows the inspected picture with the verdict of every ROI, once the output file is written.\n
+        '''
+        self.label1.configure(text="RESULTS")
+        self.button2.configure(command=self.run_again)
+
+        # [NOTE EXPLANATION] Image needs to be cropped to a 1:1 aspect ratio, then it is stored.
+        frame = img_proc.square_crop(frame)
+        cv.imwrite(style.REALTIME_IMAGE, frame)
+
+        # [NOTE EXPLANATION] Display picture clicked on the canvas.
+        image = cv.cvtColor(frame, cv.COLOR_BGR2RGBA)
+        pil_frame = Image.fromarray(image)
+        pil_frame = pil_frame.resize((screen_height, screen_height))
+        pil_pic = ImageTk.PhotoImage(image = pil_frame)
+        self.video_canvas.delete('stream')
+        self.video_canvas.create_image((0, 0), image=pil_pic, anchor=tk.NW, tags='result')
+        self.video_canvas.image = pil_pic
+
+        # [NOTE EXPLANATION] Open config file/s (served from memory by the config-store).
+        color_config = config_store.read_json(style.OUTPUT_FILE)
+        param_config = config_store.read_json(style.APP_CONFIG_JSON)
+
+        # [NOTE EXPLANATION] In classify-mode, assign the part to its nearest product variant.
+        classification = None
+        if style.SORTING_MODE == 'classify':
+            classification = classifier.classify_result(color_config, param_config['error_margin'])
+            self.label2.configure(text='{}\nCONFIDENCE {:.0f}%'.format(classification['class'], 100*classification['confidence']))
+            self.button4.configure(state=tk.ACTIVE)
+
+        # [NOTE EXPLANATION] Update rolling statistics of every ROI (constant time), and redraw the control-chart.
+        spc_summary = None
+        if self.process_control is not None:
+            spc_summary = self.process_control.update(color_config, self.config)
+            self.draw_control_chart()
+
+        if api_server is not None:
+            api_server.publish_result(color_config, classification, process_control=spc_summary)
+
+        # [NOTE EXPLANATION] Highlight ROI on the screen, and in highlight them in GREEN/RED.
+        # [NOTE EXPLANATION] GREEN indicates that color has matched.
+        # [NOTE EXPLANATION] RED indicates that color has not matched.
+        # [NOTE EXPLANATION] In classify-mode, GREEN/RED tell whether the part belongs to a known class or not.
+        color_dict = {}
+        for key in color_config:
+            success = color_config[key]["success_status"]
+            if classification is not None:
+                success = classification['class'] != classifier.UNKNOWN_CLASS
+            fill_color = style.RESULT_GREEN if success == True else style.RESULT_RED
+            color_dict[key] = fill_color
+            # print(fill_color, success)
+        display_config = img_proc.scale_config(self.config, screen_height, legacy_size=screen_height)
+        for key in display_config:
+            coordinates = display_config[key]["coordinates"]
+            for i in range(1, len(coordinates)):
+                self.video_canvas.create_line(  coordinates[i-1][0], coordinates[i-1][1],
+                                                coordinates[i][0], coordinates[i][1],
+                                                fill=color_dict[key], 
+                                                width=8,
+                                                tags='result')                
+
+            self.video_canvas.create_line(      coordinates[0][0], coordinates[0][1],
+                                                coordinates[len(coordinates)-1][0], coordinates[len(coordinates)-1][1],
+                                                fill=color_dict[key], 
+                                                width=8,
+                                                tags='result')
+            extremes = display_config[key]['extremes_of_ROI']
+            # self.video_canvas
+
+            # [NOTE EXPLANATION] Display the difference in color in terms of percentage.
+            label = tk.Label(self.video_canvas, text=str(color_config[key]['error']) + ' / ' + str(param_config['error_margin']))
+            label.configure(background=style.COLOR_BLACK,
+                            foreground=style.COLOR_WHITE,
+                            font=(style.FONT,10,"bold"))
+            label.place(x=extremes[0], y=extremes[1] - 30)
+
+
+    def scheduled_analysis(self, frame, quick):
+        '''
+        Definition:
+        -----------
+        Inspects a part for the conveyor scheduler (runs on the scheduler thread, see `inspection_scheduler.py`).\n
+        Nothing is written to the output file, as several parts may be in flight.\n
+        '''
+        if analysis_supervisor is not None:
+            recipe = recipe_library.active_recipe()
+            return analysis_supervisor.inspect(frame, style.JSON_FILE, None, style.MASK_IMAGE_PATH, screen_height,
+                                               recipe.name if recipe is not None else None, quick=quick)
+        config = config_store.read_json(style.JSON_FILE)
+        return img_proc.inspect_frame(frame, style.JSON_FILE, None, style.MASK_IMAGE_PATH,
+                                      masks=recipe_library.active_masks(config, min(frame.shape[:2])), legacy_size=screen_height, quick=quick)
+
+    def show_scheduler_events(self):
+        '''
+        Definition:
+        -----------
+        Shows and publishes the verdicts and gate decisions handed over by the conveyor scheduler since the last stream frame.\n
+        '''
+        while len(self.scheduler_events) > 0:
+            kind, job = self.scheduler_events.popleft()
+            schedule = {'deadline_ms' : round(1000*(job['deadline'] - job['trigger_time']), 1),
+                        'latency_ms'  : None if job['finished'] is None else round(1000*(job['finished'] - job['trigger_time']), 1),
+                        'quick'       : job['quick'],
+                        'state'       : job['state']}
+            if kind == 'verdict':
+                self.label1.configure(text='PASS' if job['verdict'] == True else 'REJECT')
+                spc_summary = None
+                if self.process_control is not None:
+                    spc_summary = self.process_control.update(job['output'], self.config)
+                    self.draw_control_chart()
+                if api_server is not None:
+                    api_server.publish_result(job['output'], process_control=spc_summary, schedule=schedule)
+            elif job['state'] != inspection_scheduler.DONE:
+                # [NOTE EXPLANATION] Part reached the gate without a verdict: reported, never silently late.
+                reasons = {inspection_scheduler.NO_DECISION: 'NO DECISION', inspection_scheduler.FAILED: 'ANALYSIS FAILED'}
+                reason = reasons.get(job['state'], 'DEADLINE MISSED')
+                self.label1.configure(text=reason)
+                if api_server is not None:
+                    api_server.publish_result({}, no_decision={'passed': False, 'reason': reason}, schedule=schedule)
+
+    def draw_control_chart(self):
+        '''
+        Definition:
+        -----------
+        Draws the recent EWMA of every ROI in its reference color: baseline at the bottom, dashed alarm limit at the top.\n
+        ROIs in alarm are named on the chart.\n
+        '''
+        self.chart_canvas.delete('chart')
+        width, height = self.chart_width, self.chart_height
+
+        # [NOTE EXPLANATION] Chart points are scaled so that 0 is the baseline and 1 the alarm limit.
+        def y_of(value):
+            value = min(max(value, -0.25), 1.25)
+            return height*(1.25 - value)/1.5
+        self.chart_canvas.create_line(0, y_of(1.0), width, y_of(1.0), fill=style.RESULT_RED, dash=(4, 2), tags='chart')
+        self.chart_canvas.create_line(0, y_of(0.0), width, y_of(0.0), fill=style.COLOR_GREY, tags='chart')
+
+        step = width/max(style.SPC_CHART_POINTS - 1, 1)
+        for key in self.config:
+            points = self.process_control.chart(key)
+            if len(points) < 2: continue
+            coordinates = []
+            for index, value in enumerate(points):
+                coordinates.extend([index*step, y_of(value)])
+            self.chart_canvas.create_line(*coordinates, fill=img_proc.tkinter_compatible_color(self.config[key]['mean_color']), width=2, tags='chart')
+
+        alarms = self.process_control.alarms()
+        if len(alarms) > 0:
+            text = 'DRIFT ' + ' '.join('{} ({})'.format(key, '/'.join(alarms[key])) for key in sorted(alarms))
+            self.chart_canvas.create_text(4, 2, text=text, anchor=tk.NW, fill=style.RESULT_RED, font=(style.FONT, 9, "bold"), tags='chart')
+
+    def toggle_profiling(self, event=None):
+        '''
+        Definition:
+        -----------
+        Arms profiling for the next `style.PROFILE_INSPECTIONS` inspections, or disarms it if it is armed.\n
+        '''
+        if profiling.remaining() > 0:
+            profiling.disarm()
+        else:
+            profiling.arm()
+
     def gpioCallback(self, channel):
+        # [NOTE EXPLANATION] Runs on the GPIO thread, so only raise the trigger-flag (Tkinter is not thread-safe).
         print("Channel Interrupt {}".format(channel))
         if channel == style.GPIO_CAMERA_TRIGGER_PIN:
             print("yes executing")
-            self.take_picture_now()
+            self.request_trigger()
+
+    def request_trigger(self):
+        '''
+        Definition:
+        -----------
+        Called by the control-server or GPIO (from their own threads) when an inspection is requested.\n
+        Function only raises a flag, the inspection itself is run by the stream-loop on the UI thread.\n
+        Returns False if the page is busy (result still shown, or a trigger already pending).\n
+        '''
+        if self.picture_clicked == True or self.api_trigger == True:
+            return False
+        self.api_trigger = True
+        return True
+
+    def add_class(self):
+        '''
+        Definition:
+        -----------
+        Asks the user for a class name and adds the ROI colors of the last inspected part to the catalogue under said name.\n
+        '''
+        name = simpledialog.askstring('Add Class', 'CLASS NAME', parent=self.run_page)
+        if name is None or name.strip() == '':
+            return
+        color_config = config_store.read_json(style.OUTPUT_FILE)
+        try:
+            classifier.add_class(name.strip(), {key: color_config[key]['mean_color'] for key in color_config})
+        except (OSError, ValueError) as err:
+            print('Error received while adding class is: {}'.format(err))
+            self.label2.configure(text='CLASS COULD\nNOT BE ADDED')
+            return
+        self.label2.configure(text='CLASS ADDED\n' + name.strip())
+        self.button4.configure(state=tk.DISABLED)
+
+    def refresh_recipe_menu(self):
+        '''
+        Definition:
+        -----------
+        Fills the recipe selector with all recipes stored in the recipe folder.\n
+        '''
+        menu = self.recipe_menu['menu']
+        menu.delete(0, tk.END)
+        for name in recipe_library.list_recipes():
+            menu.add_command(label=name, command=lambda name=name: self.switch_recipe(name))
+
+    def switch_recipe(self, name):
+        '''
+        Definition:
+        -----------
+        Switches the station to another product by activating its recipe, the camera keeps streaming.\n
+        '''
+        if self.picture_clicked == True:
+            self.label2.configure(text='GO BACK TO STREAM\nBEFORE SWITCHING')
+            return
+        try:
+            recipe_library.activate_recipe(name)
+        except (OSError, ValueError) as err:
+            print('Error received while switching recipe is: {}'.format(err))
+            self.label2.configure(text='RECIPE COULD\nNOT BE LOADED')
+            return
+        self.recipe_name.set(name)
+        self.config = config_store.read_json(style.JSON_FILE)
+
+    def save_recipe(self):
+        '''
+        Definition:
+        -----------
+        Asks the user for a product name and stores the current calibration as a recipe under said name.\n
+        '''
+        name = simpledialog.askstring('Save Recipe', 'PRODUCT NAME', parent=self.run_page)
+        if name is None or name.strip() == '':
+            return
+        try:
+            recipe_library.save_current_as_recipe(name.strip(), mask_size=self.frame_size)
+        except (OSError, ValueError) as err:
+            print('Error received while saving recipe is: {}'.format(err))
+            self.label2.configure(text='RECIPE COULD\nNOT BE SAVED')
+            return
+        self.recipe_name.set(name.strip())
+        self.refresh_recipe_menu()
 
     def run_again(self):
         '''
@@ -213,13 +573,15 @@ class run_device:
         '''
         for widgets in self.video_canvas.winfo_children():
             widgets.destroy()
+        self.video_canvas.delete('result')
+        if style.SORTING_MODE == 'classify':
+            self.button4.configure(state=tk.DISABLED)
         self.button1.configure(state=tk.ACTIVE)
         self.button2.configure(command=self.go_back)
         self.label1.configure(text="CLICK PICTURE\nTO COMPARE")
         self.label2.configure(text="")
         self.picture_clicked = False
-        self.camera = cv.VideoCapture(style.USB_CAMERA)
-        self.camera.set(cv.CAP_PROP_FPS, style.VIDEO_STREAM_FPS)
+        self.camera = open_camera(self.config)
         self.update_stream()
 
     def update_stream(self):
@@ -233,52 +595,107 @@ class run_device:
         The ROIs are also highlighted in their respective colors to show which ROI corresponds to which color.\n
         
         '''
+        # [NOTE EXPLANATION] Only one stream-loop may run, a direct call replaces the scheduled one.
+        if self.stream_job is not None:
+            self.run_page.after_cancel(self.stream_job)
+            self.stream_job = None
+
         if self.picture_clicked == False:
             # self.camera = cv.VideoCapture(style.USB_CAMERA)
 
+            if self.scheduler is not None:
+                self.show_scheduler_events()
+
+            # [NOTE EXPLANATION] Serve a pending control-server/GPIO trigger, take_picture_now continues the stream-loop.
+            if self.api_trigger == True:
+                self.api_trigger = False
+                self.take_picture_now()
+                return
+
+            # [NOTE EXPLANATION] Pick up config changes made on disk (hot reload), costs nothing if unchanged.
+            self.config = config_store.read_json(style.JSON_FILE)
+            if self.quality_gate is not None:
+                self.quality_gate.update(self.config, config_store.read_json(style.APP_CONFIG_JSON), config_store.version(style.JSON_FILE))
+            if self.live_scorer is not None:
+                self.live_scorer.config = self.config
+                self.live_scorer.error_margin = img_proc.clamp_error_margin(config_store.read_json(style.APP_CONFIG_JSON)['error_margin'])
+
             # [NOTE EXPLANATION] Check if camera is connected to USB-port or not.
             if self.camera.isOpened() == True:
                 ret, frame = self.camera.read()
                 if ret == True:
                     # [NOTE EXPLANATION] Image needs to be cropped to a 1:1 aspect ratio.
-                    img_width, img_height = int(frame.shape[1]), int(frame.shape[0])
-                    if img_width > img_height:
-                        frame = frame[0:img_height, int((img_width - img_height)/2):int((img_width + img_height)/2)]
-                    else:
-                        frame = frame[int((img_height - img_width)/2):int((img_height + img_width)/2), 0:img_width]
+                    frame = img_proc.square_crop(frame)
+                    self.frame_size = frame.shape[0]
                     # img_width, img_height = int(frame.shape[1]), int(frame.shape[0])
 
+                    # [NOTE EXPLANATION] Let the quality-gate know the latest frame, for its motion check.
+                    if self.quality_gate is not None:
+                        self.quality_gate.observe(frame)
+
+                    # [NOTE EXPLANATION] Part arrived and settled: raise the trigger-flag, it is served by the next pass of the stream-loop.
+                    if self.presence_trigger is not None:
+                        self.presence_trigger.update(self.config, config_store.read_json(style.APP_CONFIG_JSON), (config_store.version(style.JSON_FILE), config_store.version(style.APP_CONFIG_JSON)))
+                        if self.presence_trigger.observe(frame) == True:
+                            self.request_trigger()
+
+                    # [NOTE EXPLANATION] Hand latest frame to the live-scorer, it is dropped if scorer is still busy.
+                    if self.live_scorer is not None:
+                        self.live_scorer.submit(frame)
+                        live_results = self.live_scorer.latest()
+                    else:
+                        live_results = {}
+
                     # [NOTE EXPLANATION] resize and store and show said image on canvas.
                     frame = cv.cvtColor(frame, cv.COLOR_BGR2RGB)
                     pil_frame = Image.fromarray(frame)
                     pil_frame = pil_frame.resize((screen_height, screen_height))
                     pil_pic = ImageTk.PhotoImage(image = pil_frame)
-                    self.video_canvas.create_image((0, 0), image=pil_pic, anchor=tk.NW)
+                    # [NOTE EXPLANATION] Remove previous frame (and ROI outlines) first, else canvas-items pile up every frame.
+                    self.video_canvas.delete('stream')
+                    self.video_canvas.create_image((0, 0), image=pil_pic, anchor=tk.NW, tags='stream')
                     self.video_canvas.image = pil_pic
 
                     # [NOTE EXPLANATION] Show the ROIs on the stream, with the color in which they were detected while calibrating.
-                    for key in self.config:
-                        coordinates = self.config[key]["coordinates"]
-                        color = img_proc.tkinter_compatible_color(self.config[key]["mean_color"])
+                    # [NOTE EXPLANATION] Once live-scoring has a verdict for an ROI, it is tinted GREEN/RED instead.
+                    display_config = img_proc.scale_config(self.config, screen_height, legacy_size=screen_height)
+                    if len(live_results) > 0:
+                        self.video_canvas.create_text(  10, 10, anchor=tk.NW, text='LIVE: APPROXIMATE (MEAN COLOR)',
+                                                        fill=style.COLOR_WHITE, font=(style.FONT, 12, "bold"), tags='stream')
+                    for key in display_config:
+                        coordinates = display_config[key]["coordinates"]
+                        if key in live_results:
+                            color = style.RESULT_GREEN if live_results[key] == True else style.RESULT_RED
+                        else:
+                            color = img_proc.tkinter_compatible_color(self.config[key]["mean_color"])
                         for i in range(1, len(coordinates)):
                             self.video_canvas.create_line(  coordinates[i-1][0], coordinates[i-1][1],
                                                             coordinates[i][0], coordinates[i][1],
                                                             fill=color, 
-                                                            width=8)                
+                                                            width=8,
+                                                            tags='stream')                
 
                         self.video_canvas.create_line(      coordinates[0][0], coordinates[0][1],
                                                             coordinates[len(coordinates)-1][0], coordinates[len(coordinates)-1][1],
                                                             fill=color, 
-                                                            width=8)
+                                                            width=8,
+                                                            tags='stream')
                                                             
-                self.label2.configure(text="TAKE A PICTURE\nTO RUN DEVICE")     
+                if profiling.remaining() > 0:
+                    self.label2.configure(text='PROFILING NEXT\n{} INSPECTIONS'.format(profiling.remaining()))
+                elif self.scheduler is not None:
+                    summary = self.scheduler.summary()
+                    self.label2.configure(text='IN FLIGHT {}  REJECTED {}\nMISSED {}  FAILED {}  QUICK {}'.format(
+                                               summary['in_flight'], summary['rejected'], summary['missed'], summary['failed'], summary['quick']))
+                else:
+                    self.label2.configure(text="TAKE A PICTURE\nTO RUN DEVICE")     
             else:
                 # [NOTE EXPLANATION] Notify user that camera is not connected.
                 time.sleep(0.015)
                 # print('camera not connected')
                 self.label2.configure(text='ERROR!\nCAMERA NOT CONNECTED')
 
-            self.run_page.after(self.stream_interval, self.update_stream)
+            self.stream_job = self.run_page.after(self.stream_interval, self.update_stream)
 
     def go_back(self):
         '''
@@ -289,6 +706,16 @@ class run_device:
         '''
         if self.picture_clicked == False and self.camera.isOpened() == True:
             self.camera.release()
+        if self.analysis_job is not None:
+            self.run_page.after_cancel(self.analysis_job[1])
+            analysis_supervisor.discard(self.analysis_job[0])
+            self.analysis_job = None
+        if self.live_scorer is not None:
+            self.live_scorer.stop()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        if api_server is not None:
+            api_server.trigger_callback = None
         self.run_page.destroy()
         GPIO.remove_event_detect(12)
 
@@ -302,7 +729,9 @@ class select_ROI:
     User can add/modify/delete points for a ROI.\n
     User can submit multiple ROIs.\n
     User can reset screen to select ROI/s again.\n
-    Any region is defined by a minimum of 3 vertex-points.\n
+    Any region is a rectangle (2 corners), circle (centre and rim), ellipse (2 corners of its box) or polygon (a minimum of 3 vertex-points).\n
+    Polygons may have holes, outlined after the polygon itself.\n
+    ROIs may also be proposed automatically (regions of uniform color on the picture), then edited and accepted one by one.\n
     Class performs exception-handling of allowing an ROI to exist only if 3 points are selected by user.\n
     Class also performs exception-handling of ensuring that atleast one ROI is selected for calibration of device.\n
     Class then calls image-processing functions to compute dominant color of individual ROI/s and storing data in a file.\n
@@ -312,6 +741,7 @@ class select_ROI:
     def __init__(self, previous_page):
         self.prev_page = previous_page
         self.all_ROI = {}
+        self.white_patch = None
         self.ROI_index = 1
         self.temp_ROI = []
         self.tkinter_ROI_points = []
@@ -319,6 +749,9 @@ class select_ROI:
         self.first_x, self.first_y = None, None
         self.previous_x, self.previous_y = None, None 
         self.current_x, self.current_x = None, None
+        self.shape_mode = img_proc.POLYGON
+        self.use_palette = False
+        self.proposals = None
 
         # [NOTE EXPLANATION] Start the select-ROI page.
         self.ROI_page = tk.Toplevel()
@@ -360,9 +793,49 @@ class select_ROI:
         self.label2.configure(  background=style.COLOR_WHITE,
                                 foreground=style.COLOR_RED,
                                 font=(style.FONT,30))
-        self.label2.place(relx = 0.5, anchor=tk.CENTER,y=2.5*button_canvas_height//10)
+        self.label2.place(relx = 0.5, anchor=tk.CENTER,y=2.2*button_canvas_height//10)
 
         # [NOTE EXPLANATION] Create and configure and place buttons on said page/canvas.
+        self.button6=tk.Button(self.button_canvas, text="SHAPE: POLYGON", command=self.next_shape)
+        self.button6.configure( width=16, 
+                                height =2,
+                                font=(style.FONT, 15), 
+                                background=style.COLOR_BLUE, 
+                                activebackground=style.COLOR_DARKBLUE,
+                                foreground=style.COLOR_WHITE,
+                                activeforeground=style.COLOR_WHITE)
+        self.button6.place(relx = 0.28, anchor=tk.CENTER, y=2.45*screen_height//8)
+
+        self.button7=tk.Button(self.button_canvas, text="AUTO-PROPOSE", command=self.next_proposal)
+        self.button7.configure( width=16, 
+                                height =2,
+                                font=(style.FONT, 15), 
+                                background=style.COLOR_BLUE, 
+                                activebackground=style.COLOR_DARKBLUE,
+                                foreground=style.COLOR_WHITE,
+                                activeforeground=style.COLOR_WHITE)
+        self.button7.place(relx = 0.72, anchor=tk.CENTER, y=2.45*screen_height//8)
+
+        self.button5=tk.Button(self.button_canvas, text="WHITE PATCH", command=self.mark_white_patch)
+        self.button5.configure( width=16, 
+                                height =2,
+                                font=(style.FONT, 15), 
+                                background=style.COLOR_BLUE, 
+                                activebackground=style.COLOR_DARKBLUE,
+                                foreground=style.COLOR_WHITE,
+                                activeforeground=style.COLOR_WHITE)
+        self.button5.place(relx = 0.28, anchor=tk.CENTER, y=3.2*screen_height//8)
+
+        self.button8=tk.Button(self.button_canvas, text="PALETTE: OFF", command=self.toggle_palette)
+        self.button8.configure( width=16, 
+                                height =2,
+                                font=(style.FONT, 15), 
+                                background=style.COLOR_BLUE, 
+                                activebackground=style.COLOR_DARKBLUE,
+                                foreground=style.COLOR_WHITE,
+                                activeforeground=style.COLOR_WHITE)
+        self.button8.place(relx = 0.72, anchor=tk.CENTER, y=3.2*screen_height//8)
+
         self.button1=tk.Button(self.button_canvas, text="DELETE RECENT ROI POINT", command=self.remove_last_ROI)
         self.button1.configure( width=30, 
                                 height =2,
@@ -410,7 +883,14 @@ class select_ROI:
         -----------
         Stores the (x, y) coordinates of the point when user clicks via mouse or via touch-screen.\n
         '''
-        x, y = event.x, event.y
+        self.place_ROI_point(event.x, event.y)
+
+    def place_ROI_point(self, x, y):
+        # [NOTE EXPLANATION] Adds a point (canvas pixels) to the current ROI, whether clicked or proposed.
+        # [NOTE EXPLANATION] Rectangles, circles and ellipses are defined by 2 points.
+        if self.shape_mode in (img_proc.RECTANGLE, img_proc.CIRCLE, img_proc.ELLIPSE) and len(self.temp_ROI) >= 2:
+            self.label2.configure(text='ONLY 2 POINTS\nFOR THIS SHAPE')
+            return
         self.current_x, self.current_y = x, y
         if len(self.temp_ROI) == 0: 
             self.first_x = x
@@ -451,26 +931,145 @@ class select_ROI:
         if len(self.tkinter_ROI_lines) != 0: 
             self.image_canvas.delete(self.tkinter_ROI_lines.pop())
 
+    def next_shape(self):
+        '''
+        Definition:
+        -----------
+        Switches the shape of the next ROI: polygon, rectangle, circle, ellipse, or a hole in the last polygon.\n
+        '''
+        modes = list(img_proc.ROI_SHAPES) + ['hole']
+        self.shape_mode = modes[(modes.index(self.shape_mode) + 1) % len(modes)]
+        self.button6.configure(text='SHAPE: ' + self.shape_mode.upper())
+        hints = {   img_proc.POLYGON    : 'CLICK 3 OR\nMORE POINTS',
+                    img_proc.RECTANGLE  : 'CLICK 2 OPPOSITE\nCORNERS',
+                    img_proc.CIRCLE     : 'CLICK CENTRE\nTHEN RIM',
+                    img_proc.ELLIPSE    : 'CLICK 2 CORNERS\nOF ITS BOX',
+                    'hole'              : 'OUTLINE A HOLE\nIN LAST POLYGON'}
+        self.label2.configure(text=hints[self.shape_mode])
+
+    def next_proposal(self):
+        '''
+        Definition:
+        -----------
+        Loads the next automatically proposed ROI (see `image_processing.propose_ROIs`) as the points of the current polygon.\n
+        All proposals are outlined dashed on first use. A loaded proposal is edited like clicked points
+        (delete or add points) and accepted with ADD ANOTHER ROI, pressing again skips to the next proposal.\n
+        '''
+        if self.proposals is None:
+            self.proposals = img_proc.propose_ROIs(cv.imread(style.REFERENCE_IMAGE))
+            for proposal in self.proposals:
+                vertices = img_proc.ROI_points({'normalised': proposal}, screen_height)
+                self.image_canvas.create_polygon(*[value for vertex in vertices for value in vertex], outline=style.SHAPE_OUTLINE, fill='', dash=(4, 4), width=1, tags='proposal')
+
+        # [NOTE EXPLANATION] Points of the current (unfinished) ROI give way to the proposal.
+        for item in self.tkinter_ROI_points + self.tkinter_ROI_lines:
+            self.image_canvas.delete(item)
+        self.temp_ROI = []
+        self.tkinter_ROI_points = []
+        self.tkinter_ROI_lines = []
+        self.first_x, self.first_y = None, None
+        self.previous_x, self.previous_y = None, None
+
+        if len(self.proposals) == 0:
+            self.label2.configure(text='NO MORE\nPROPOSALS')
+            return
+        if self.shape_mode != img_proc.POLYGON:
+            self.shape_mode = img_proc.POLYGON
+            self.button6.configure(text='SHAPE: ' + self.shape_mode.upper())
+
+        for x, y in img_proc.ROI_points({'normalised': self.proposals.pop(0)}, screen_height):
+            self.place_ROI_point(x, y)
+        self.label2.configure(text='PROPOSAL LOADED\n{} LEFT'.format(len(self.proposals)))
+
+    def toggle_palette(self):
+        '''
+        Definition:
+        -----------
+        Switches whether the next ROIs are compared on their color palette (multi-colored parts) instead of their dominant color.\n
+        '''
+        self.use_palette = not self.use_palette
+        self.button8.configure(text='PALETTE: ON' if self.use_palette == True else 'PALETTE: OFF')
+        self.label2.configure(text='NEXT ROIS USE\nCOLOR PALETTE' if self.use_palette == True else 'NEXT ROIS USE\nDOMINANT COLOR')
+
+    def shape_outline(self):
+        '''
+        Definition:
+        -----------
+        Returns the outline vertices of the shape clicked so far (see `image_processing.shape_vertices`), None if points are missing.\n
+        '''
+        if self.shape_mode in (img_proc.POLYGON, 'hole'):
+            return img_proc.shape_vertices(img_proc.POLYGON, self.temp_ROI) if len(self.temp_ROI) >= 3 else None
+        return img_proc.shape_vertices(self.shape_mode, self.temp_ROI) if len(self.temp_ROI) == 2 else None
+
+    def close_outline(self, vertices, color):
+        # [NOTE EXPLANATION] Polygons are closed with a line back to the first point, other shapes get their outline drawn.
+        if self.shape_mode in (img_proc.POLYGON, 'hole'):
+            self.image_canvas.create_line(  self.current_x, self.current_y,
+                                            self.first_x, self.first_y,
+                                            fill=color, 
+                                            width=1)
+        else:
+            self.image_canvas.create_polygon(*[value for vertex in vertices for value in vertex], outline=color, fill='', width=1)
+
     def add_another_ROI(self):
         '''
         Definition:
         -----------
         Allows the user to enter multiple ROIs.\n
         '''
-        if len(self.temp_ROI) >= 3:
+        vertices = self.shape_outline()
+        if self.shape_mode == 'hole':
+            last_ROI = self.all_ROI.get('ROI' + str(self.ROI_index - 1))
+            if vertices is None or last_ROI is None or img_proc.ROI_shape(last_ROI) != img_proc.POLYGON:
+                self.label2.configure(text='OUTLINE A HOLE\nIN LAST POLYGON')
+                return
+            last_ROI.setdefault('holes', []).append(img_proc.normalise_coordinates(vertices, screen_height))
+            self.close_outline(vertices, style.SHAPE_OUTLINE)
+            self.previous_y, self.previous_x = None, None
+            self.first_x, self.first_y = None, None
+            self.temp_ROI = []
+            self.tkinter_ROI_points = []
+            self.tkinter_ROI_lines = []
+            self.label2.configure(text='HOLE ADDED')
+            return
+
+        if vertices is not None:
             self.all_ROI['ROI' + str(self.ROI_index)] = {}
-            self.all_ROI['ROI' + str(self.ROI_index)]['coordinates'] = self.temp_ROI
+            self.all_ROI['ROI' + str(self.ROI_index)]['normalised'] = img_proc.normalise_coordinates(vertices, screen_height)
+            if self.shape_mode != img_proc.POLYGON:
+                self.all_ROI['ROI' + str(self.ROI_index)]['shape'] = self.shape_mode
+            if self.use_palette == True:
+                self.all_ROI['ROI' + str(self.ROI_index)]['use_palette'] = True
             # self.all_ROI.append(self.temp_ROI)
-            line = self.image_canvas.create_line(   self.current_x, self.current_y,
-                                                    self.first_x, self.first_y,
-                                                    fill=style.SHAPE_OUTLINE, 
-                                                    width=1)
+            self.close_outline(vertices, style.SHAPE_OUTLINE)
             self.previous_y, self.previous_x = None, None
             self.first_x, self.first_y = None, None
             self.temp_ROI = []
             self.tkinter_ROI_points = []
             self.tkinter_ROI_lines = []
             self.ROI_index = self.ROI_index + 1
+        else:
+            self.label2.configure(text='SELECT ATLEAST\n3 POINTS FIRST' if self.shape_mode == img_proc.POLYGON else 'SELECT\n2 POINTS FIRST')
+
+    def mark_white_patch(self):
+        '''
+        Definition:
+        -----------
+        Uses the points entered so far as the neutral reference (white) patch instead of as a ROI.\n
+        Patch is used in run-mode to compensate for lighting drift. Marking again replaces the previous patch.\n
+        '''
+        vertices = self.shape_outline() if self.shape_mode != 'hole' else None
+        if vertices is not None:
+            self.white_patch = vertices
+            self.close_outline(vertices, style.WHITE_PATCH_OUTLINE)
+            for line in self.tkinter_ROI_lines:
+                self.image_canvas.itemconfigure(line, fill=style.WHITE_PATCH_OUTLINE)
+            self.previous_y, self.previous_x = None, None
+            self.first_x, self.first_y = None, None
+            self.temp_ROI = []
+            self.tkinter_ROI_points = []
+            self.tkinter_ROI_lines = []
+            self.label2.configure(text='WHITE PATCH\nMARKED')
         else:
             self.label2.configure(text='SELECT ATLEAST\n3 POINTS FIRST')
 
@@ -481,10 +1080,25 @@ class select_ROI:
         Allows the user to go back to main-page after selecting all ROI/s.\n
         '''
         if self.ROI_index != 1:
-            with open(style.JSON_FILE, 'w') as file:
-                file.write(json.dumps(self.all_ROI))
-                file.close()
-            img_proc.get_mean_colors(style.REFERENCE_IMAGE, style.JSON_FILE, style.MASK_IMAGE_PATH)
+            config_store.write_json(style.JSON_FILE, self.all_ROI)
+            img_proc.get_mean_colors(style.REFERENCE_IMAGE, style.JSON_FILE, style.MASK_IMAGE_PATH, legacy_size=screen_height)
+
+            # [NOTE EXPLANATION] Store white patch with its color on the reference image, a new calibration without patch disables compensation.
+            try:
+                param_config = dict(config_store.read_json(style.APP_CONFIG_JSON))
+            except (OSError, ValueError):
+                param_config = {}
+            param_config.pop('white_patch', None)
+            reference_image = cv.imread(style.REFERENCE_IMAGE)
+            if self.white_patch is not None:
+                white_patch = {'normalised': img_proc.normalise_coordinates(self.white_patch, screen_height)}
+                coordinates = img_proc.ROI_points(white_patch, reference_image.shape[0])
+                white_patch['reference_color'] = img_proc.region_mean_color(reference_image, coordinates)
+                param_config['white_patch'] = white_patch
+
+            # [NOTE EXPLANATION] Calibrate the frame-quality gate on the ROI union of the reference image.
+            param_config['quality_reference'] = quality_gate.quality_reference(reference_image, config_store.read_json(style.JSON_FILE))
+            config_store.write_json(style.APP_CONFIG_JSON, param_config)
             self.ROI_page.destroy()
             self.prev_page.destroy()
         else:
@@ -497,6 +1111,7 @@ class select_ROI:
         Removes all ROI points selected by the user and refreshes the screen.\n
         '''
         self.all_ROI = {}
+        self.white_patch = None
         self.ROI_index = 1
         self.temp_ROI = []
         self.tkinter_ROI_points = []
@@ -504,6 +1119,8 @@ class select_ROI:
         self.first_x, self.first_y = None, None
         self.previous_x, self.previous_y = None, None 
         self.current_x, self.current_x = None, None
+        self.proposals = None
+        self.image_canvas.delete('proposal')
 
         image = cv.imread(style.REFERENCE_IMAGE)
         image = cv.cvtColor(image, cv.COLOR_BGR2RGBA)
@@ -607,8 +1224,7 @@ class take_reference_photo:
         self.button2.place(relx = 0.5, anchor=tk.CENTER, y=7*screen_height//8)
 
         # [NOTE EXPLANATION] Configure camera and stream-variables.
-        self.camera = cv.VideoCapture(style.USB_CAMERA)
-        self.camera.set(cv.CAP_PROP_FPS, style.VIDEO_STREAM_FPS)
+        self.camera = open_camera()
         self.picture_clicked = False
         self.stream_interval = 15 #miliseconds
         self.update_stream()
@@ -623,13 +1239,15 @@ class take_reference_photo:
         Function then stores said error-margin in a file.\n
 
         '''
-        json_dict = {}
         try:
             error_margin = int(self.error_margin.get())
+            # [NOTE EXPLANATION] Keep any other app-config entries, only replace the error-margin.
+            try:
+                json_dict = dict(config_store.read_json(style.APP_CONFIG_JSON))
+            except (OSError, ValueError):
+                json_dict = {}
             json_dict['error_margin'] = error_margin
-            with open(style.APP_CONFIG_JSON, 'w') as file:
-                file.write(json.dumps(json_dict))
-                file.close()        
+            config_store.write_json(style.APP_CONFIG_JSON, json_dict)
             self.label2.configure(text='UPDATED\nERROR MARGIN')
         except Exception as err:
             print('Error received while entering error margin is: {}'.format(err))
@@ -652,11 +1270,7 @@ class take_reference_photo:
                 ret, frame = self.camera.read()
                 if ret == True:
                     # [NOTE EXPLANATION] Image needs to be cropped to a 1:1 aspect ratio.
-                    img_width, img_height = int(frame.shape[1]), int(frame.shape[0])
-                    if img_width > img_height:
-                        frame = frame[0:img_height, int((img_width - img_height)/2):int((img_width + img_height)/2)]
-                    else:
-                        frame = frame[int((img_height - img_width)/2):int((img_height + img_width)/2), 0:img_width]
+                    frame = img_proc.square_crop(frame)
                     # img_width, img_height = int(frame.shape[1]), int(frame.shape[0])
 
                     # [NOTE EXPLANATION] resize and show said image on canvas.                
@@ -664,7 +1278,9 @@ class take_reference_photo:
                     pil_frame = Image.fromarray(frame)
                     pil_frame = pil_frame.resize((screen_height, screen_height))
                     pil_pic = ImageTk.PhotoImage(image = pil_frame)
-                    self.video_canvas.create_image((0, 0), image=pil_pic, anchor=tk.NW)
+                    # [NOTE EXPLANATION] Remove previous frame (and ROI outlines) first, else canvas-items pile up every frame.
+                    self.video_canvas.delete('stream')
+                    self.video_canvas.create_image((0, 0), image=pil_pic, anchor=tk.NW, tags='stream')
                     self.video_canvas.image = pil_pic
                 self.label2.configure(text="TAKE A PICTURE\nTO SELECT ROI")     
             else:
@@ -692,16 +1308,9 @@ class take_reference_photo:
 
             if ret == True:
                 # [NOTE EXPLANATION] Image needs to be cropped to a 1:1 aspect ratio.
-                img_width, img_height = int(frame.shape[1]), int(frame.shape[0])
-                if img_width > img_height:
-                    frame = frame[0:img_height, int((img_width - img_height)/2):int((img_width + img_height)/2)]
-                else:
-                    frame = frame[int((img_height - img_width)/2):int((img_height + img_width)/2), 0:img_width]
+                frame = img_proc.square_crop(frame)
                 
-                # [NOTE EXPLANATION] resize and store said image.
-                dsize = (screen_height, screen_height)
-                frame = cv.resize(frame, dsize=dsize)
-
+                # [NOTE EXPLANATION] Store said image at native resolution, it is only resized for display.
                 cv.imwrite(style.REFERENCE_IMAGE, frame)
                 
                 if self.camera.isOpened() == True:
@@ -731,6 +1340,10 @@ class take_reference_photo:
             self.camera.release()
         self.calibrate_page.destroy()
 
+def open_camera(config=None):
+    # [NOTE EXPLANATION] Open USB camera with the low-latency capture-profile (smallest resolution covering the ROIs, buffer depth 1).
+    return capture.open_camera(screen_height, config)
+
 def call_referencephoto_class():
     # [NOTE EXPLANATION] Call calibrate-mode page/class.
     class_obj = take_reference_photo
@@ -750,8 +1363,48 @@ def setup_gpio():
     GPIO.setmode(GPIO.BOARD)
     GPIO.setup(style.GPIO_CAMERA_TRIGGER_PIN, GPIO.IN)
 
+    # [NOTE EXPLANATION] Reject actuator output (opt-in), pulsed by the deadline scheduler when a failed part reaches the gate.
+    global reject_output
+    if style.REJECT_ACTUATOR == True and style.DEADLINE_SCHEDULER == True:
+        reject_output = inspection_scheduler.reject_actuator(GPIO)
+
+def start_control_server():
+    # [NOTE EXPLANATION] Start local control/results API (runs on its own thread).
+    global api_server
+    if style.API_ENABLED == True:
+        api_server = control_server.control_server()
+        try:
+            api_server.start()
+        except OSError as err:
+            # [NOTE EXPLANATION] Station runs without the API rather than not at all (e.g. port taken by another program).
+            print('Control-server not started, API disabled: {}'.format(err))
+            api_server = None
+
+def start_analysis_worker():
+    # [NOTE EXPLANATION] Start the supervised analysis process, analysis stays in-process if it cannot be started.
+    global analysis_supervisor
+    if style.ANALYSIS_WORKER == True:
+        try:
+            analysis_supervisor = analysis_worker.analysis_worker()
+            analysis_supervisor.start()
+            atexit.register(analysis_supervisor.stop)
+        except (OSError, RuntimeError) as err:
+            print('Error received while starting analysis worker is: {}'.format(err))
+            analysis_supervisor = None
+
+def start_process_control():
+    # [NOTE EXPLANATION] One set of SPC statistics (and writer-thread) for the whole run of the app, shared by every visit of run-mode.
+    global process_monitor
+    if style.SPC_ENABLED == True:
+        process_monitor = process_control.process_control()
+        atexit.register(process_monitor.stop)
+
 def main():
     setup_gpio()
+    start_control_server()
+    start_analysis_worker()
+    start_process_control()
+    profiling.install_signal_handler()
 
     # [NOTE EXPLANATION] Create tkinter object and start the main page.
     main_page = tk.Tk()
@@ -815,4 +1468,5 @@ def main():
     main_canvas.pack()
     main_page.mainloop()
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
\ No newline at end of file
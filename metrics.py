@@ -0,0 +1,85 @@
+import threading, time, collections, contextlib
+
+# [NOTE EXPLANATION] Process-wide counters and timings, shared by the UI, the camera and the control-server threads.
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+_started = time.time()
+
+TIMING_WINDOW = 500
+
+def increment(name, amount=1):
+    """
+    Definition:
+    -----------
+    Function adds `amount` to the counter called `name` (counter is created on first use).\n
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def observe(name, seconds):
+    """
+    Definition:
+    -----------
+    Function records one duration (in seconds) for the timing called `name`.\n
+    Count, total and maximum are kept for all samples, percentiles are computed over the last `TIMING_WINDOW` samples.\n
+    """
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = {'count': 0, 'total': 0.0, 'max': 0.0, 'recent': collections.deque(maxlen=TIMING_WINDOW)}
+        timing['count'] = timing['count'] + 1
+        timing['total'] = timing['total'] + seconds
+        timing['max'] = max(timing['max'], seconds)
+        timing['recent'].append(seconds)
+
+@contextlib.contextmanager
+def timed(name):
+    """
+    Definition:
+    -----------
+    Context-manager which records the time spent inside the `with` block as timing `name`.\n
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def _percentile(sorted_samples, fraction):
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+def snapshot():
+    """
+    Definition:
+    -----------
+    Function returns a json-serialisable copy of all counters and timings.\n
+    Timings are reported in milliseconds.\n
+
+    Returns:
+    --------
+    `snapshot` : dict
+        {'uptime_s': .., 'counters': {..}, 'timings_ms': {name: {count, mean, p50, p95, max}}}
+    """
+    with _lock:
+        counters = dict(_counters)
+        timings = {}
+        for name, timing in _timings.items():
+            recent = sorted(timing['recent'])
+            timings[name] = {   'count': timing['count'],
+                                'mean' : round(1000*timing['total']/timing['count'], 3),
+                                'p50'  : round(1000*_percentile(recent, 0.50), 3),
+                                'p95'  : round(1000*_percentile(recent, 0.95), 3),
+                                'max'  : round(1000*timing['max'], 3)}
+    return {'uptime_s': round(time.time() - _started, 1), 'counters': counters, 'timings_ms': timings}
+
+def reset():
+    """
+    Definition:
+    -----------
+    Function clears all counters and timings.\n
+    """
+    with _lock:
+        _counters.clear()
+        _timings.clear()
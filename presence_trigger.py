@@ -0,0 +1,201 @@
+import time
+import numpy
+import cv2 as cv
+import style
+import metrics
+import image_processing as img_proc
+
+# ===================================================================================
+# Software trigger: inspects automatically when a part has entered the frame and come to rest, no external sensor needed.
+# Every stream frame, the ROI union is shrunk to a tiny grey image (PRESENCE_WIDTH pixels across) and compared:
+#   presence : mean difference from the background (learned while the station is empty)
+#   motion   : mean difference from the previous frame
+# States:
+#   EMPTY    -> ARRIVING  presence above PRESENCE_ENTER
+#   ARRIVING -> PRESENT   motion below PRESENCE_SETTLE_MOTION for PRESENCE_SETTLE_FRAMES frames (fires the trigger)
+#   ARRIVING -> EMPTY     presence below PRESENCE_EXIT (a shadow or hand passing by)
+#   PRESENT  -> EMPTY     presence below PRESENCE_EXIT for PRESENCE_CLEAR_FRAMES frames (part removed)
+# Enter/exit thresholds differ (hysteresis), so a part fires once however long it stays.
+# With a white patch calibrated (outside the ROIs, never covered by a part), light drifting while a part sits (background
+# frozen) is divided out by the gain of said patch, limited to LIGHTING_GAIN_LIMITS. The ROIs themselves never set the gain.
+# ===================================================================================
+
+EMPTY = 'EMPTY'
+ARRIVING = 'ARRIVING'
+PRESENT = 'PRESENT'
+
+class presence_trigger:
+    '''
+    Definition:
+    -----------
+    Class watches the stream frames and tells when a part has arrived and settled, i.e. when to inspect.\n
+    Check costs a fraction of a millisecond (a resize of the ROI union and two differences).\n
+    Should it exceed `style.PRESENCE_BUDGET` of the frame-interval, only every 2nd, 3rd, .. frame is checked.\n
+    Cost is recorded as 'presence_trigger', triggers as 'presence_triggers' (see `metrics.py`).\n
+
+    Attributes:
+    -----------
+    `config` : dict
+        contents of the json file containing the coordinates of the ROI, replaced through `update` (hot reload).\n
+
+    `legacy_size` : Int
+        side of the square legacy (pixel) ROI coordinates were drawn on (see `image_processing.ROI_points`).\n
+
+    `fps` : Float
+        frame rate of the stream, for the CPU budget.\n
+
+    `param_config` : dict
+        contents of the app-config json file, its 'white_patch' (if any) compensates lighting drift.\n
+
+    '''
+    def __init__(self, config, legacy_size=None, fps=style.VIDEO_STREAM_FPS, param_config=None):
+        self.config = config
+        self.param_config = {} if param_config is None else param_config
+        self.version = None
+        self.legacy_size = legacy_size
+        self.fps = float(fps)
+        self.stride = 1
+        self.triggers = 0
+        self._region = None
+        self._region_key = None
+        self._cost = 0.0
+        self._frame_count = 0
+        self.reset()
+
+    def reset(self):
+        '''
+        Definition:
+        -----------
+        Forgets the background and state, e.g. after a new calibration. Next frame is taken as the empty station.\n
+        '''
+        self.state = EMPTY
+        self.background = None
+        self.background_level = None
+        self.previous = None
+        self.presence = 0.0
+        self.motion = 0.0
+        self._count = 0
+
+    def update(self, config, param_config=None, version=None):
+        '''
+        Definition:
+        -----------
+        Takes over a (re)loaded calibration. ROI union and white patch are mapped again only when `version` changes (see `config_store.version`).\n
+        '''
+        if version != self.version:
+            self._region_key = None
+        self.version = version
+        self.config = config
+        self.param_config = {} if param_config is None else param_config
+
+    def observe(self, frame):
+        '''
+        Definition:
+        -----------
+        Checks a stream frame, never blocks.\n
+
+        Attributes:
+        -----------
+        `frame` : numpy array
+            B-G-R stream frame (square crop or native frame, the ROIs are mapped on its square centre).\n
+
+        Returns:
+        --------
+        `trigger` : bool
+            True exactly once per part, when it has settled
+        '''
+        if not self.config:
+            return False
+        self._frame_count = self._frame_count + 1
+        if self._frame_count % self.stride != 0:
+            metrics.increment('presence_frames_skipped')
+            return False
+
+        start = time.perf_counter()
+        small, level = self._downscale(frame)
+        trigger = self._step(small, level)
+        elapsed = time.perf_counter() - start
+        metrics.observe('presence_trigger', elapsed)
+
+        # [NOTE EXPLANATION] Smoothed cost decides the stride, so that a single slow frame does not change it.
+        self._cost = elapsed if self._cost == 0.0 else 0.9*self._cost + 0.1*elapsed
+        budget = style.PRESENCE_BUDGET/self.fps
+        self.stride = max(1, min(int(numpy.ceil(self._cost/budget)), style.PRESENCE_SETTLE_FRAMES))
+        return trigger
+
+    def _downscale(self, frame):
+        # [NOTE EXPLANATION] ROI union and white patch are mapped onto the frame only when the config version or frame size changes.
+        key = frame.shape[:2]
+        if key != self._region_key:
+            size, offset = img_proc.square_geometry(frame.shape)
+            union = img_proc.ROI_union(img_proc.scale_config(self.config, size, offset, self.legacy_size))
+            x, y, w, h = _clip(union, frame.shape)
+            width = min(style.PRESENCE_WIDTH, max(w, 1))
+            patch = None
+            if 'white_patch' in self.param_config:
+                points = numpy.array(img_proc.ROI_points(self.param_config['white_patch'], size, offset, self.legacy_size), numpy.int32)
+                patch = _clip(cv.boundingRect(points), frame.shape)
+                patch = patch if patch[2] > 0 and patch[3] > 0 else None
+            region = (x, y, w, h, (width, max(1, int(round(width*h/max(w, 1))))), patch)
+            # [NOTE EXPLANATION] Background is only forgotten when the watched region has really moved.
+            if region != self._region:
+                self._region = region
+                self.reset()
+            self._region_key = key
+        x, y, w, h, dsize, patch = self._region
+        small = cv.resize(frame[y: y+h, x: x+w], dsize=dsize, interpolation=cv.INTER_AREA)
+        level = None
+        if patch is not None:
+            px, py, pw, ph = patch
+            level = float(numpy.mean(cv.mean(frame[py: py+ph, px: px+pw])[:3]))
+        return cv.cvtColor(small, cv.COLOR_BGR2GRAY).astype(numpy.float32), level
+
+    def _step(self, small, level=None):
+        if self.background is None:
+            self.background, self.background_level, self.previous = small.copy(), level, small
+            return False
+
+        # [NOTE EXPLANATION] Gain comes from the white patch only (outside the ROIs), so that a part of any color is never scaled away.
+        gain = 1.0
+        if level is not None and self.background_level is not None:
+            low, high = style.LIGHTING_GAIN_LIMITS
+            gain = min(max(self.background_level/max(level, 1.0), low), high)
+        self.presence = float(cv.absdiff(small*gain, self.background).mean())
+        self.motion = float(cv.absdiff(small, self.previous).mean())
+        self.previous = small
+
+        trigger = False
+        if self.state == EMPTY:
+            if self.presence > style.PRESENCE_ENTER:
+                self.state, self._count = ARRIVING, 0
+            else:
+                # [NOTE EXPLANATION] Background follows slow lighting changes, but only while nothing is in front of the camera.
+                cv.accumulateWeighted(small, self.background, style.PRESENCE_BACKGROUND_RATE)
+                if level is not None and self.background_level is not None:
+                    self.background_level = self.background_level + style.PRESENCE_BACKGROUND_RATE*(level - self.background_level)
+        elif self.state == ARRIVING:
+            if self.presence < style.PRESENCE_EXIT:
+                self.state = EMPTY
+            elif self.motion < style.PRESENCE_SETTLE_MOTION:
+                self._count = self._count + 1
+                if self._count*self.stride >= style.PRESENCE_SETTLE_FRAMES:
+                    self.state, self._count, trigger = PRESENT, 0, True
+                    self.triggers = self.triggers + 1
+                    metrics.increment('presence_triggers')
+            else:
+                self._count = 0
+        else:
+            if self.presence < style.PRESENCE_EXIT:
+                self._count = self._count + 1
+                if self._count*self.stride >= style.PRESENCE_CLEAR_FRAMES:
+                    self.state, self._count = EMPTY, 0
+            else:
+                self._count = 0
+        return trigger
+
+def _clip(rect, shape):
+    # [NOTE EXPLANATION] Rectangle (x, y, w, h) cut to the frame, both corners clipped.
+    x, y, w, h = rect
+    x1, y1 = min(max(x, 0), shape[1]), min(max(y, 0), shape[0])
+    x2, y2 = min(max(x + w, 0), shape[1]), min(max(y + h, 0), shape[0])
+    return x1, y1, x2 - x1, y2 - y1
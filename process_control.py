@@ -0,0 +1,256 @@
+import math, collections, threading, time
+import style
+import config_store
+import metrics
+
+# ===================================================================================
+# Statistical process control of every ROI, updated in O(1) per inspection (no scans over stored history).
+# Monitored value is the color error of the ROI (percent distance from its reference color, see output.json):
+#   running mean/std : Welford's algorithm over all inspections, frozen as baseline after SPC_BASELINE_SAMPLES
+#   EWMA             : alarm when it rises above baseline + SPC_EWMA_L sigma (asymptotic EWMA limit)
+#   CUSUM            : one-sided, alarm when the cumulative excess over baseline + k sigma exceeds h sigma
+#   pass-rate        : share of passed inspections in the last SPC_PASS_WINDOW, alarm below SPC_MIN_PASS_RATE
+# Statistics restart whenever the reference colors change (new calibration or another recipe).
+# Statistics are stored by a background thread, at most every SPC_SAVE_INTERVAL seconds, never on the UI thread.
+# ===================================================================================
+
+ALARM_EWMA = 'EWMA'
+ALARM_CUSUM = 'CUSUM'
+ALARM_PASS_RATE = 'PASS RATE'
+
+class roi_statistics:
+    '''
+    Definition:
+    -----------
+    Class holds the rolling statistics of a single ROI.\n
+
+    Attributes:
+    -----------
+    `state` : dict
+        statistics as stored by `to_dict` (optional, fresh statistics if None).\n
+
+    '''
+    def __init__(self, state=None):
+        state = {} if state is None else state
+        self.count = state.get('count', 0)
+        self.mean = state.get('mean', 0.0)
+        self.m2 = state.get('m2', 0.0)
+        self.ewma = state.get('ewma')
+        self.baseline_mean = state.get('baseline_mean')
+        self.baseline_std = state.get('baseline_std')
+        self.cusum = state.get('cusum', 0.0)
+        self.window = collections.deque(state.get('window', []), maxlen=style.SPC_PASS_WINDOW)
+        self.window_passes = sum(1 for passed in self.window if passed)
+        self.chart = collections.deque(state.get('chart', []), maxlen=style.SPC_CHART_POINTS)
+        self.alarms = list(state.get('alarms', []))
+
+    def std(self):
+        return math.sqrt(self.m2/(self.count - 1)) if self.count > 1 else 0.0
+
+    def ewma_limit(self):
+        factor = math.sqrt(style.SPC_EWMA_LAMBDA/(2 - style.SPC_EWMA_LAMBDA))
+        return self.baseline_mean + style.SPC_EWMA_L*self.baseline_std*factor
+
+    def pass_rate(self):
+        return self.window_passes/len(self.window) if len(self.window) > 0 else None
+
+    def update(self, error, passed):
+        '''
+        Definition:
+        -----------
+        Adds one inspection of the ROI, in constant time.\n
+
+        Attributes:
+        -----------
+        `error` : Float
+            color error of the ROI (percent).\n
+
+        `passed` : bool
+            whether the ROI was within the error-margin.\n
+
+        Returns:
+        --------
+        `alarms` : list
+            alarms active after this inspection (ALARM_EWMA, ALARM_CUSUM, ALARM_PASS_RATE)
+        '''
+        # [NOTE EXPLANATION] Welford: running mean and sum of squared deviations.
+        self.count = self.count + 1
+        delta = error - self.mean
+        self.mean = self.mean + delta/self.count
+        self.m2 = self.m2 + delta*(error - self.mean)
+
+        self.ewma = error if self.ewma is None else style.SPC_EWMA_LAMBDA*error + (1 - style.SPC_EWMA_LAMBDA)*self.ewma
+
+        # [NOTE EXPLANATION] Pass-rate window: only the sample falling out of the window is subtracted.
+        if len(self.window) == self.window.maxlen and self.window[0] == True:
+            self.window_passes = self.window_passes - 1
+        self.window.append(passed == True)
+        if passed == True:
+            self.window_passes = self.window_passes + 1
+
+        if self.baseline_mean is None:
+            if self.count >= style.SPC_BASELINE_SAMPLES:
+                self.baseline_mean = self.mean
+                self.baseline_std = max(self.std(), style.SPC_MIN_SIGMA)
+            self.alarms = []
+            return self.alarms
+
+        self.cusum = max(0.0, self.cusum + error - self.baseline_mean - style.SPC_CUSUM_K*self.baseline_std)
+
+        # [NOTE EXPLANATION] Chart point: EWMA on a scale where baseline is 0 and the alarm limit is 1.
+        limit = self.ewma_limit()
+        self.chart.append(round((self.ewma - self.baseline_mean)/max(limit - self.baseline_mean, 1e-9), 3))
+
+        alarms = []
+        if self.ewma > limit: alarms.append(ALARM_EWMA)
+        if self.cusum > style.SPC_CUSUM_H*self.baseline_std: alarms.append(ALARM_CUSUM)
+        if len(self.window) == self.window.maxlen and self.pass_rate() < style.SPC_MIN_PASS_RATE: alarms.append(ALARM_PASS_RATE)
+        self.alarms = alarms
+        return alarms
+
+    def summary(self):
+        return {'count'     : self.count,
+                'mean'      : round(self.mean, 3),
+                'std'       : round(self.std(), 3),
+                'ewma'      : None if self.ewma is None else round(self.ewma, 3),
+                'limit'     : None if self.baseline_mean is None else round(self.ewma_limit(), 3),
+                'cusum'     : round(self.cusum, 3),
+                'pass_rate' : None if self.pass_rate() is None else round(self.pass_rate(), 3),
+                'alarms'    : list(self.alarms)}
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2, 'ewma': self.ewma,
+                'baseline_mean': self.baseline_mean, 'baseline_std': self.baseline_std, 'cusum': self.cusum,
+                'window': list(self.window), 'chart': list(self.chart), 'alarms': self.alarms}
+
+class process_control:
+    '''
+    Definition:
+    -----------
+    Class keeps the rolling statistics of every ROI of the current calibration.\n
+    They are stored (atomically) by a background thread, at most every `style.SPC_SAVE_INTERVAL` seconds, and on `stop`.\n
+    New alarms are counted in `metrics.py` as spc_alarm_<kind>.\n
+
+    Attributes:
+    -----------
+    `filename` : String
+        file the statistics are stored in, default `style.SPC_FILE`.\n
+
+    '''
+    def __init__(self, filename=None):
+        self.filename = style.SPC_FILE if filename is None else filename
+        self.reference = None
+        self.rois = {}
+        try:
+            stored = config_store.read_json(self.filename)
+            self.reference = stored.get('reference')
+            self.rois = {key: roi_statistics(state) for key, state in stored.get('rois', {}).items()}
+        except (OSError, ValueError):
+            pass
+        self._condition = threading.Condition()
+        self._pending = False
+        self._running = True
+        self._thread = threading.Thread(target=self._writer, name='process_control', daemon=True)
+        self._thread.start()
+
+    def update(self, color_config, config):
+        '''
+        Definition:
+        -----------
+        Adds one inspection to the statistics of every ROI.\n
+
+        Attributes:
+        -----------
+        `color_config` : dict
+            contents of the output json file (ROI name -> error / success_status).\n
+
+        `config` : dict
+            contents of the json file containing the reference colors of the ROI, statistics restart when they change.\n
+
+        Returns:
+        --------
+        `summary` : dict
+            ROI name -> {'count', 'mean', 'std', 'ewma', 'limit', 'cusum', 'pass_rate', 'alarms'}
+        '''
+        reference = {key: config[key]['mean_color'] for key in config}
+        summary = {}
+        with self._condition:
+            if reference != self.reference:
+                self.reference = reference
+                self.rois = {}
+
+            for key in color_config:
+                statistics = self.rois.setdefault(key, roi_statistics())
+                previous = set(statistics.alarms)
+                alarms = statistics.update(color_config[key]['error'], color_config[key]['success_status'])
+                for alarm in alarms:
+                    if alarm not in previous:
+                        metrics.increment('spc_alarm_' + alarm.lower().replace(' ', '_'))
+                summary[key] = statistics.summary()
+
+            # [NOTE EXPLANATION] Only marked for the writer-thread, the fsync of the file does not hold up the inspection.
+            self._pending = True
+            self._condition.notify()
+        return summary
+
+    def save(self):
+        '''
+        Definition:
+        -----------
+        Stores the statistics now, if they changed since last stored. Cost is recorded as 'spc_save' (see `metrics.py`).\n
+        '''
+        with self._condition:
+            if self._pending == False:
+                return
+            self._pending = False
+            state = {'reference': self.reference, 'rois': {key: self.rois[key].to_dict() for key in self.rois}}
+        with metrics.timed('spc_save'):
+            config_store.write_json(self.filename, state)
+
+    def stop(self):
+        '''
+        Definition:
+        -----------
+        Stops the writer-thread and stores the statistics not yet stored.\n
+        '''
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        self._save()
+
+    def _save(self):
+        try:
+            self.save()
+        except OSError as error:
+            print('SPC statistics not stored: {}'.format(error))
+
+    def _writer(self):
+        while True:
+            with self._condition:
+                while self._running and self._pending == False:
+                    self._condition.wait()
+                if self._running == False:
+                    return
+            self._save()
+            # [NOTE EXPLANATION] Inspections arriving meanwhile are stored together by the next write.
+            deadline = time.monotonic() + style.SPC_SAVE_INTERVAL
+            with self._condition:
+                while self._running and time.monotonic() < deadline:
+                    self._condition.wait(deadline - time.monotonic())
+
+    def chart(self, key):
+        '''
+        Definition:
+        -----------
+        Returns the recent EWMA points of a ROI, scaled so that 0 is the baseline and 1 the alarm limit.\n
+        '''
+        return list(self.rois[key].chart) if key in self.rois else []
+
+    def alarms(self):
+        '''
+        Definition:
+        -----------
+        Returns ROI name -> active alarms, for ROIs with at least one alarm.\n
+        '''
+        return {key: list(statistics.alarms) for key, statistics in self.rois.items() if len(statistics.alarms) > 0}
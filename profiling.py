@@ -0,0 +1,192 @@
+#! /usr/bin/python3
+
+# ===================================================================================
+# On-demand profiling of production inspections (cProfile + tracemalloc), armed while the station runs:
+#   hidden UI control : triple-click the title of the run-mode page
+#   signal            : kill -USR1 <pid of main.py>
+#   CLI               : python3 profiling.py arm --count 20
+# Next N inspections are captured into PROFILE_FOLDER (oldest captures are removed), then rank them with
+#   python3 profiling.py summarise --top 25
+# When not armed, an inspection costs one integer check.
+# ===================================================================================
+
+import os, time, signal, argparse, contextlib, cProfile, pstats, tracemalloc, threading
+import style
+
+PID_FILE = 'station.pid'
+ARM_FILE = 'arm'
+PROFILE_EXTENSION = '.prof'
+SNAPSHOT_EXTENSION = '.tracemalloc'
+
+_remaining = 0
+_sequence = 0
+_lock = threading.Lock()
+
+def arm(count=None):
+    """
+    Definition:
+    -----------
+    Function arms profiling for the next `count` inspections (default `style.PROFILE_INSPECTIONS`).\n
+    """
+    global _remaining
+    _remaining = style.PROFILE_INSPECTIONS if count is None else int(count)
+
+def disarm():
+    global _remaining
+    _remaining = 0
+
+def remaining():
+    return _remaining
+
+def take():
+    """
+    Definition:
+    -----------
+    Function returns True if the inspection about to start is to be profiled, and counts it.\n
+    """
+    global _remaining
+    if _remaining <= 0:
+        return False
+    with _lock:
+        if _remaining <= 0: return False
+        _remaining = _remaining - 1
+    return True
+
+@contextlib.contextmanager
+def capture(label):
+    """
+    Definition:
+    -----------
+    Context-manager which profiles (cProfile) and traces allocations (tracemalloc) of its block.\n
+    Both are written to `style.PROFILE_FOLDER` as '<time>_<label>_<pid>_<sequence>.prof' and '.tracemalloc', then old captures are rotated out.\n
+
+    Attributes:
+    -----------
+    `label` : String
+        what is being profiled, e.g. 'take_picture_now' or 'analysis' (worker process).\n
+
+    """
+    global _sequence
+    os.makedirs(style.PROFILE_FOLDER, exist_ok=True)
+    tracing = tracemalloc.is_tracing()
+    if tracing == False:
+        tracemalloc.start(style.PROFILE_TRACEMALLOC_FRAMES)
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        if tracing == False:
+            tracemalloc.stop()
+
+        _sequence = _sequence + 1
+        name = '{}_{}_{}_{}'.format(time.strftime('%Y%m%d-%H%M%S'), label, os.getpid(), _sequence)
+        path = os.path.join(style.PROFILE_FOLDER, name)
+        profile.dump_stats(path + PROFILE_EXTENSION)
+        snapshot.dump(path + SNAPSHOT_EXTENSION)
+        rotate()
+
+def rotate(folder=None, keep=None):
+    """
+    Definition:
+    -----------
+    Function removes the oldest captures, so that at most `keep` (default `style.PROFILE_KEEP`) remain.\n
+    """
+    folder = style.PROFILE_FOLDER if folder is None else folder
+    keep = style.PROFILE_KEEP if keep is None else keep
+    captures = _captures(folder)
+    for path in captures[:max(len(captures) - keep, 0)]:
+        for extension in (PROFILE_EXTENSION, SNAPSHOT_EXTENSION):
+            with contextlib.suppress(OSError):
+                os.remove(path + extension)
+
+def _captures(folder):
+    # [NOTE EXPLANATION] Captures as paths without extension, oldest first.
+    if not os.path.isdir(folder):
+        return []
+    names = [filename[:-len(PROFILE_EXTENSION)] for filename in os.listdir(folder) if filename.endswith(PROFILE_EXTENSION)]
+    paths = [os.path.join(folder, name) for name in names]
+    return sorted(paths, key=lambda path: os.path.getmtime(path + PROFILE_EXTENSION))
+
+def install_signal_handler():
+    """
+    Definition:
+    -----------
+    Function lets SIGUSR1 arm profiling, and stores the pid so that `profiling.py arm` can find the station.\n
+    Must be called from the main thread.\n
+    """
+    os.makedirs(style.PROFILE_FOLDER, exist_ok=True)
+    with open(os.path.join(style.PROFILE_FOLDER, PID_FILE), 'w') as file:
+        file.write(str(os.getpid()))
+    signal.signal(signal.SIGUSR1, _on_signal)
+
+def _on_signal(signum, frame):
+    # [NOTE EXPLANATION] Inspection count may be left in the arm-file by the CLI, else the default is used.
+    count = None
+    with contextlib.suppress(OSError, ValueError):
+        with open(os.path.join(style.PROFILE_FOLDER, ARM_FILE), 'r') as file:
+            count = int(file.read().strip())
+        os.remove(os.path.join(style.PROFILE_FOLDER, ARM_FILE))
+    arm(count)
+
+def summarise(folder=None, top=20, sort='tottime'):
+    """
+    Definition:
+    -----------
+    Function prints the hottest functions (all cProfile captures merged) and the largest allocation sites
+    (summed over all tracemalloc captures) of the captures in `folder`.\n
+    """
+    folder = style.PROFILE_FOLDER if folder is None else folder
+    captures = _captures(folder)
+    if len(captures) == 0:
+        print('no captures in {}'.format(folder))
+        return
+
+    print('{} captures in {}\n'.format(len(captures), folder))
+    stats = pstats.Stats(*[path + PROFILE_EXTENSION for path in captures])
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+    # [NOTE EXPLANATION] Allocation sites: size still allocated at the end of every capture, summed and counted over captures.
+    ignore = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, cProfile.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+    sites = {}
+    for path in captures:
+        if not os.path.exists(path + SNAPSHOT_EXTENSION): continue
+        snapshot = tracemalloc.Snapshot.load(path + SNAPSHOT_EXTENSION).filter_traces(ignore)
+        for statistic in snapshot.statistics('lineno'):
+            frame = statistic.traceback[0]
+            site = sites.setdefault('{}:{}'.format(frame.filename, frame.lineno), [0, 0, 0])
+            site[0], site[1], site[2] = site[0] + statistic.size, site[1] + statistic.count, site[2] + 1
+    print('{:>12} {:>10} {:>9}  {}'.format('size [KiB]', 'blocks', 'captures', 'allocation site'))
+    for site, (size, count, seen) in sorted(sites.items(), key=lambda item: item[1][0], reverse=True)[:top]:
+        print('{:>12.1f} {:>10} {:>9}  {}'.format(size/1024, count, seen, site))
+
+def main():
+    parser = argparse.ArgumentParser(description='On-demand profiling of the inspection station.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('arm', help='profile the next inspections of the running station')
+    command.add_argument('--count', type=int, default=style.PROFILE_INSPECTIONS)
+    command.add_argument('--pid', type=int, default=0, help='pid of main.py, read from the pid-file if omitted')
+
+    command = commands.add_parser('summarise', help='rank hot functions and allocation sites across captures')
+    command.add_argument('--folder', default=style.PROFILE_FOLDER)
+    command.add_argument('--top', type=int, default=20)
+    command.add_argument('--sort', default='tottime', help='pstats sort key, e.g. tottime or cumulative')
+
+    arguments = parser.parse_args()
+    if arguments.command == 'arm':
+        pid = arguments.pid
+        if pid == 0:
+            with open(os.path.join(style.PROFILE_FOLDER, PID_FILE), 'r') as file:
+                pid = int(file.read().strip())
+        with open(os.path.join(style.PROFILE_FOLDER, ARM_FILE), 'w') as file:
+            file.write(str(arguments.count))
+        os.kill(pid, signal.SIGUSR1)
+        print('profiling armed for the next {} inspections of pid {}'.format(arguments.count, pid))
+    else:
+        summarise(arguments.folder, arguments.top, arguments.sort)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import time
+import numpy
+import cv2 as cv
+import style
+import metrics
+import image_processing as img_proc
+import capture
+
+def ROI_region(shape, config, legacy_size=None):
+    """
+    Definition:
+    -----------
+    Function returns the bounding-box [x, y, w, h] of all ROIs on a frame of said shape (ROIs lie on its square centre).\n
+    """
+    size, offset = img_proc.square_geometry(shape)
+    x, y, w, h = img_proc.ROI_union(img_proc.scale_config(config, size, offset, legacy_size))
+    return [max(x, 0), max(y, 0), max(w, 1), max(h, 1)]
+
+def downscale(frame, region):
+    # [NOTE EXPLANATION] ROI union of the frame, shrunk to a small grey image (fixed width, so that stream and capture frames compare).
+    x, y, w, h = region
+    dsize = (style.QUALITY_GATE_SIZE, max(1, int(round(style.QUALITY_GATE_SIZE*h/float(w)))))
+    small = cv.resize(frame[y: y+h, x: x+w], dsize=dsize, interpolation=cv.INTER_AREA)
+    return cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+
+def measure(small):
+    # [NOTE EXPLANATION] Sharpness (variance of the Laplacian) and clipped fraction (saturated or black pixels) of a downscaled ROI union.
+    sharpness = float(cv.Laplacian(small, cv.CV_32F).var())
+    clipped = float(numpy.count_nonzero((small >= 250) | (small <= 5)))/small.size
+    return sharpness, clipped
+
+def quality_reference(image, config, legacy_size=None):
+    """
+    Definition:
+    -----------
+    Function measures the reference image at calibration time, the gate judges frames relative to it (see `quality_limits`).\n
+    A dark or plain part has little sharpness and many black pixels on its good pictures too, so absolute thresholds do not fit every product.\n
+
+    Attributes:
+    -----------
+    `image` : numpy array
+        B-G-R reference image.\n
+
+    `config` : dict
+        contents of the json file containing the coordinates of the ROI, only the ROI union is measured.\n
+
+    `legacy_size` : Int
+        side of the square legacy (pixel) ROI coordinates were drawn on (see `image_processing.ROI_points`).\n
+
+    Returns:
+    --------
+    `reference` : dict
+        {'sharpness', 'clipped'}, stored in the app-config json file as 'quality_reference'
+    """
+    sharpness, clipped = measure(downscale(image, ROI_region(image.shape, config, legacy_size)))
+    return {'sharpness': round(sharpness, 2), 'clipped': round(clipped, 4)}
+
+def quality_limits(reference):
+    """
+    Definition:
+    -----------
+    Function returns the limits a frame must keep, derived from the calibrated reference (see `quality_reference`).\n
+    Sharpness may drop to `style.QUALITY_SHARPNESS_RATIO` of the reference, clipped pixels may rise by `style.QUALITY_CLIPPED_MARGIN`.\n
+    """
+    return {'min_sharpness' : style.QUALITY_SHARPNESS_RATIO*reference['sharpness'],
+            'max_clipped'   : min(reference['clipped'] + style.QUALITY_CLIPPED_MARGIN, 1.0)}
+
+def frame_quality(frame, region, limits, previous_small=None):
+    """
+    Definition:
+    -----------
+    Function measures the quality of a camera frame on a small downscaled copy of its ROI union (cheap, well under a millisecond).\n
+    sharpness : variance of the Laplacian, low for blurred/out-of-focus frames\n
+    clipped   : fraction of pixels that are saturated (over-exposed) or black (under-exposed)\n
+    motion    : mean absolute difference from the previous frame, high while the part or camera is moving\n
+
+    Attributes:
+    -----------
+    `frame` : numpy array
+        B-G-R camera frame.\n
+
+    `region` : list
+        ROI union [x, y, w, h] in pixels of the frame (see `ROI_region`), nothing outside it is checked.\n
+
+    `limits` : dict
+        {'min_sharpness', 'max_clipped'} of the calibration (see `quality_limits`).\n
+
+    `previous_small` : numpy array
+        downscaled grey copy of the previous frame (as returned by this function), motion is not measured if None.\n
+
+    Returns:
+    --------
+    (`reason` [String or None], `measurements` [dict], `small` [numpy array]) : tuple
+    \n
+    reason       : None if the frame is good, else 'BLURRED', 'BADLY EXPOSED' or 'MOVING'\n
+    measurements : sharpness / clipped / motion values\n
+    small        : downscaled grey copy of this frame, to be passed as `previous_small` next time\n
+    \n
+    """
+    small = downscale(frame, region)
+
+    sharpness, clipped = measure(small)
+    motion = None
+    if previous_small is not None and previous_small.shape == small.shape:
+        motion = float(cv.absdiff(small, previous_small).mean())
+
+    measurements = {'sharpness': round(sharpness, 1), 'clipped': round(clipped, 4), 'motion': None if motion is None else round(motion, 2)}
+    if clipped > limits['max_clipped']: return 'BADLY EXPOSED', measurements, small
+    if motion is not None and motion > style.QUALITY_MAX_MOTION: return 'MOVING', measurements, small
+    if sharpness < limits['min_sharpness']: return 'BLURRED', measurements, small
+    return None, measurements, small
+
+class frame_quality_gate:
+    '''
+    Definition:
+    -----------
+    Class rejects blurred, badly exposed or moving frames before they reach the (expensive) color clustering.\n
+    Only the ROI union is checked, against limits calibrated on the reference image ('quality_reference' in the app-config).\n
+    Until such a calibration exists, the gate lets every frame pass (metrics 'quality_gate_uncalibrated').\n
+    A rejected frame is replaced by a fresh one from the camera until one passes or the time-budget runs out.\n
+    When the budget runs out, the inspection is flagged "no decision" instead of producing a bogus verdict.\n
+    Gate cost and hit-rates are recorded in `metrics.py` (quality_gate_*).\n
+
+    Attributes:
+    -----------
+    `config`, `param_config` : dict
+        contents of the ROI json file and of the app-config json file, may be replaced at any time (hot reload, see `update`).\n
+
+    `legacy_size` : Int
+        side of the square legacy (pixel) ROI coordinates were drawn on (see `image_processing.ROI_points`).\n
+
+    `budget` : Float
+        time allowed for retries (in seconds).\n
+
+    '''
+    def __init__(self, config, param_config, legacy_size=None, budget=style.QUALITY_RETRY_BUDGET):
+        self.legacy_size = legacy_size
+        self.budget = budget
+        self.previous_small = None
+        self.version = None
+        self._regions = {}
+        self.update(config, param_config)
+
+    def update(self, config, param_config, version=None):
+        '''
+        Definition:
+        -----------
+        Takes over a (re)loaded calibration. ROI regions are mapped again only when `version` changes (see `config_store.version`).\n
+        '''
+        if version is None or version != self.version:
+            self._regions = {}
+        self.version = version
+        self.config = config
+        reference = param_config.get('quality_reference')
+        self.limits = quality_limits(reference) if reference is not None else None
+
+    def _region(self, shape):
+        region = self._regions.get(shape[:2])
+        if region is None:
+            region = self._regions[shape[:2]] = ROI_region(shape, self.config, self.legacy_size)
+        return region
+
+    def observe(self, frame):
+        '''
+        Definition:
+        -----------
+        Remembers a (downscaled) stream frame, so that the first frame of an inspection can already be checked for motion.\n
+        '''
+        if self.limits is not None and self.config:
+            self.previous_small = downscale(frame, self._region(frame.shape))
+
+    def capture(self, camera, frame):
+        '''
+        Definition:
+        -----------
+        Checks `frame` and, while it fails and time is left, reads fresh replacement frames from `camera` (buffered ones are flushed).\n
+        Without a calibrated reference, `frame` passes unchecked (0 attempts).\n
+
+        Returns:
+        --------
+        (`frame` [numpy array], `quality` [dict]) : tuple
+        \n
+        frame   : last frame checked (the good one if the gate passed)\n
+        quality : {'passed': bool, 'reason': None or reason of last rejection, 'attempts': Int, 'measurements': dict}\n
+        \n
+        '''
+        if self.limits is None or not self.config:
+            metrics.increment('quality_gate_uncalibrated')
+            return frame, {'passed': True, 'reason': None, 'attempts': 0, 'measurements': None}
+
+        deadline = time.monotonic() + self.budget
+        attempts = 0
+        while True:
+            attempts = attempts + 1
+            with metrics.timed('quality_gate'):
+                reason, measurements, self.previous_small = frame_quality(frame, self._region(frame.shape), self.limits, self.previous_small)
+            if reason is None:
+                metrics.increment('quality_gate_passed')
+                if attempts > 1: metrics.increment('quality_gate_passed_after_retry')
+                return frame, {'passed': True, 'reason': None, 'attempts': attempts, 'measurements': measurements}
+
+            metrics.increment('quality_gate_rejected_' + reason.lower().replace(' ', '_'))
+            if time.monotonic() >= deadline:
+                break
+            # [NOTE EXPLANATION] Frames buffered while the part still moved are skipped, as on trigger (see `capture.fresh_frame`).
+            ret, next_frame, _ = capture.fresh_frame(camera)
+            if ret == False:
+                break
+            frame = next_frame
+
+        metrics.increment('quality_gate_no_decision')
+        return frame, {'passed': False, 'reason': reason, 'attempts': attempts, 'measurements': measurements}
@@ -0,0 +1,258 @@
+import os, json, mmap, struct, time, copy, threading
+import numpy
+import style
+import config_store
+import image_processing as img_proc
+
+# ===================================================================================
+# Recipe file format (one '.recipe' file per product, little-endian):
+#   8 bytes   : magic 'CAKERCP1'
+#   4 bytes   : length of json header (uint32)
+#   n bytes   : json header -> name, created, app_config, config (ROI coordinates, reference colors, extremes)
+#               mask_size (side of the square camera frame the masks were compiled for)
+#               and for every ROI the offset and shape of its compiled mask
+#   padding   : up to the next multiple of RECIPE_ALIGNMENT bytes
+#   masks     : raw uint8 masks, each starting at a multiple of RECIPE_ALIGNMENT bytes
+# Masks are never copied while loading, they are views into the memory-mapped file.
+# ===================================================================================
+
+RECIPE_MAGIC = b'CAKERCP1'
+RECIPE_ALIGNMENT = 64
+RECIPE_EXTENSION = '.recipe'
+
+# [NOTE EXPLANATION] Loaded recipes, keyed by filepath: (file-signature, recipe).
+_loaded = {}
+_lock = threading.Lock()
+_active = None
+
+class recipe:
+    '''
+    Definition:
+    -----------
+    Class holds one calibrated product: ROIs with reference colors, error-margin and compiled ROI masks.\n
+    Masks are read-only views into the memory-mapped recipe file.\n
+
+    Attributes:
+    -----------
+    `name` : String
+        name of the product.\n
+
+    `config` : dict
+        contents of `config.json` at the time the recipe was saved.\n
+
+    `app_config` : dict
+        contents of `app_config.json` at the time the recipe was saved.\n
+
+    `masks` : dict
+        ROI name -> compiled uint8 mask (see `image_processing.compile_masks`).\n
+
+    `mask_size` : Int
+        side of the square centre of the camera frame the masks were compiled for (None for recipes from before normalised ROIs).\n
+
+    '''
+    def __init__(self, name, config, app_config, masks, created=None, mapping=None, mask_size=None):
+        self.name = name
+        self.config = config
+        self.app_config = app_config
+        self.masks = masks
+        self.mask_size = mask_size
+        self.created = created
+        self._mapping = mapping
+
+    def masks_for(self, config, size):
+        '''
+        Definition:
+        -----------
+        Returns the masks that are still valid for `config` analysed on a `size` x `size` frame centre,
+        i.e. of ROIs whose coordinates and shape are unchanged since the recipe was saved.\n
+        '''
+        if size != self.mask_size:
+            return {}
+        return {key: mask for key, mask in self.masks.items()
+                if key in config and all(config[key].get(name) == self.config[key].get(name) for name in ('normalised', 'shape', 'holes'))}
+
+def recipe_path(name, folder=None):
+    folder = style.RECIPE_FOLDER if folder is None else folder
+    return os.path.join(folder, name + RECIPE_EXTENSION)
+
+def _aligned(offset):
+    return (offset + RECIPE_ALIGNMENT - 1)//RECIPE_ALIGNMENT*RECIPE_ALIGNMENT
+
+def save_recipe(name, config, app_config, folder=None, mask_size=None):
+    """
+    Definition:
+    -----------
+    Function compiles the ROI masks of a calibration and stores everything as a recipe file (atomically).\n
+
+    Attributes:
+    -----------
+    `name` : String
+        name of the product, used as filename.\n
+
+    `config` : dict
+        contents of `config.json` (ROI coordinates, reference colors).\n
+
+    `app_config` : dict
+        contents of `app_config.json` (error-margin).\n
+
+    `mask_size` : Int
+        side of the square centre of the run-mode camera frame, default that of `style.CAPTURE_DEFAULT_MODE`.\n
+
+    Returns:
+    --------
+    `filename` : String
+        filepath and filename of the recipe
+    """
+    if name == '' or os.sep in name or name.startswith('.'):
+        raise ValueError('invalid recipe name: {!r}'.format(name))
+
+    mask_size = min(style.CAPTURE_DEFAULT_MODE) if mask_size is None else int(mask_size)
+    masks = img_proc.compile_masks(img_proc.scale_config(config, mask_size))
+    app_config = {key: value for key, value in app_config.items() if key != 'recipe'}
+
+    # [NOTE EXPLANATION] Lay masks out one after the other, then write header with their offsets.
+    layout, offset = {}, 0
+    for key, mask in masks.items():
+        layout[key] = {'offset': offset, 'shape': list(mask.shape)}
+        offset = _aligned(offset + mask.size)
+    header = json.dumps({   'name'       : name,
+                            'created'    : time.time(),
+                            'app_config' : app_config,
+                            'config'     : config,
+                            'mask_size'  : mask_size,
+                            'masks'      : layout}).encode()
+    data_start = _aligned(len(RECIPE_MAGIC) + 4 + len(header))
+
+    payload = bytearray(data_start + offset)
+    payload[0:len(RECIPE_MAGIC)] = RECIPE_MAGIC
+    payload[len(RECIPE_MAGIC):len(RECIPE_MAGIC) + 4] = struct.pack('<I', len(header))
+    payload[len(RECIPE_MAGIC) + 4:len(RECIPE_MAGIC) + 4 + len(header)] = header
+    for key, mask in masks.items():
+        start = data_start + layout[key]['offset']
+        payload[start:start + mask.size] = numpy.ascontiguousarray(mask, numpy.uint8).tobytes()
+
+    filename = recipe_path(name, folder)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    config_store.write_atomic(filename, bytes(payload))
+    return filename
+
+def load_recipe(name, folder=None):
+    """
+    Definition:
+    -----------
+    Function memory-maps a recipe file and returns it as a `recipe` object.\n
+    Loaded recipes are kept (and their files kept mapped), so loading the same recipe again costs only a stat.\n
+
+    Attributes:
+    -----------
+    `name` : String
+        name of the product.\n
+
+    Returns:
+    --------
+    `recipe` : recipe
+        the loaded recipe
+    """
+    filename = recipe_path(name, folder)
+    stat = os.stat(filename)
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        entry = _loaded.get(filename)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+
+    with open(filename, 'rb') as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        file.close()
+
+    if mapping[0:len(RECIPE_MAGIC)] != RECIPE_MAGIC:
+        mapping.close()
+        raise ValueError('{} is not a recipe file'.format(filename))
+    header_length = struct.unpack('<I', mapping[len(RECIPE_MAGIC):len(RECIPE_MAGIC) + 4])[0]
+    header = json.loads(mapping[len(RECIPE_MAGIC) + 4:len(RECIPE_MAGIC) + 4 + header_length].decode())
+    data_start = _aligned(len(RECIPE_MAGIC) + 4 + header_length)
+
+    # [NOTE EXPLANATION] Masks are zero-copy views into the mapped file.
+    masks = {}
+    for key, layout in header['masks'].items():
+        height, width = layout['shape']
+        masks[key] = numpy.frombuffer(mapping, numpy.uint8, count=height*width, offset=data_start + layout['offset']).reshape(height, width)
+
+    loaded = recipe(header['name'], header['config'], header['app_config'], masks, header.get('created'), mapping, header.get('mask_size'))
+    with _lock:
+        _loaded[filename] = (signature, loaded)
+    return loaded
+
+def list_recipes(folder=None):
+    """
+    Definition:
+    -----------
+    Function returns the names of all recipes in the recipe folder, sorted alphabetically.\n
+    """
+    folder = style.RECIPE_FOLDER if folder is None else folder
+    if not os.path.isdir(folder):
+        return []
+    return sorted(filename[:-len(RECIPE_EXTENSION)] for filename in os.listdir(folder) if filename.endswith(RECIPE_EXTENSION))
+
+def save_current_as_recipe(name, mask_size=None):
+    """
+    Definition:
+    -----------
+    Function stores the current calibration (`style.JSON_FILE` and `style.APP_CONFIG_JSON`) as a recipe and marks it active.\n
+    Masks are compiled for a camera frame centre of `mask_size` pixels (see `save_recipe`).\n
+    """
+    global _active
+    filename = save_recipe(name, config_store.read_json(style.JSON_FILE), config_store.read_json(style.APP_CONFIG_JSON), mask_size=mask_size)
+    _active = load_recipe(name)
+    app_config = dict(config_store.read_json(style.APP_CONFIG_JSON))
+    app_config['recipe'] = name
+    config_store.write_json(style.APP_CONFIG_JSON, app_config)
+    return filename
+
+def activate_recipe(name):
+    """
+    Definition:
+    -----------
+    Function switches the station to another product: the recipe is loaded (memory-mapped) and becomes the current calibration.\n
+    `style.JSON_FILE` and `style.APP_CONFIG_JSON` are rewritten from the recipe, so every other part of the application follows.\n
+    Camera is never touched.\n
+
+    Returns:
+    --------
+    `recipe` : recipe
+        the activated recipe
+    """
+    global _active
+    loaded = load_recipe(name)
+    app_config = copy.deepcopy(loaded.app_config)
+    app_config['recipe'] = loaded.name
+    config_store.write_json(style.JSON_FILE, copy.deepcopy(loaded.config))
+    config_store.write_json(style.APP_CONFIG_JSON, app_config)
+    _active = loaded
+    return loaded
+
+def active_recipe():
+    """
+    Definition:
+    -----------
+    Function returns the active recipe, or None if the current calibration was never stored as a recipe.\n
+    After a restart, the recipe named in `style.APP_CONFIG_JSON` is loaded again.\n
+    """
+    global _active
+    if _active is None:
+        try:
+            name = config_store.read_json(style.APP_CONFIG_JSON).get('recipe')
+            if name is not None: _active = load_recipe(name)
+        except (OSError, ValueError):
+            _active = None
+    return _active
+
+def active_masks(config, size):
+    """
+    Definition:
+    -----------
+    Function returns the compiled masks of the active recipe that are valid for `config` on a `size` x `size` frame centre
+    (empty dict if there is no active recipe).\n
+    """
+    loaded = active_recipe()
+    return loaded.masks_for(config, size) if loaded is not None else {}
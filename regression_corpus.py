@@ -0,0 +1,264 @@
+#! /usr/bin/python3
+
+# ===================================================================================
+# Golden corpus of inspections, and a scorecard of color estimators against it.
+# A corpus is a folder (default CORPUS_FOLDER, next to the calibration files) holding:
+#   config.json     : ROIs with their reference colors, as data_log/config.json (normalised vertices)
+#   app_config.json : error margin and white patch, as data_log/app_config.json
+#   frames/         : camera frames at native resolution (.bmp)
+#   expected.json   : frame name -> expected output, as data_log/output.json (mean_color, error, success_status per ROI)
+# Recording takes the verdicts of the current `compare_colors` path, expected.json may be corrected by hand afterwards.
+#   python3 regression_corpus.py record --frames captures/ [--config config.json --app-config app_config.json]
+#   python3 regression_corpus.py score [--scales 1 0.5 0.25 --repeat 3 --csv scorecard.csv]
+# Every estimator x resolution is scored on verdict agreement, color error and latency percentiles, then the
+# Pareto front (nothing else is both faster and agrees more) is marked and the fastest lossless configuration named.
+# ===================================================================================
+
+import argparse, os, glob, time, csv
+import numpy
+import cv2 as cv
+import style
+import config_store
+import image_processing as img_proc
+import metrics
+
+CONFIG_FILE = 'config.json'
+APP_CONFIG_FILE = 'app_config.json'
+EXPECTED_FILE = 'expected.json'
+FRAME_FOLDER = 'frames'
+FRAME_EXTENSION = '.bmp'
+
+# [NOTE EXPLANATION] Estimators of `image_processing.inspect_frame`: name -> value of its `quick` argument.
+ESTIMATORS = {  'kmeans'    : False,     # NOTE production path: K-means dominant color (or palette, where calibrated)
+                'mean'      : True}      # NOTE plain mean color inside the ROI (see `estimate_mean_colors`)
+SCALES = (1.0, 0.5, 0.25, 0.125)
+
+def use_corpus(folder):
+    '''
+    Definition:
+    -----------
+    Function points `style` at the app-config of the corpus, so that its error margin and white patch apply, and stops image dumps.\n
+    '''
+    style.APP_CONFIG_JSON = os.path.join(folder, APP_CONFIG_FILE)
+    style.CREATE_FILES = False
+
+def record(folder, frames, config_file, app_config_file, legacy_size=None):
+    '''
+    Definition:
+    -----------
+    Function creates (or extends) a corpus: frames are stored with the verdicts of the current `compare_colors` path as expected output.\n
+
+    Attributes:
+    -----------
+    `folder` : String
+        corpus folder.\n
+
+    `frames` : iterable
+        B-G-R camera frames.\n
+
+    `config_file`, `app_config_file` : String
+        calibration to record with, copied into a new corpus (legacy pixel ROIs are converted to normalised vertices).\n
+        An existing corpus keeps its own calibration.\n
+
+    `legacy_size` : Int
+        side of the square legacy (pixel) ROI coordinates were drawn on, default the square side of the first frame.\n
+
+    Returns:
+    --------
+    `count` : Int
+        number of frames recorded
+    '''
+    os.makedirs(os.path.join(folder, FRAME_FOLDER), exist_ok=True)
+    corpus_config = os.path.join(folder, CONFIG_FILE)
+    expected_file = os.path.join(folder, EXPECTED_FILE)
+    expected = dict(config_store.read_json(expected_file)) if os.path.exists(expected_file) else {}
+
+    # [NOTE EXPLANATION] A corpus keeps the calibration it was started with, further frames are recorded against it.
+    config = config_store.read_json(corpus_config) if len(expected) > 0 else None
+    if config is None:
+        config_store.write_json(os.path.join(folder, APP_CONFIG_FILE), config_store.read_json(app_config_file))
+    use_corpus(folder)
+
+    count = 0
+    for frame in frames:
+        if config is None:
+            # [NOTE EXPLANATION] Corpus must not depend on the screen it was drawn on, so every ROI is stored normalised.
+            legacy_size = legacy_size or img_proc.square_geometry(frame.shape)[0]
+            config = {}
+            for key, ROI in config_store.read_json(config_file).items():
+                config[key] = {name: value for name, value in ROI.items() if name not in ('coordinates', 'extremes_of_ROI')}
+                if 'normalised' not in ROI:
+                    config[key]['normalised'] = img_proc.normalise_coordinates(ROI['coordinates'], legacy_size)
+            config_store.write_json(corpus_config, config)
+
+        name = 'frame_{:05d}{}'.format(len(expected) + 1, FRAME_EXTENSION)
+        cv.imwrite(os.path.join(folder, FRAME_FOLDER, name), frame)
+        expected[name] = img_proc.inspect_frame(frame, corpus_config, None, folder, scale=1.0)
+        count = count + 1
+
+    config_store.write_json(expected_file, expected)
+    return count
+
+def image_frames(pattern):
+    for filename in sorted(glob.glob(pattern)):
+        frame = cv.imread(filename, cv.IMREAD_COLOR)
+        if frame is not None:
+            yield frame
+
+def video_frames(filename, every=1):
+    capture = cv.VideoCapture(filename)
+    index = 0
+    while True:
+        ret, frame = capture.read()
+        if ret == False: break
+        if index % every == 0:
+            yield frame
+        index = index + 1
+    capture.release()
+
+def score_configuration(folder, frames, expected, quick, scale, repeat):
+    '''
+    Definition:
+    -----------
+    Function runs every corpus frame through `inspect_frame` with one estimator and resolution, and compares with the expected output.\n
+
+    Returns:
+    --------
+    `row` : dict
+        {'roi_agreement', 'part_agreement', 'false_rejects', 'false_accepts', 'color_error_mean', 'color_error_max', 'p50_ms', 'p95_ms', 'p99_ms', 'resize_p50_ms'}
+        \n
+        latencies include shrinking the ROI box, resize_p50_ms is that share alone (0 at scale 1)\n
+    '''
+    config_file = os.path.join(folder, CONFIG_FILE)
+    # [NOTE EXPLANATION] Warm-up run, so that pools and caches are not part of the measurement.
+    img_proc.inspect_frame(frames[0][1], config_file, None, folder, quick=quick, scale=scale)
+    metrics.reset()
+
+    timings, color_errors = [], []
+    rois, roi_agreements, parts, part_agreements, false_rejects, false_accepts = 0, 0, 0, 0, 0, 0
+    for name, frame in frames:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = img_proc.inspect_frame(frame, config_file, None, folder, quick=quick, scale=scale)
+            timings.append(time.perf_counter() - start)
+
+        for key in expected[name]:
+            rois = rois + 1
+            roi_agreements = roi_agreements + (output[key]['success_status'] == expected[name][key]['success_status'])
+            color_errors.append(img_proc.color_error(expected[name][key]['mean_color'], output[key]['mean_color']))
+
+        # [NOTE EXPLANATION] Part verdict is what the reject gate acts on: pass only if every ROI passes.
+        expected_pass = all(expected[name][key]['success_status'] == True for key in expected[name])
+        measured_pass = all(output[key]['success_status'] == True for key in expected[name])
+        parts = parts + 1
+        part_agreements = part_agreements + (expected_pass == measured_pass)
+        if expected_pass == True and measured_pass == False: false_rejects = false_rejects + 1
+        if expected_pass == False and measured_pass == True: false_accepts = false_accepts + 1
+
+    p50, p95, p99 = 1000*numpy.percentile(timings, [50, 95, 99])
+    resize = metrics.snapshot()['timings_ms'].get('analysis_resize', {'p50': 0.0})
+    return {'roi_agreement'     : round(100.0*roi_agreements/max(rois, 1), 2),
+            'part_agreement'    : round(100.0*part_agreements/max(parts, 1), 2),
+            'false_rejects'     : false_rejects,
+            'false_accepts'     : false_accepts,
+            'color_error_mean'  : round(float(numpy.mean(color_errors)), 2) if len(color_errors) > 0 else 0.0,
+            'color_error_max'   : round(float(numpy.max(color_errors)), 2) if len(color_errors) > 0 else 0.0,
+            'p50_ms'            : round(float(p50), 2),
+            'p95_ms'            : round(float(p95), 2),
+            'p99_ms'            : round(float(p99), 2),
+            'resize_p50_ms'     : resize['p50']}
+
+def pareto_front(rows):
+    '''
+    Definition:
+    -----------
+    Function marks the rows no other row dominates, i.e. none is at least as fast (p95) and agrees at least as often (per ROI), and is better in one.\n
+    '''
+    for row in rows:
+        row['pareto'] = not any(other['p95_ms'] <= row['p95_ms'] and other['roi_agreement'] >= row['roi_agreement'] and
+                                (other['p95_ms'] < row['p95_ms'] or other['roi_agreement'] > row['roi_agreement']) for other in rows)
+    return rows
+
+def score(folder, scales=SCALES, estimators=None, repeat=1, csv_file=None):
+    '''
+    Definition:
+    -----------
+    Function scores every estimator x resolution on the corpus, prints the scorecard (fastest first) and the fastest lossless configuration.\n
+
+    Returns:
+    --------
+    `rows` : list
+        one dict per configuration, see `score_configuration`, plus 'estimator', 'scale' and 'pareto'
+    '''
+    use_corpus(folder)
+    expected = config_store.read_json(os.path.join(folder, EXPECTED_FILE))
+    frames = [(name, cv.imread(os.path.join(folder, FRAME_FOLDER, name), cv.IMREAD_COLOR)) for name in sorted(expected)]
+    frames = [(name, frame) for name, frame in frames if frame is not None]
+    if len(frames) == 0:
+        raise SystemExit('no frames in {}, record some first'.format(folder))
+
+    rows = []
+    for estimator in (ESTIMATORS if estimators is None else estimators):
+        for scale in scales:
+            row = {'estimator': estimator, 'scale': scale}
+            row.update(score_configuration(folder, frames, expected, ESTIMATORS[estimator], scale, repeat))
+            rows.append(row)
+    rows = sorted(pareto_front(rows), key=lambda row: row['p95_ms'])
+
+    print('{} frames, {} ROIs each, {} run(s) per frame'.format(len(frames), len(expected[frames[0][0]]), repeat))
+    print('{:>9} {:>6} {:>10} {:>10} {:>8} {:>8} {:>10} {:>9} {:>9} {:>9} {:>12} {:>7}'.format(
+          'estimator', 'scale', 'ROI agr.%', 'part agr.%', 'f.rej.', 'f.acc.', 'err mean', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]', 'resize [ms]', 'pareto'))
+    for row in rows:
+        print('{:>9} {:>6} {:>10.2f} {:>10.2f} {:>8} {:>8} {:>10.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>12.2f} {:>7}'.format(
+              row['estimator'], row['scale'], row['roi_agreement'], row['part_agreement'], row['false_rejects'], row['false_accepts'],
+              row['color_error_mean'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['resize_p50_ms'], '*' if row['pareto'] == True else ''))
+
+    lossless = [row for row in rows if row['roi_agreement'] == 100.0]
+    if len(lossless) > 0:
+        print('fastest configuration keeping every verdict: estimator {}, scale {} (p95 {:.2f} ms)'.format(
+              lossless[0]['estimator'], lossless[0]['scale'], lossless[0]['p95_ms']))
+    else:
+        print('no configuration keeps every verdict')
+
+    if csv_file:
+        with open(csv_file, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Golden corpus and accuracy-vs-speed scorecard of the color estimators.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('record', help='add frames to the corpus, with the verdicts of the current path as expected output')
+    command.add_argument('--folder', default=style.CORPUS_FOLDER)
+    command.add_argument('--frames', default='', help='folder of frames (.bmp/.png/.jpg)')
+    command.add_argument('--video', default='', help='recorded footage, instead of --frames')
+    command.add_argument('--every', type=int, default=1, help='keep every n-th frame of the footage')
+    command.add_argument('--config', default=style.JSON_FILE)
+    command.add_argument('--app-config', default=style.APP_CONFIG_JSON)
+    command.add_argument('--legacy-size', type=int, default=0, help='screen height legacy pixel ROIs were drawn on')
+
+    command = commands.add_parser('score', help='score every estimator and resolution against the corpus')
+    command.add_argument('--folder', default=style.CORPUS_FOLDER)
+    command.add_argument('--scales', type=float, nargs='+', default=list(SCALES))
+    command.add_argument('--estimators', nargs='+', choices=list(ESTIMATORS), default=list(ESTIMATORS))
+    command.add_argument('--repeat', type=int, default=1, help='runs per frame, for the latency percentiles')
+    command.add_argument('--csv', default='', help='also write the scorecard to this file')
+
+    arguments = parser.parse_args()
+    if arguments.command == 'record':
+        if arguments.video:
+            frames = video_frames(arguments.video, max(arguments.every, 1))
+        elif arguments.frames:
+            frames = (frame for pattern in ('*.bmp', '*.png', '*.jpg') for frame in image_frames(os.path.join(arguments.frames, pattern)))
+        else:
+            raise SystemExit('give --frames or --video')
+        count = record(arguments.folder, frames, arguments.config, arguments.app_config, arguments.legacy_size or None)
+        print('{} frames recorded into {}'.format(count, arguments.folder))
+    else:
+        score(arguments.folder, arguments.scales, arguments.estimators, arguments.repeat, arguments.csv or None)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import time, sys, types
+import numpy
+import cv2 as cv
+import style
+
+class simulated_camera:
+    '''
+    Definition:
+    -----------
+    Class is a stand-in for `cv.VideoCapture`, used when no USB camera is connected (testing, soak-runs, localhost API).\n
+    Class offers the same methods the application uses: isOpened(), read(), grab(), retrieve(), set(), get() and release().\n
+    Frames are either taken from a list of images (cycled) or generated: a flat background with colored patches and some sensor noise.\n
+
+    Attributes:
+    -----------
+    `frames` : list of numpy arrays or list of Strings
+        B-G-R frames, or filepaths of images, to be played back in a loop. Generated frames are used if empty.\n
+
+    `width`, `height` : Int
+        size of generated frames (in pixels).\n
+
+    `fps` : Float
+        frame rate of the simulated camera. Reads block until the next frame is due if `realtime` is True.\n
+
+    `realtime` : bool
+        True behaves like a real camera, False returns frames immediately.\n
+        A real camera exposes frames at the frame rate, whether they are read or not, and its driver keeps the last `buffer_depth` of them.\n
+        grab() then returns the oldest buffered frame at once (possibly stale), and only waits if the buffer is empty.\n
+        `frame_time` holds the `time.monotonic()` at which the last grabbed frame was exposed, to check frame age.\n
+
+    `buffer_depth` : Int
+        driver buffer depth in realtime mode, changed via `set(cv.CAP_PROP_BUFFERSIZE, ..)`.\n
+
+    '''
+    def __init__(self, frames=None, width=640, height=480, fps=style.VIDEO_STREAM_FPS, realtime=False, seed=0, buffer_depth=4):
+        self.frames = [cv.imread(frame) if isinstance(frame, str) else frame for frame in (frames or [])]
+        self.width = width
+        self.height = height
+        self.fps = float(fps)
+        self.realtime = realtime
+        self.frame_index = 0
+        self.opened = True
+        self.random = numpy.random.default_rng(seed)
+        self.buffer_depth = buffer_depth
+        self.start_time = time.monotonic()
+        self.next_exposure = 0
+        self.frame_time = None
+        self.properties = {cv.CAP_PROP_FOURCC: cv.VideoWriter_fourcc(*'YUYV')}
+
+    def _generate_frame(self):
+        # [NOTE EXPLANATION] Background plus a few colored patches, with mild noise so that no two frames are equal.
+        frame = numpy.full((self.height, self.width, 3), (160, 164, 159), numpy.uint8)
+        frame[self.height//4: 3*self.height//4, self.width//8: 3*self.width//8] = (81, 115, 133)
+        frame[self.height//4: 3*self.height//4, 5*self.width//8: 7*self.width//8] = (60, 99, 146)
+        noise = self.random.integers(-3, 4, size=frame.shape, dtype=numpy.int16)
+        return numpy.clip(frame.astype(numpy.int16) + noise, 0, 255).astype(numpy.uint8)
+
+    def _next_frame(self):
+        if len(self.frames) == 0:
+            return self._generate_frame()
+        frame = self.frames[self.frame_index % len(self.frames)]
+        self.frame_index = self.frame_index + 1
+        return frame.copy()
+
+    def isOpened(self):
+        return self.opened
+
+    def grab(self):
+        if self.opened == False: return False
+        if self.realtime == True:
+            # [NOTE EXPLANATION] Frames exposed so far; older ones than the buffer holds were dropped by the driver.
+            exposed = int((time.monotonic() - self.start_time)*self.fps) + 1
+            self.next_exposure = max(self.next_exposure, exposed - self.buffer_depth)
+            if self.next_exposure >= exposed:
+                time.sleep(max(0.0, self.start_time + self.next_exposure/self.fps - time.monotonic()))
+            self.frame_time = self.start_time + self.next_exposure/self.fps
+            self.next_exposure = self.next_exposure + 1
+        else:
+            self.frame_time = time.monotonic()
+        self.grabbed = self._next_frame()
+        return True
+
+    def retrieve(self):
+        if self.opened == False or getattr(self, 'grabbed', None) is None: return False, None
+        frame, self.grabbed = self.grabbed, None
+        return True, frame
+
+    def read(self):
+        if self.grab() == False: return False, None
+        return self.retrieve()
+
+    def set(self, prop_id, value):
+        self.properties[prop_id] = value
+        if prop_id == cv.CAP_PROP_FPS: self.fps = float(value)
+        if prop_id == cv.CAP_PROP_BUFFERSIZE: self.buffer_depth = max(1, int(value))
+        if prop_id == cv.CAP_PROP_FRAME_WIDTH and len(self.frames) == 0: self.width = int(value)
+        if prop_id == cv.CAP_PROP_FRAME_HEIGHT and len(self.frames) == 0: self.height = int(value)
+        return True
+
+    def get(self, prop_id):
+        if prop_id == cv.CAP_PROP_FRAME_WIDTH: return float(self.width)
+        if prop_id == cv.CAP_PROP_FRAME_HEIGHT: return float(self.height)
+        if prop_id == cv.CAP_PROP_FPS: return self.fps
+        if prop_id == cv.CAP_PROP_BUFFERSIZE: return float(self.buffer_depth)
+        return float(self.properties.get(prop_id, 0))
+
+    def release(self):
+        self.opened = False
+
+class simulated_gpio:
+    '''
+    Definition:
+    -----------
+    Class is a stand-in for the `RPi.GPIO` module, used when the application runs on a machine without GPIO pins.\n
+    Outputs are remembered (and can be inspected), edges on inputs are simulated with `trigger_edge`.\n
+
+    '''
+    BOARD, BCM = 10, 11
+    IN, OUT = 1, 0
+    LOW, HIGH = 0, 1
+    RISING, FALLING, BOTH = 31, 32, 33
+    PUD_OFF, PUD_DOWN, PUD_UP = 20, 21, 22
+
+    def __init__(self):
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self.callbacks = {}
+        self.history = []
+
+    def setmode(self, mode): self.mode = mode
+    def setwarnings(self, flag): pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=LOW):
+        self.directions[pin] = direction
+        self.levels[pin] = initial
+
+    def output(self, pin, value):
+        self.levels[pin] = int(bool(value))
+        self.history.append((time.monotonic(), pin, self.levels[pin]))
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self, pin=None):
+        self.callbacks.clear()
+
+    def trigger_edge(self, pin):
+        '''
+        Definition:
+        -----------
+        Simulates a rising edge on an input pin, the registered callback is called on the calling thread.\n
+        '''
+        callback = self.callbacks.get(pin)
+        if callback is not None: callback(pin)
+
+def install_simulated_gpio():
+    '''
+    Definition:
+    -----------
+    Makes `import RPi.GPIO` resolve to a `simulated_gpio` when the real module is not installed.\n
+    Must be called before `main.py` is imported. Returns the GPIO object in use (real or simulated).\n
+    '''
+    try:
+        import RPi.GPIO as GPIO
+        return GPIO
+    except (ImportError, RuntimeError):
+        pass
+    gpio = simulated_gpio()
+    package = types.ModuleType('RPi')
+    package.GPIO = gpio
+    sys.modules['RPi'] = package
+    sys.modules['RPi.GPIO'] = gpio
+    return gpio
@@ -0,0 +1,166 @@
+#! /usr/bin/python3
+
+# ===================================================================================
+# Long-run soak-test of run-mode: drives the inspect / run-again cycle of `run_device`
+# thousands of times against a simulated camera and GPIO, on a virtual display if needed.
+# Fails (exit code 1) if memory, object counts, canvas items or latency trend upward.
+#   python3 soak.py --cycles 5000 --csv soak.csv
+# ===================================================================================
+
+import argparse, os, sys, shutil, tempfile, subprocess, time, gc, tracemalloc, csv
+import style
+import simulation
+
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_log')
+
+# [NOTE EXPLANATION] Allowed growth of every metric over the whole measured run (after warm-up).
+TOLERANCES = {  'rss_mb'        : 8.0,
+                'traced_mb'     : 2.0,
+                'gc_objects'    : 2000,
+                'canvas_items'  : 0.5,
+                'widgets'       : 0.5,
+                'latency_ms'    : None}     # NOTE relative, set from --latency-growth
+
+def start_virtual_display():
+    '''
+    Definition:
+    -----------
+    Function starts an Xvfb virtual display if no display is available, and returns its process (or None).\n
+    '''
+    if os.environ.get('DISPLAY'):
+        return None
+    display = ':{}'.format(90 + os.getpid() % 500)
+    process = subprocess.Popen(['Xvfb', display, '-screen', '0', '1024x768x24', '-nolisten', 'tcp'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ['DISPLAY'] = display
+    time.sleep(1.0)
+    return process
+
+def prepare_data_folder():
+    '''
+    Definition:
+    -----------
+    Function copies the calibration files into a temporary folder and points `style` at it, so the soak-run never touches real data.\n
+    '''
+    folder = tempfile.mkdtemp(prefix='cake_soak_')
+    for filename in ('config.json', 'app_config.json'):
+        shutil.copy(os.path.join(DATA_FOLDER, filename), folder)
+    style.JSON_FILE = os.path.join(folder, 'config.json')
+    style.APP_CONFIG_JSON = os.path.join(folder, 'app_config.json')
+    style.OUTPUT_FILE = os.path.join(folder, 'output.json')
+    style.REALTIME_IMAGE = os.path.join(folder, 'realtime_image.bmp')
+    style.REFERENCE_IMAGE = os.path.join(folder, 'reference_image.bmp')
+    style.MASK_IMAGE_PATH = folder + os.sep
+    style.RECIPE_FOLDER = os.path.join(folder, 'recipes')
+    style.PROFILE_FOLDER = os.path.join(folder, 'profiles')
+    style.SPC_FILE = os.path.join(folder, 'process_control.json')
+    return folder
+
+def rss_megabytes():
+    with open('/proc/self/statm', 'r') as file:
+        resident_pages = int(file.read().split()[1])
+    return resident_pages*os.sysconf('SC_PAGE_SIZE')/(1024*1024)
+
+def slope(values):
+    # [NOTE EXPLANATION] Least-squares slope of the samples, per sample.
+    count = len(values)
+    if count < 2: return 0.0
+    mean_x, mean_y = (count - 1)/2, sum(values)/count
+    numerator = sum((index - mean_x)*(value - mean_y) for index, value in enumerate(values))
+    denominator = sum((index - mean_x)**2 for index in range(count))
+    return numerator/denominator
+
+def run_soak(cycles, sample_every, warmup, latency_growth, csv_file):
+    '''
+    Definition:
+    -----------
+    Function drives `cycles` inspect / run-again cycles, samples resource usage every `sample_every` cycles and checks trends.\n
+
+    Returns:
+    --------
+    `passed` : bool
+        True if no metric grew beyond its tolerance after the warm-up cycles
+    '''
+    simulation.install_simulated_gpio()
+    import tkinter as tk
+    import main as app
+
+    # [NOTE EXPLANATION] xrandr is not available on every virtual display, ROIs need atleast 768 px.
+    if app.screen_readstatus == False or app.screen_height < 768:
+        app.screen_width, app.screen_height = 1024, 768
+    app.open_camera = lambda config=None: simulation.simulated_camera(width=640, height=480)
+
+    root = tk.Tk()
+    root.withdraw()
+    app.start_process_control()
+    page = app.run_device()
+    tracemalloc.start()
+
+    samples = []
+    for cycle in range(cycles):
+        root.update()
+        start = time.perf_counter()
+        page.take_picture_now()
+        latency = time.perf_counter() - start
+        root.update()
+        page.run_again()
+        root.update()
+
+        if cycle % sample_every == 0:
+            gc.collect()
+            samples.append({'cycle'         : cycle,
+                            'rss_mb'        : rss_megabytes(),
+                            'traced_mb'     : tracemalloc.get_traced_memory()[0]/(1024*1024),
+                            'gc_objects'    : len(gc.get_objects()),
+                            'canvas_items'  : len(page.video_canvas.find_all()),
+                            'widgets'       : len(page.video_canvas.winfo_children()),
+                            'latency_ms'    : 1000*latency})
+            print('cycle {:>6}  rss {:7.1f} MB  traced {:6.2f} MB  objects {:>7}  canvas-items {:>4}  latency {:7.1f} ms'.format(
+                  cycle, samples[-1]['rss_mb'], samples[-1]['traced_mb'], samples[-1]['gc_objects'],
+                  samples[-1]['canvas_items'], samples[-1]['latency_ms']))
+
+    page.go_back()
+    root.destroy()
+
+    if csv_file:
+        with open(csv_file, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(samples[0].keys()))
+            writer.writeheader()
+            writer.writerows(samples)
+            file.close()
+
+    # [NOTE EXPLANATION] Project the trend of every metric over the measured run and compare with its tolerance.
+    measured = [sample for sample in samples if sample['cycle'] >= warmup]
+    passed = True
+    print('\n{:<14} {:>12} {:>12}  verdict'.format('metric', 'growth', 'allowed'))
+    for metric, allowed in TOLERANCES.items():
+        values = [sample[metric] for sample in measured]
+        growth = slope(values)*(len(values) - 1) if len(values) > 1 else 0.0
+        if metric == 'latency_ms':
+            allowed = latency_growth*(sum(values)/len(values) if values else 0.0)
+        verdict = 'ok' if growth <= allowed else 'TRENDING UP'
+        passed = passed and growth <= allowed
+        print('{:<14} {:>12.2f} {:>12.2f}  {}'.format(metric, growth, allowed, verdict))
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak-test of run-mode with a simulated camera.')
+    parser.add_argument('--cycles', type=int, default=2000)
+    parser.add_argument('--sample-every', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=200, help='cycles ignored for trend analysis')
+    parser.add_argument('--latency-growth', type=float, default=0.25, help='allowed latency growth, as fraction of its mean')
+    parser.add_argument('--csv', default='', help='write per-sample metrics to this csv file')
+    arguments = parser.parse_args()
+
+    display = start_virtual_display()
+    folder = prepare_data_folder()
+    try:
+        passed = run_soak(arguments.cycles, arguments.sample_every, arguments.warmup, arguments.latency_growth, arguments.csv)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+        if display is not None: display.terminate()
+    print('\nSOAK TEST {}'.format('PASSED' if passed else 'FAILED'))
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
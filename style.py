@@ -4,6 +4,10 @@ REALTIME_IMAGE = '/home/pi/Desktop/cake_detection/data_log/realtime_image.bmp'
 JSON_FILE = '/home/pi/Desktop/cake_detection/data_log/config.json'
 OUTPUT_FILE = '/home/pi/Desktop/cake_detection/data_log/output.json'
 APP_CONFIG_JSON = '/home/pi/Desktop/cake_detection/data_log/app_config.json'
+RECIPE_FOLDER = '/home/pi/Desktop/cake_detection/data_log/recipes/'
+CATALOGUE_FILE = '/home/pi/Desktop/cake_detection/data_log/catalogue.json'
+SPC_FILE = '/home/pi/Desktop/cake_detection/data_log/process_control.json'
+CORPUS_FOLDER = '/home/pi/Desktop/cake_detection/data_log/corpus/'
 
 MASK_IMAGE_PATH = '/home/pi/Desktop/cake_detection/data_log/'
 CROPPED_IMAGE = '_cropped.bmp'
@@ -12,6 +16,7 @@ BLACK_BACKGROUND = '_blackmask.bmp'
 WHITE_BACKGROUND = '_whitemask.bmp'
 ISOLATED_ROI = '_isolated.bmp'
 CREATE_FILES = False
+CONFIG_RELOAD_INTERVAL = 1.0 #seconds
 
 PAGE_BACKGROUND = '#FFFFFF'
 COLOR_BLUE = '#2C4B8C'
@@ -27,14 +32,103 @@ RESULT_RED = '#FF0000'
 SHAPE_PIXEL_SIZE = 3
 SHAPE_FILL = '#BC2C2C'
 SHAPE_OUTLINE = '#00FF00'
+WHITE_PATCH_OUTLINE = '#FFFF00'
 
 FONT = 'Piboto'
 
 USB_CAMERA = 0
 VIDEO_STREAM_FPS = 30
+CAPTURE_MODES = [(320, 240), (640, 480), (800, 600), (1280, 720), (1920, 1080)]  # NOTE only those of the aspect ratio of CAPTURE_DEFAULT_MODE are used
+CAPTURE_FORMATS = ['MJPG', 'YUYV']
+CAPTURE_FORMAT_SAMPLES = 5
+CAPTURE_DEFAULT_MODE = (640, 480)  # NOTE mode the reference image is calibrated at
+CAPTURE_MIN_ROI_PIXELS = 16     # native pixels across the smallest ROI
+CAPTURE_FLUSH_FRAMES = 5        # most buffered frames discarded on trigger
 GPIO_CAMERA_TRIGGER_PIN = 12
+GPIO_REJECT_PIN = 16
+
+REJECT_ACTUATOR = False         # NOTE opt-in: drives GPIO_REJECT_PIN as output, pulsed at the gate by the deadline scheduler only
+REJECT_PULSE = 0.2              # seconds the reject actuator is held
+DEADLINE_SCHEDULER = False      # NOTE conveyor: keep streaming, inspect parts in deadline order and reject them at the gate
+REJECT_GATE_DELAY = 1.5         # seconds from trigger until the part reaches the reject gate
+REJECT_ON_MISS = True           # reject parts without a verdict at the gate (fail-safe)
+SCHEDULER_QUEUE = 8             # most parts waiting for analysis
+SCHEDULER_SAFETY = 0.05         # seconds, a verdict must be ready this long before the gate
+
+API_ENABLED = True
+API_HOST = '127.0.0.1'
+API_PORT = 8080
+API_STREAM_BACKLOG = 16
+API_TRIGGER_TIMEOUT = 10 #seconds
+API_START_TIMEOUT = 5 #seconds
+
+LIVE_SCORING = False            # NOTE approximate GREEN/RED indicator on the stream (plain mean colors), not the inspection verdict
+LIVE_SCORING_INTERVAL = 0.2 #seconds
 
 K_CLUSTER_SIZE = 2
+KMEANS_SEED = 0                 # NOTE random_state of the K-means clustering, same pixels always give the same colors
+COLOR_PALETTE = False           # NOTE calibrate a palette for every ROI, else only for ROIs with "use_palette": true in config.json
+PALETTE_SIZE = 3                # colors kept per palette
+
+PROPOSAL_SIZE = 128             # pixels, side of the downscaled reference image ROIs are proposed on
+PROPOSAL_COLORS = 6             # colors the reference image is quantised to
+PROPOSAL_MIN_AREA = 0.005       # fraction of the image, smaller regions are not proposed
+PROPOSAL_MAX_AREA = 0.4         # fraction of the image, larger regions (background) are not proposed
+PROPOSAL_EPSILON = 0.015        # polygon simplification, fraction of the region's perimeter
+PROPOSAL_MAX_ROIS = 12
+
+# SORTING_MODE = 'classify'     # NOTE assign every part to its nearest product variant of the catalogue
+SORTING_MODE = 'pass_fail'
+CLASSIFIER_KDTREE_MIN_CLASSES = 64
+
+QUALITY_GATE = True             # NOTE active only once calibrated (reference measured when the ROIs are selected), passes every frame before
+QUALITY_GATE_SIZE = 96          # pixels, width of the downscaled ROI union checked by the gate
+QUALITY_SHARPNESS_RATIO = 0.5   # fraction of the reference image's sharpness (variance of Laplacian) a frame must keep
+QUALITY_CLIPPED_MARGIN = 0.05   # fraction of saturated or black pixels a frame may have beyond the reference image
+QUALITY_MAX_MOTION = 8.0        # mean grey-level difference from previous frame
+QUALITY_RETRY_BUDGET = 0.5      # seconds
+
+PRESENCE_TRIGGER = False        # NOTE inspect automatically when a part has settled in front of the camera (no trigger sensor needed)
+PRESENCE_WIDTH = 64             # pixels, width the ROI union is shrunk to
+PRESENCE_ENTER = 12.0           # mean grey-level difference from background, part arriving
+PRESENCE_EXIT = 6.0             # mean grey-level difference from background, station empty again
+PRESENCE_SETTLE_MOTION = 2.0    # mean grey-level difference from previous frame, part at rest
+PRESENCE_SETTLE_FRAMES = 4      # frames at rest before the trigger fires
+PRESENCE_CLEAR_FRAMES = 4       # frames empty before the next part may fire
+PRESENCE_BACKGROUND_RATE = 0.05 # background learning rate while empty
+PRESENCE_BUDGET = 0.05          # fraction of the frame-interval the check may use
+
+LIGHTING_COMPENSATION = True
+LIGHTING_GAIN_LIMITS = (0.5, 2.0)
+LIGHTING_GAIN_STEP = 0.01
+
+ROI_WORKERS = 0             # 0 means one worker per CPU core, 1 processes ROIs one after the other
+ROI_POOL = 'thread'         # 'thread' or 'process'
+ROI_INNER_THREADS = 1       # BLAS/OpenMP threads inside every ROI worker
+ANALYSIS_SCALE = 1.0        # ROI box is shrunk by this factor before the clustering, pick with `regression_corpus.py score`
+
+ANALYSIS_WORKER = True          # analyse in a supervised child process (frames handed over via shared memory)
+ANALYSIS_RING_SLOTS = 2
+ANALYSIS_WORKER_TIMEOUT = 30    # seconds, a job taking longer restarts the child
+ANALYSIS_WORKER_RETRIES = 1     # times a job is run again after the child crashed
+ANALYSIS_POLL_INTERVAL = 5      # miliseconds
+
+PROFILE_FOLDER = '/home/pi/Desktop/cake_detection/data_log/profiles/'
+PROFILE_INSPECTIONS = 10        # inspections profiled once armed
+PROFILE_KEEP = 50               # captures kept, older ones are removed
+PROFILE_TRACEMALLOC_FRAMES = 10
+
+SPC_ENABLED = True
+SPC_BASELINE_SAMPLES = 30       # inspections used to establish the baseline of every ROI
+SPC_EWMA_LAMBDA = 0.2
+SPC_EWMA_L = 3.0                # width of the EWMA limit (sigma)
+SPC_CUSUM_K = 0.5               # CUSUM allowance (sigma)
+SPC_CUSUM_H = 5.0               # CUSUM decision interval (sigma)
+SPC_MIN_SIGMA = 0.1             # percent, floor of the baseline std
+SPC_PASS_WINDOW = 50            # inspections
+SPC_MIN_PASS_RATE = 0.9
+SPC_CHART_POINTS = 60
+SPC_SAVE_INTERVAL = 5.0         # seconds, statistics are stored at most this often (off the UI thread)
 
 # DEVICE_TESTING = 'development'
 DEVICE_TESTING = 'deployment'
@@ -0,0 +1,83 @@
+import os, sys, json, socket, threading, unittest, http.client
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import control_server
+
+class control_server_test(unittest.TestCase):
+    '''
+    Definition:
+    -----------
+    Exercises the trigger/result/health endpoints of `control_server.py` on localhost, without camera, UI or calibration files.\n
+    '''
+    def setUp(self):
+        self.triggers = 0
+        self.server = control_server.control_server(self.trigger, '127.0.0.1', 0)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def trigger(self):
+        # [NOTE EXPLANATION] Stands in for run-mode: every trigger is answered with a result from another thread.
+        self.triggers = self.triggers + 1
+        threading.Timer(0.05, self.server.publish_result, args=({'ROI1': {'mean_color': [1, 2, 3], 'error': 1.5, 'success_status': True}},)).start()
+        return True
+
+    def request(self, method, path):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.port, timeout=5)
+        try:
+            connection.request(method, path)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def test_health(self):
+        status, payload = self.request('GET', '/health')
+        self.assertEqual(status, 200)
+        self.assertEqual(payload['status'], 'ok')
+        self.assertTrue(payload['trigger_ready'])
+
+    def test_trigger_and_result(self):
+        status, payload = self.request('GET', '/result')
+        self.assertEqual(status, 404)
+
+        status, payload = self.request('POST', '/trigger?wait=1&timeout=5')
+        self.assertEqual(status, 200)
+        self.assertTrue(payload['passed'])
+        self.assertEqual(payload['rois']['ROI1']['error'], 1.5)
+        self.assertEqual(self.triggers, 1)
+
+        status, payload = self.request('GET', '/result')
+        self.assertEqual(status, 200)
+        self.assertEqual(payload['sequence'], 1)
+
+    def test_trigger_without_wait(self):
+        status, payload = self.request('POST', '/trigger')
+        self.assertEqual(status, 202)
+        self.assertTrue(payload['accepted'])
+
+    def test_bad_timeout(self):
+        status, payload = self.request('POST', '/trigger?wait=1&timeout=soon')
+        self.assertEqual(status, 400)
+        self.assertFalse(payload['accepted'])
+        self.assertEqual(self.triggers, 0)
+
+    def test_wrong_method(self):
+        status, _ = self.request('GET', '/trigger')
+        self.assertEqual(status, 405)
+
+    def test_port_in_use(self):
+        # [NOTE EXPLANATION] A taken port must raise in `start`, not hang it.
+        blocker = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        blocker.bind(('127.0.0.1', 0))
+        blocker.listen(1)
+        try:
+            server = control_server.control_server(None, '127.0.0.1', blocker.getsockname()[1])
+            with self.assertRaises(OSError):
+                server.start(timeout=5)
+        finally:
+            blocker.close()
+
+if __name__ == '__main__':
+    unittest.main()
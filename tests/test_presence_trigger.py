@@ -0,0 +1,40 @@
+import os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    import numpy
+    import presence_trigger
+    import benchmark
+except ImportError:
+    numpy = None
+
+@unittest.skipIf(numpy is None, 'needs numpy and OpenCV')
+class presence_trigger_test(unittest.TestCase):
+    '''
+    Definition:
+    -----------
+    Replays synthetic stream frames through `presence_trigger.py`: every part settling in front of the camera must fire exactly once.\n
+    '''
+    def setUp(self):
+        self.size = 240
+        self.config = benchmark.synthetic_config(4, self.size)
+
+    def replay(self, trigger, frames):
+        return sum(1 for frame in frames if trigger.observe(frame) == True)
+
+    def test_flat_part(self):
+        # [NOTE EXPLANATION] A part of one flat color differs from the belt only in brightness, it must not be taken for a lighting change.
+        trigger = presence_trigger.presence_trigger(self.config, self.size, 15)
+        belt = numpy.full((self.size, self.size, 3), 60, numpy.uint8)
+        part = numpy.full((self.size, self.size, 3), (200, 180, 150), numpy.uint8)
+        self.assertEqual(self.replay(trigger, [belt]*20 + [part]*40), 1)
+        self.assertEqual(trigger.state, presence_trigger.PRESENT)
+
+    def test_conveyor(self):
+        for flat in (False, True):
+            trigger = presence_trigger.presence_trigger(self.config, self.size, 15, {'white_patch': benchmark.conveyor_patch(self.size)})
+            frames = [frame for frame, _ in benchmark.conveyor_frames(self.size, 5, flat=flat)]
+            self.assertEqual(self.replay(trigger, frames), 5)
+
+if __name__ == '__main__':
+    unittest.main()